@@ -4,3 +4,8 @@ from melp.multithreading import *
 
 # libs
 from melp.libs.helices import *
+from melp.libs.histogram import *
+from melp.libs.results import *
+from melp.libs.treeloader import prepare_cache
+from melp.libs.cache import set_cache_dir
+from melp.libs.timing import set_timing
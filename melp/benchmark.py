@@ -0,0 +1,237 @@
+# import modules
+import melp
+import multiprocessing as mp
+import os
+import sys
+import json
+import time
+import hashlib
+import platform
+import resource
+import tempfile
+import argparse
+import subprocess
+import traceback
+import numpy as np
+from melp import multithreading as mt
+from melp.libs import treeloader as tl
+from melp.libs import synthetic as sy
+
+
+# analyses that are timed, single process and with run_mt
+METHODS    = ["hitAngleRec", "hitAngleHelix", "hitAnglePixelRec", "hitAngleTruth", "tileHitRateHID"]
+MT_METHODS = ["hitAngleRec", "tileHitRateHID"]
+
+
+#####################
+# private functions #
+#####################
+
+def _peak_rss(who):
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+
+    return rss if sys.platform == "darwin" else rss * 1024
+
+# ------------------------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+# ------------------------------------
+
+def _run_case(case, queue):
+    # runs one benchmark case in a fresh process, so the peak RSS belongs to this case only
+    try:
+        with tempfile.TemporaryDirectory(prefix="melp_benchmark_") as tmp:
+            # output files of the analyses go to the temporary directory
+            os.chdir(tmp)
+            start = time.perf_counter()
+            if case["workers"] == 0:
+                filename = case["files"][0]
+                if hasattr(melp.TileHitAngle, case["method"]):
+                    calls = melp.TileHitAngle(filename, "bench", chunk_size=case["chunk_size"])
+                    getattr(calls, case["method"])()
+                    accepted = len(calls.result_z)
+                else:
+                    calls = melp.TileHitRate(filename, "bench", "benchedep", chunk_size=case["chunk_size"])
+                    getattr(calls, case["method"])()
+                    accepted = len(calls.hits)
+            else:
+                result = mt.run_mt(case["method"], case["pattern"], reduce="concat", workers=case["workers"],
+                                   frames_per_unit=case["frames_per_unit"], min_free_memory=0, shared_geometry=True)
+                accepted = len(result)
+            elapsed = time.perf_counter() - start
+
+        queue.put({"elapsed": elapsed, "accepted": accepted,
+                   "peak_rss": _peak_rss(resource.RUSAGE_SELF), "peak_rss_workers": _peak_rss(resource.RUSAGE_CHILDREN)})
+    except BaseException:
+        queue.put({"error": traceback.format_exc()})
+
+# ------------------------------------
+
+def _measure(case):
+    context = mp.get_context("spawn")
+    queue   = context.Queue()
+    process = context.Process(target=_run_case, args=(case, queue))
+    process.start()
+    result  = queue.get()
+    process.join()
+    if "error" in result:
+        raise RuntimeError("benchmark " + case["method"] + " failed:\n" + result["error"])
+
+    return result
+
+# ------------------------------------
+
+def _print_results(run):
+    print("{:<18} {:>7} {:>10} {:>12} {:>12} {:>10}".format("method", "workers", "time [s]", "frames/s", "hits/s", "RSS [MB]"))
+    for r in run["results"]:
+        rss = max(r["peak_rss"], r["peak_rss_workers"]) / 2**20
+        print("{:<18} {:>7} {:>10.2f} {:>12.0f} {:>12.0f} {:>10.0f}".format(r["method"], r["workers"], r["elapsed"], r["frames_per_s"], r["hits_per_s"], rss))
+
+
+#####################
+# public  functions #
+#####################
+
+def synthetic_name(files, frames, tracks, tile_hits, pixel_hits, seed):
+    """ Common name of the synthetic files of one configuration, the files are name + "_0.root", name + "_1.root", ... """
+    config = json.dumps([files, frames, tracks, tile_hits, pixel_hits, seed])
+
+    return "synthetic_" + hashlib.sha1(config.encode()).hexdigest()[0:8]
+
+# ------------------------------------
+
+def generate_files(directory, files=2, frames=10000, tracks=4., tile_hits=1.5, pixel_hits=8., seed=0):
+    """
+        Writes files synthetic sorted ROOT files (see synthetic.write_sorted_file) to directory and returns their paths.
+        The file names hold a hash of the parameters, existing files with the same parameters are reused.
+    """
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, synthetic_name(files, frames, tracks, tile_hits, pixel_hits, seed) + "_" + str(i) + ".root")
+        if not os.path.exists(path):
+            # write to a temporary name, so an interrupted run leaves no incomplete file
+            tmp = os.path.join(directory, ".tmp_" + os.path.basename(path))
+            sy.write_sorted_file(tmp, frames, tracks, tile_hits, pixel_hits, seed + i)
+            os.replace(tmp, path)
+        paths.append(path)
+
+    return paths
+
+# ------------------------------------
+
+def run_benchmark(directory="benchmark_data", files=2, frames=10000, tracks=4., tile_hits=1.5, pixel_hits=8., seed=0,
+                  methods=METHODS, mt_methods=MT_METHODS, workers=[1, 2, 4], frames_per_unit=0, chunk_size=0,
+                  cache=False, history="benchmarks.jsonl", label=""):
+    """
+        Times the analyses on synthetic files and appends the run to history (one JSON object per line).
+        methods are run on the first file in one process, mt_methods with run_mt on all files for every
+        number of workers. Every case runs in its own process, its peak RSS (and the one of its
+        run_mt workers) is reported with the frames/s and tile hits/s.
+        cache: the files are read through prepare_cache instead of ROOT
+        history: None does not save the run
+    """
+    paths   = generate_files(directory, files, frames, tracks, tile_hits, pixel_hits, seed)
+    pattern = os.path.join(os.path.dirname(paths[0]), synthetic_name(files, frames, tracks, tile_hits, pixel_hits, seed) + "_*.root")
+    if cache:
+        for path in paths:
+            tl.prepare_cache(path)
+
+    # input size of the cases
+    hits = [len(tl.load_tile_hits(path)["tilehit_tile"].values) for path in paths]
+
+    cases = [{"method": m, "workers": 0} for m in methods]
+    cases += [{"method": m, "workers": w} for m in mt_methods for w in workers if w <= mt.available_cpus()]
+
+    run = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "label": label, "commit": _git_commit(),
+           "host": platform.node(), "python": platform.python_version(), "numpy": np.__version__, "cpus": mt.available_cpus(),
+           "config": {"files": files, "frames": frames, "tracks": tracks, "tile_hits": tile_hits, "pixel_hits": pixel_hits,
+                      "seed": seed, "frames_per_unit": frames_per_unit, "chunk_size": chunk_size, "cache": cache},
+           "results": []}
+
+    for case in cases:
+        case.update(files=paths, pattern=pattern, chunk_size=chunk_size, frames_per_unit=frames_per_unit)
+        n_frames = frames if case["workers"] == 0 else frames * files
+        n_hits   = hits[0] if case["workers"] == 0 else sum(hits)
+
+        result = _measure(case)
+        run["results"].append({"method": case["method"], "workers": case["workers"], "frames": n_frames, "hits": n_hits,
+                               "accepted": result["accepted"], "elapsed": result["elapsed"],
+                               "frames_per_s": n_frames / result["elapsed"], "hits_per_s": n_hits / result["elapsed"],
+                               "peak_rss": result["peak_rss"], "peak_rss_workers": result["peak_rss_workers"]})
+
+    _print_results(run)
+
+    if history is not None:
+        with open(history, "a") as f:
+            f.write(json.dumps(run) + "\n")
+
+    return run
+
+# ------------------------------------
+
+def load_history(history="benchmarks.jsonl"):
+    """ Returns all runs saved by run_benchmark, oldest first """
+    with open(history) as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+# ------------------------------------
+
+def compare(history="benchmarks.jsonl", baseline=-2, current=-1):
+    """
+        Prints the frames/s and peak RSS of run current relative to run baseline (indices into the history)
+        for every case of both runs. Returns a dict (method, workers) -> (speedup, rss ratio).
+    """
+    runs = load_history(history)
+    old  = {(r["method"], r["workers"]): r for r in runs[baseline]["results"]}
+    new  = {(r["method"], r["workers"]): r for r in runs[current]["results"]}
+
+    if runs[baseline]["config"] != runs[current]["config"]:
+        print("Warning: the runs have a different configuration")
+    print("{:<18} {:>7} {:>10} {:>10}".format("method", "workers", "speedup", "RSS"))
+
+    ratios = {}
+    for key in [k for k in new if k in old]:
+        speedup = new[key]["frames_per_s"] / old[key]["frames_per_s"]
+        rss     = max(new[key]["peak_rss"], new[key]["peak_rss_workers"]) / max(old[key]["peak_rss"], old[key]["peak_rss_workers"])
+        ratios[key] = (speedup, rss)
+        print("{:<18} {:>7} {:>10.2f} {:>10.2f}".format(key[0], key[1], speedup, rss))
+
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the melp analyses on synthetic sorted ROOT files")
+    parser.add_argument("--directory", default="benchmark_data", help="directory of the synthetic files")
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=10000, help="frames per file")
+    parser.add_argument("--tracks", type=float, default=4., help="mean number of trajectories per frame")
+    parser.add_argument("--tile-hits", type=float, default=1.5, help="mean number of tile hits per trajectory")
+    parser.add_argument("--pixel-hits", type=float, default=8., help="mean number of pixel hits per trajectory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--methods", nargs="*", default=METHODS)
+    parser.add_argument("--mt-methods", nargs="*", default=MT_METHODS)
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4])
+    parser.add_argument("--frames-per-unit", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="read the files through prepare_cache")
+    parser.add_argument("--history", default="benchmarks.jsonl")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--compare", action="store_true", help="only compare the last two runs of the history")
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(options.history)
+    else:
+        run_benchmark(options.directory, options.files, options.frames, options.tracks, options.tile_hits, options.pixel_hits,
+                      options.seed, options.methods, options.mt_methods, options.workers, options.frames_per_unit,
+                      options.chunk_size, options.cache, options.history, options.label)
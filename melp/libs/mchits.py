@@ -0,0 +1,30 @@
+import numpy as np
+from melp.libs import treeloader as tl
+
+
+class MCHitTable():
+    """
+        Columns of the mu3e_mchits tree as contiguous arrays indexed by mc_i.
+        Works for single indices and for index arrays (fancy indexing).
+        With start/stop only the entries [start, stop) are read, row 0 is then mc_i = base.
+    """
+    def __init__ (self, filename, momentum=True, start=0, stop=None):
+        branches = ["hid", "tid", "pdg"]
+        if momentum:
+            branches += ["p_in_x", "p_in_y", "p_in_z"]
+
+        columns  = tl.read_flat(filename, "mu3e_mchits", branches, start, stop)
+
+        self.base = start
+
+        self.hid = columns["hid"].astype(np.int32, copy=False)
+        self.tid = columns["tid"].astype(np.int32, copy=False)
+        self.pdg = columns["pdg"].astype(np.int32, copy=False)
+
+        if momentum:
+            self.p_in = np.column_stack((columns["p_in_x"], columns["p_in_y"], columns["p_in_z"])).astype(np.float64)
+        else:
+            self.p_in = np.zeros((0, 3))
+
+    def __len__ (self):
+        return len(self.hid)
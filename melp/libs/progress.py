@@ -0,0 +1,249 @@
+import sys
+import time
+import queue
+import datetime
+import threading
+
+
+# reporter of the analyses of this process (see set_reporter), the printing one if None
+_reporter = None
+
+
+#####################
+# private functions #
+#####################
+
+def _duration(seconds):
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+#####################
+# public  functions #
+#####################
+
+def reporter():
+    """ Returns the reporter of the analyses in this process """
+    global _reporter
+    if _reporter is None:
+        _reporter = ProgressReporter()
+
+    return _reporter
+
+# ------------------------------------
+
+def set_reporter(progress_reporter=None):
+    """ Sets the reporter of the analyses in this process, None restores the default (printing) one """
+    global _reporter
+    _reporter = progress_reporter
+
+
+# ------------------------------------
+
+class ProgressReporter():
+    """
+        Progress of the analyses of TileHitAngle/TileHitRate: prints the percentage of analysed frames
+        at most every interval seconds (and messages such as the HID/TID checks).
+        update() is cheap, so it can be called from the frame loops.
+    """
+    def __init__ (self, interval=2.):
+        self.interval = interval
+        self.start(0)
+
+    # ------------------------------------
+
+    def start(self, n):
+        """ Starts an analysis of n frames """
+        self.n      = n
+        self.frames = 0
+        self.hits   = 0
+        self.last   = time.monotonic()
+
+    # ------------------------------------
+
+    def update(self, frames, hits=0):
+        """ frames more frames with hits tile hits were analysed """
+        self.frames += frames
+        self.hits   += hits
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    # ------------------------------------
+
+    def report(self):
+        if self.n != 0 and self.frames < self.n:
+            print(round((self.frames/self.n)*100,2), "%")
+
+    # ------------------------------------
+
+    def message(self, *args):
+        print(*args)
+
+    # ------------------------------------
+
+    def flush(self):
+        pass
+
+    # ------------------------------------
+
+    def finish(self):
+        print("100%")
+
+
+# ------------------------------------
+
+class QueueReporter(ProgressReporter):
+    """
+        Reporter of a run_mt worker: sends the frames and hits analysed since the last report to the
+        queue of the parent (at most every interval seconds), messages are dropped.
+        queue: None drops everything
+    """
+    def __init__ (self, queue, interval=0.5):
+        self.queue = queue
+        ProgressReporter.__init__(self, interval)
+
+    # ------------------------------------
+
+    def start(self, n):
+        # counts of the previous analysis are sent first
+        if hasattr(self, "frames"):
+            self.flush()
+        ProgressReporter.start(self, n)
+        self.sent_frames = 0
+        self.sent_hits   = 0
+
+    # ------------------------------------
+
+    def report(self):
+        if self.queue is not None and (self.frames != self.sent_frames or self.hits != self.sent_hits):
+            self.queue.put((self.frames - self.sent_frames, self.hits - self.sent_hits))
+        self.sent_frames = self.frames
+        self.sent_hits   = self.hits
+
+    # ------------------------------------
+
+    def message(self, *args):
+        pass
+
+    # ------------------------------------
+
+    def flush(self):
+        self.report()
+
+    # ------------------------------------
+
+    def finish(self):
+        self.flush()
+
+
+# ------------------------------------
+
+class ProgressMonitor():
+    """
+        Collects the (frames, hits) sent by the QueueReporters of all workers in a thread and shows
+        one progress line for the whole run: frames done of frames, frames/s, tile hits/s and ETA.
+        On a terminal the line is redrawn every interval seconds, otherwise a new line is printed
+        every 20 intervals. message() prints other output without breaking the line.
+    """
+    def __init__ (self, queue, frames, interval=0.5, stream=None):
+        self.queue    = queue
+        self.total    = frames
+        self.stream   = sys.stdout if stream is None else stream
+        self.tty      = getattr(self.stream, "isatty", lambda: False)()
+        self.interval = interval if self.tty else 20 * interval
+
+        self.frames   = 0
+        self.hits     = 0
+        self.begin    = time.monotonic()
+        self.last     = 0.
+        self.width    = 0
+        self.lock     = threading.Lock()
+        self.thread   = threading.Thread(target=self.__Collect, daemon=True)
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Collect (self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            with self.lock:
+                self.frames += item[0]
+                self.hits   += item[1]
+                now = time.monotonic()
+                if now - self.last >= self.interval:
+                    self.last = now
+                    self.__Draw()
+
+    # ------------------------------------
+
+    def __Line (self):
+        elapsed = max(time.monotonic() - self.begin, 1e-9)
+        rate    = self.frames / elapsed
+        eta     = _duration((self.total - self.frames) / rate) if rate > 0 else "?"
+        percent = 100 * self.frames / self.total if self.total != 0 else 100.
+
+        return "frames {}/{} ({:.1f}%)  {:.0f} frames/s  {:.0f} hits/s  elapsed {}  ETA {}".format(
+            self.frames, self.total, percent, rate, self.hits / elapsed, _duration(elapsed), eta)
+
+    # ------------------------------------
+
+    def __Draw (self):
+        line = self.__Line()
+        if self.tty:
+            # overwrite the previous line
+            self.stream.write("\r" + line.ljust(self.width))
+            self.width = len(line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    # ------------------------------------
+
+    def __Clear (self):
+        if self.tty and self.width != 0:
+            self.stream.write("\r" + " " * self.width + "\r")
+            self.width = 0
+
+    #####################
+    # public  functions #
+    #####################
+
+    def start(self):
+        self.begin = time.monotonic()
+        self.thread.start()
+
+        return self
+
+    # ------------------------------------
+
+    def message(self, *args):
+        with self.lock:
+            self.__Clear()
+            self.stream.write(" ".join(str(a) for a in args) + "\n")
+            if self.tty:
+                self.__Draw()
+            self.stream.flush()
+
+    # ------------------------------------
+
+    def close(self):
+        """ Waits for all queued counts and prints the final line """
+        self.queue.put(None)
+        self.thread.join()
+        with self.lock:
+            # counts of the workers that arrived after the end marker
+            try:
+                while True:
+                    item = self.queue.get_nowait()
+                    if item is not None:
+                        self.frames += item[0]
+                        self.hits   += item[1]
+            except queue.Empty:
+                pass
+            self.__Clear()
+            self.stream.write(self.__Line() + "\n")
+            self.stream.flush()
@@ -0,0 +1,386 @@
+import numpy as np
+from melp.libs import resultstore as rst
+from melp.libs import histogram as hi
+from melp.libs import timing as tm
+
+
+class AngleResult():
+    """
+        z, angle and tile id of the tile hits accepted by one TileHitAngle analysis, together with
+        the labels that make up the output file names (output + angle + ana_type + hit_type).
+        Results of several frame ranges or files can be concatenated.
+        metadata: further information for the header of saveRecords, e.g. {"method": "rec", "input": [files]}
+        counters: frames, hit counters and stage times of the analysis (TileHitAngle.getCounters), summed by concatenate
+    """
+    def __init__ (self, output, angle_type, ana_type, hit_type, z=None, angle=None, id=None, histogram=None, metadata=None, counters=None):
+        self.output     = output
+        self.angle_type = angle_type
+        self.ana_type   = ana_type
+        self.hit_type   = hit_type
+
+        self.z          = np.zeros(0) if z is None else z
+        self.angle      = np.zeros(0) if angle is None else angle
+        self.id         = np.zeros(0, dtype=np.int64) if id is None else id
+        self.histogram  = histogram
+        self.metadata   = {} if metadata is None else metadata
+        self.counters   = {} if counters is None else counters
+
+    def __len__ (self):
+        return len(self.z)
+
+    # ------------------------------------
+
+    def name(self):
+        return self.output + self.angle_type + self.ana_type + self.hit_type
+
+    # ------------------------------------
+
+    def header(self):
+        """ Labels and metadata of the result as saved in the header of saveRecords """
+        return dict(self.metadata, output=self.output, angle=self.angle_type, ana_type=self.ana_type, hit_type=self.hit_type)
+
+    # ------------------------------------
+
+    @staticmethod
+    def concatenate(results, output=None):
+        """
+            Concatenates the results in the given order, histograms are added if all results have one with the same binning.
+            output: output name of the merged result, default is the one of the first result
+        """
+        first     = results[0]
+        histogram = None
+        if all(r.histogram is not None for r in results):
+            try:
+                histogram = sum(r.histogram for r in results)
+            except ValueError:
+                # different binning (e.g. files with a different geometry), only the arrays are merged
+                histogram = None
+
+        # input files of all results, in order
+        metadata = dict(first.metadata)
+        inputs   = [f for r in results for f in r.metadata.get("input", [])]
+        if len(inputs) != 0:
+            metadata["input"] = list(dict.fromkeys(inputs))
+
+        return AngleResult(first.output if output is None else output, first.angle_type, first.ana_type, first.hit_type,
+                           np.concatenate([r.z for r in results]),
+                           np.concatenate([r.angle for r in results]),
+                           np.concatenate([r.id for r in results]),
+                           histogram, metadata, tm.add_counters(getattr(r, "counters", {}) for r in results))
+
+    # ------------------------------------
+
+    def binnedOnly(self):
+        """ Returns a copy with the histogram only (e.g. to send less data between processes) """
+        return AngleResult(self.output, self.angle_type, self.ana_type, self.hit_type, histogram=self.histogram, metadata=self.metadata, counters=self.counters)
+
+    # ------------------------------------
+
+    def save(self, txt=False, npz=False, binned=False, compressed=False, records=False):
+        """ Saves the result in all selected formats """
+        if records == True:
+            self.saveRecords()
+        if txt == True:
+            self.saveTxt()
+        if npz == True:
+            self.saveNpz()
+        if binned == True:
+            self.saveBinned()
+        if compressed == True:
+            self.saveCompressed()
+
+    # ------------------------------------
+
+    def saveTxt(self):
+        np.savetxt(self.name() + "_z.txt", self.z)
+        np.savetxt(self.name() + "_angle.txt", self.angle)
+        np.savetxt(self.name() + "_id.txt", self.id)
+
+    # ------------------------------------
+
+    def saveNpz(self):
+        np.savez(self.name(), z=self.z, angle=self.angle, id=self.id)
+
+    # ------------------------------------
+
+    def saveCompressed(self):
+        np.savez_compressed(self.name() + "_compressed", z=self.z, angle=self.angle, id=self.id)
+
+    # ------------------------------------
+
+    def saveBinned(self):
+        if self.histogram is None:
+            raise ValueError("AngleResult: no histogram")
+        self.histogram.save(self.name() + "_binned")
+
+    # ------------------------------------
+
+    def saveRecords(self, path=None, float_dtype=np.float32, id_dtype=np.int32):
+        """
+            Saves z, angle, id as binary records with the labels and metadata in the header (see resultstore).
+            path: default name() + ".mres"
+        """
+        with rst.ResultWriter(self.name() + ".mres" if path is None else path, self.header(), float_dtype, id_dtype) as writer:
+            writer.append(self.z, self.angle, self.id)
+
+    # ------------------------------------
+
+    @staticmethod
+    def loadRecords(path):
+        """ Loads a file of saveRecords, z, angle and id are memory-mapped (no copy) """
+        records, metadata = rst.load_records(path)
+        labels            = [metadata.pop(key, "") for key in ["output", "angle", "ana_type", "hit_type"]]
+
+        return AngleResult(*labels, z=records["z"], angle=records["angle"], id=records["id"], metadata=metadata)
+
+
+# ------------------------------------
+
+class RateResult():
+    """
+        z and edep of the tile hits of one TileHitRate analysis, split into total, primary,
+        secondary and tertiary hits. Results of several frame ranges or files can be concatenated.
+        counters: frames, hit counts and stage times of the analysis (TileHitRate.getCounters), summed by concatenate
+    """
+    names = ["total", "primary", "secondary", "tertiary"]
+
+    def __init__ (self, output_z, output_rate, z=None, edep=None, histograms=None, counters=None):
+        self.output_z    = output_z
+        self.output_rate = output_rate
+
+        # dicts name -> array
+        self.z           = {name: np.zeros(0) for name in self.names} if z is None else z
+        self.edep        = {name: np.zeros(0) for name in self.names} if edep is None else edep
+
+        # optional Histogram1D dict as returned by TileHitRate.fillBinnedHID ("z_total", ..., "edep_total", ...)
+        self.histograms  = histograms
+        self.counters    = {} if counters is None else counters
+
+    def __len__ (self):
+        return len(self.z["total"])
+
+    # ------------------------------------
+
+    @staticmethod
+    def concatenate(results, output_z=None, output_rate=None):
+        """
+            Concatenates the results in the given order, histograms are added if all results have them with the same binning.
+            Default output names are the ones of the first result
+        """
+        first = results[0]
+        z     = {name: np.concatenate([r.z[name] for r in results]) for name in RateResult.names}
+        edep  = {name: np.concatenate([r.edep[name] for r in results]) for name in RateResult.names}
+
+        histograms = None
+        if all(r.histograms is not None for r in results):
+            try:
+                histograms = {key: sum(r.histograms[key] for r in results) for key in first.histograms}
+            except ValueError:
+                # different binning (e.g. files with a different geometry), only the arrays are merged
+                histograms = None
+
+        return RateResult(first.output_z if output_z is None else output_z,
+                          first.output_rate if output_rate is None else output_rate, z, edep, histograms,
+                          tm.add_counters(getattr(r, "counters", {}) for r in results))
+
+    # ------------------------------------
+
+    def binnedOnly(self):
+        """ Returns a copy with the histograms only (e.g. to send less data between processes) """
+        return RateResult(self.output_z, self.output_rate, histograms=self.histograms, counters=self.counters)
+
+    # ------------------------------------
+
+    def save(self, npz=False, binned=False):
+        """ Saves the result in all selected formats """
+        if npz == True:
+            self.saveNpz()
+        if binned == True:
+            self.saveBinned()
+
+    # ------------------------------------
+
+    def saveNpz(self):
+        np.savez(self.output_z, **self.z)
+        np.savez(self.output_rate, **self.edep)
+
+    # ------------------------------------
+
+    def saveBinned(self):
+        """ Saves every histogram as output_z + "_" + name + "_binned" (z) or output_rate + "_" + name + "_binned" (edep) """
+        if self.histograms is None:
+            raise ValueError("RateResult: no histograms")
+        for name in self.names:
+            self.histograms["z_" + name].save(self.output_z + "_" + name + "_binned")
+            self.histograms["edep_" + name].save(self.output_rate + "_" + name + "_binned")
+
+
+# ------------------------------------
+
+class ResultSet():
+    """
+        Several results of one analysis, {key: AngleResult or RateResult}, e.g. the results of
+        TileHitAngle.hitAngleMulti with its requests as keys. Results of several frame ranges or files
+        are concatenated key by key, all results are saved with their own output names.
+        counters: frames, hit counters and stage times of the analysis, summed by concatenate
+    """
+    def __init__ (self, results, counters=None):
+        self.results  = results
+        self.counters = {} if counters is None else counters
+
+    def __len__ (self):
+        return sum(len(r) for r in self.results.values())
+
+    # ------------------------------------
+
+    @staticmethod
+    def concatenate(results):
+        """ Concatenates the results of every key in the given order, all sets must have the same keys """
+        merged = {}
+        for key, first in results[0].results.items():
+            merged[key] = type(first).concatenate([r.results[key] for r in results])
+
+        return ResultSet(merged, tm.add_counters(r.counters for r in results))
+
+    # ------------------------------------
+
+    def binnedOnly(self):
+        """ Returns a copy with the histograms only """
+        return ResultSet({key: r.binnedOnly() for key, r in self.results.items()}, self.counters)
+
+    # ------------------------------------
+
+    def save(self, txt=False, npz=False, binned=False, compressed=False, records=False):
+        """ Saves all results in the selected formats (only npz and binned for a RateResult) """
+        for r in self.results.values():
+            if isinstance(r, RateResult):
+                r.save(npz=npz, binned=binned)
+            else:
+                r.save(txt=txt, npz=npz, binned=binned, compressed=compressed, records=records)
+
+    # ------------------------------------
+
+    def saveBinned(self):
+        for r in self.results.values():
+            r.saveBinned()
+
+
+# ------------------------------------
+
+class TreeReducer():
+    """
+        Ordered tree reduction of n results that arrive in any order (e.g. from a process pool).
+        Result k is leaf k of a binary tree and two nodes are merged as soon as both are there,
+        so results are combined while the others are still running, every value is copied
+        O(log n) times and the merged result keeps the order of k.
+        merge: function that merges a list [left, right] into one result
+    """
+    def __init__ (self, n, merge):
+        self.n     = n
+        self.merge = merge
+        self.nodes = {}
+
+        # the root is the node (levels, 0)
+        self.levels = max(n - 1, 0).bit_length()
+
+    def __len__ (self):
+        """ Number of partial results that are held """
+        return len(self.nodes)
+
+    # ------------------------------------
+
+    def add(self, k, result):
+        level = 0
+        while level < self.levels:
+            sibling = k ^ 1
+            if (sibling << level) < self.n:
+                if (level, sibling) not in self.nodes:
+                    break
+                other  = self.nodes.pop((level, sibling))
+                result = self.merge([result, other] if k < sibling else [other, result])
+            # else the sibling covers no results, the node is moved up as it is
+            k     >>= 1
+            level  += 1
+
+        self.nodes[(level, k)] = result
+
+    # ------------------------------------
+
+    def result(self):
+        """ Returns the merged result, None if not all results were added """
+        return self.nodes.get((self.levels, 0))
+
+
+# ------------------------------------
+
+def rate_histograms(tile_geometry, bins=220):
+    """ Empty histograms of a RateResult ("z_total", ..., "edep_total", ...), fixed binning: z over all tile positions """
+    z_range    = (tile_geometry.pos[:, 2].min(), tile_geometry.pos[:, 2].max())
+    histograms = {}
+    for name in RateResult.names:
+        histograms["z_" + name]    = hi.Histogram1D(bins, range=z_range)
+        histograms["edep_" + name] = hi.Histogram1D(bins, range=z_range)
+
+    return histograms
+
+# ------------------------------------
+
+def fill_rate_histograms(histograms, arrays):
+    """ Fills the histograms of rate_histograms with the eight arrays z, z primary, ..., edep, edep primary, ... """
+    for k, name in enumerate(RateResult.names):
+        histograms["z_" + name].fill(arrays[k])
+        histograms["edep_" + name].fill(arrays[k], weights=arrays[k+4])
+
+# ------------------------------------
+
+def angle_dtype(compact=True):
+    """ Record of one TileHitAngle hit, compact: float32 z/angle/vector and int32 tile id """
+    if compact:
+        return np.dtype([("z", np.float32), ("angle", np.float32), ("id", np.int32), ("vector", np.float32, (3,))])
+
+    return np.dtype([("z", np.float64), ("angle", np.float64), ("id", np.int64), ("vector", np.float64, (3,))])
+
+# ------------------------------------
+
+def rate_dtype(compact=True):
+    """ Record of one TileHitRate hit, hid: 1 primary, 2 secondary, 3 tertiary, 0 other """
+    if compact:
+        return np.dtype([("z", np.float32), ("edep", np.float32), ("id", np.int32), ("hid", np.uint8)])
+
+    return np.dtype([("z", np.float64), ("edep", np.float64), ("id", np.int64), ("hid", np.uint8)])
+
+
+# ------------------------------------
+
+class GrowableArray():
+    """
+        Structured array that is filled chunk by chunk (no per-hit Python objects).
+        The capacity doubles when it is full, finish() trims it to the used length.
+    """
+    def __init__ (self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.n    = 0
+
+    def __len__ (self):
+        return self.n
+
+    # ------------------------------------
+
+    def append(self, **fields):
+        """ Appends one array for every field of the dtype, all of the same length """
+        k = len(next(iter(fields.values())))
+        if self.n + k > len(self.data):
+            # no views of data exist before finish()
+            self.data.resize(max(2 * len(self.data), self.n + k), refcheck=False)
+
+        for name, values in fields.items():
+            self.data[name][self.n:self.n + k] = values
+        self.n += k
+
+    # ------------------------------------
+
+    def finish(self):
+        """ Returns the filled records, nothing can be appended afterwards """
+        self.data.resize(self.n, refcheck=False)
+
+        return self.data
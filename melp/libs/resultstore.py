@@ -0,0 +1,105 @@
+import os
+import json
+import numpy as np
+
+
+# file layout: MAGIC, header length (uint64), JSON header padded to a multiple of ALIGN bytes, records
+MAGIC   = b"MELPRES\x01"
+VERSION = 1
+ALIGN   = 64
+
+
+#####################
+# private functions #
+#####################
+
+def _header(dtype, metadata):
+    header = json.dumps({"version": VERSION, "dtype": [[name, dtype[name].str] for name in dtype.names], "metadata": metadata}).encode()
+    # records start aligned
+    length = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN - len(MAGIC) - 8
+
+    return MAGIC + np.uint64(length).tobytes() + header.ljust(length)
+
+
+#####################
+# public  functions #
+#####################
+
+def record_dtype(float_dtype=np.float32, id_dtype=np.int32):
+    """ dtype of one (z, angle, id) record """
+    return np.dtype([("z", float_dtype), ("angle", float_dtype), ("id", id_dtype)])
+
+# ------------------------------------
+
+def read_header(path):
+    """ Returns metadata, record dtype and the offset of the first record of a result file """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ": not a melp result file")
+        length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(length).decode())
+
+    if header["version"] != VERSION:
+        raise ValueError(path + ": unsupported result file version")
+
+    return header["metadata"], np.dtype([tuple(field) for field in header["dtype"]]), len(MAGIC) + 8 + length
+
+# ------------------------------------
+
+def load_records(path, mode="r"):
+    """
+        Returns the records of a result file as memory-mapped structured array (records["z"], records["angle"],
+        records["id"] are views, nothing is copied) and the metadata. An incomplete last record (e.g. of a
+        file that is still written) is ignored.
+    """
+    metadata, dtype, offset = read_header(path)
+    n = (os.path.getsize(path) - offset) // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype), metadata
+
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(n,)), metadata
+
+
+# ------------------------------------
+
+class ResultWriter():
+    """
+        Writes (z, angle, id) records to a binary result file chunk by chunk. The header holds the record dtype
+        and the metadata (angle, method, hit_type, input files, ...), so the file name carries no information.
+        append: add records to an existing file (its dtype is kept)
+    """
+    def __init__ (self, path, metadata=None, float_dtype=np.float32, id_dtype=np.int32, append=False):
+        self.path = path
+
+        if append and os.path.exists(path):
+            self.metadata, self.dtype, offset = read_header(path)
+            self.file = open(path, "r+b")
+            # drop an incomplete last record
+            n = (os.path.getsize(path) - offset) // self.dtype.itemsize
+            self.file.truncate(offset + n * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.metadata = {} if metadata is None else metadata
+            self.dtype    = record_dtype(float_dtype, id_dtype)
+            self.file     = open(path, "wb")
+            self.file.write(_header(self.dtype, self.metadata))
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+    # ------------------------------------
+
+    def append(self, z, angle, id):
+        records          = np.empty(len(z), dtype=self.dtype)
+        records["z"]     = z
+        records["angle"] = angle
+        records["id"]    = id
+        records.tofile(self.file)
+
+    # ------------------------------------
+
+    def close(self):
+        self.file.close()
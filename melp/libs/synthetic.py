@@ -0,0 +1,214 @@
+import ROOT
+import numpy as np
+
+
+# tiles: one barrel of ROWS x COLUMNS tiles, pixels: layer 2 and layer 3 (see hitAnglePixelRec)
+TILE_RADIUS  = 64.
+TILE_ROWS    = 52
+TILE_COLUMNS = 56
+TILE_LENGTH  = 340.
+TILE_ID      = 200000
+
+# radius, sensors around, first sensor id of the pixel layers
+LAYERS       = [(70., 22, 10000), (82., 25, 11500)]
+SENSOR_ROWS  = 18
+PIXEL_PITCH  = 0.08
+PIXEL_COLS   = 256
+PIXEL_ROWS   = 250
+
+# hid of the tile hits: 1 primary, 2 secondary, 3 tertiary, others are discarded by the analyses
+TILE_HIDS    = [1, 2, 3, -1, 4]
+TILE_HID_P   = [0.7, 0.12, 0.08, 0.06, 0.04]
+TRAJ_TYPES   = [11, 12, 21, 22, 92]
+
+# C++ type of the vector branches
+_CPP_TYPES   = {"i": "int", "f": "double"}
+
+
+#####################
+# private functions #
+#####################
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    return offsets
+
+# ------------------------------------
+
+def _tile_index(phi, z):
+    column = np.floor((phi + np.pi) / (2 * np.pi) * TILE_COLUMNS).astype(np.int64) % TILE_COLUMNS
+    row    = np.clip(np.floor((z / TILE_LENGTH + 0.5) * TILE_ROWS).astype(np.int64), 0, TILE_ROWS - 1)
+
+    return row, column
+
+# ------------------------------------
+
+def _write_jagged(treename, columns, frames):
+    # one std::vector per branch, filled frame by frame
+    tree    = ROOT.TTree(treename, treename)
+    vectors = {}
+    for branch, (values, offsets) in columns.items():
+        vectors[branch] = ROOT.std.vector(_CPP_TYPES[values.dtype.kind])()
+        tree.Branch(branch, vectors[branch])
+
+    for i in range(frames):
+        for branch, (values, offsets) in columns.items():
+            vector = vectors[branch]
+            vector.clear()
+            for value in values[offsets[i]:offsets[i+1]].tolist():
+                vector.push_back(value)
+        tree.Fill()
+
+    tree.Write()
+
+# ------------------------------------
+
+def _write_flat(treename, filename, columns):
+    options       = ROOT.RDF.RSnapshotOptions()
+    options.fMode = "UPDATE"
+    columns       = {b: np.ascontiguousarray(values) for b, values in columns.items()}
+    ROOT.RDF.FromNumpy(columns).Snapshot(treename, filename, list(columns), options)
+
+
+#####################
+# public  functions #
+#####################
+
+def synthetic_geometry():
+    """ Returns the columns of alignment/tiles and alignment/sensors of the synthetic detector """
+    row, column = np.divmod(np.arange(TILE_ROWS * TILE_COLUMNS), TILE_COLUMNS)
+    phi         = (column + 0.5) / TILE_COLUMNS * 2 * np.pi - np.pi
+    tiles = {"sensor": (TILE_ID + row * TILE_COLUMNS + column).astype(np.int32),
+             "posx":   TILE_RADIUS * np.cos(phi),
+             "posy":   TILE_RADIUS * np.sin(phi),
+             "posz":   ((row + 0.5) / TILE_ROWS - 0.5) * TILE_LENGTH,
+             "dirx":   np.cos(phi),
+             "diry":   np.sin(phi),
+             "dirz":   np.zeros(len(phi))}
+
+    sensors = {b: [] for b in ["sensor", "vx", "vy", "vz", "colx", "coly", "colz", "rowx", "rowy", "rowz"]}
+    for radius, around, first in LAYERS:
+        row, column = np.divmod(np.arange(SENSOR_ROWS * around), around)
+        phi         = (column + 0.5) / around * 2 * np.pi - np.pi
+        z           = ((row + 0.5) / SENSOR_ROWS - 0.5) * SENSOR_ROWS * PIXEL_ROWS * PIXEL_PITCH
+        # columns run along phi, rows along z, v is the corner of the sensor
+        col         = PIXEL_PITCH * np.column_stack((-np.sin(phi), np.cos(phi), np.zeros(len(phi))))
+        row_vec     = PIXEL_PITCH * np.column_stack((np.zeros(len(phi)), np.zeros(len(phi)), np.ones(len(phi))))
+        v           = (np.column_stack((radius * np.cos(phi), radius * np.sin(phi), z))
+                       - PIXEL_COLS / 2 * col - PIXEL_ROWS / 2 * row_vec)
+
+        sensors["sensor"].append(first + row * around + column)
+        for k, axis in enumerate("xyz"):
+            sensors["v" + axis].append(v[:, k])
+            sensors["col" + axis].append(col[:, k])
+            sensors["row" + axis].append(row_vec[:, k])
+
+    sensors = {b: np.concatenate(values) for b, values in sensors.items()}
+    sensors["sensor"] = sensors["sensor"].astype(np.int32)
+
+    return tiles, sensors
+
+# ------------------------------------
+
+def synthetic_frames(frames, tracks=4., tile_hits=1.5, pixel_hits=8., seed=0):
+    """
+        Returns the columns of the mu3e tree (branch -> (values, offsets)) and of the mu3e_mchits tree of
+        frames random frames. Every frame has Poisson(tracks) trajectories, every trajectory Poisson(tile_hits)
+        tile hits and Poisson(pixel_hits) pixel hits in layer 2 and 3 next to its tiles. The mchits are sorted
+        by frame (tile hits first), as in a sorted file.
+    """
+    rng = np.random.default_rng(seed)
+
+    # trajectories, tid 1, 2, ... in every frame
+    n_traj = rng.poisson(tracks, frames)
+    n      = int(n_traj.sum())
+    frame  = np.repeat(np.arange(frames), n_traj)
+    tid    = np.arange(n) - np.repeat(_offsets(n_traj)[:-1], n_traj) + 1
+    phi    = rng.uniform(-np.pi, np.pi, n)
+    z      = rng.uniform(-TILE_LENGTH / 2, TILE_LENGTH / 2, n)
+    pt     = rng.uniform(15., 50., n)
+
+    # tile hits around the direction of their trajectory
+    n_tile       = rng.poisson(tile_hits, n)
+    owner        = np.repeat(np.arange(n), n_tile)
+    row, column  = _tile_index(phi[owner] + rng.normal(0, 0.05, len(owner)), z[owner] + rng.normal(0, 5., len(owner)))
+    tile_id      = TILE_ID + row * TILE_COLUMNS + column
+    tile_frame   = frame[owner]
+    tile_counts  = np.bincount(tile_frame, minlength=frames)
+
+    # pixel hits on the sensors in front of the tiles
+    n_pixel      = rng.poisson(pixel_hits, n)
+    pixel_owner  = np.repeat(np.arange(n), n_pixel)
+    pixel_frame  = frame[pixel_owner]
+    pixel_counts = np.bincount(pixel_frame, minlength=frames)
+    layer        = rng.integers(0, len(LAYERS), len(pixel_owner))
+    around       = np.array([l[1] for l in LAYERS])[layer]
+    first        = np.array([l[2] for l in LAYERS])[layer]
+    pixel_phi    = phi[pixel_owner] + rng.normal(0, 0.02, len(pixel_owner))
+    pixel_z      = z[pixel_owner] + rng.normal(0, 2., len(pixel_owner))
+    sensor_col   = np.floor((pixel_phi + np.pi) / (2 * np.pi) * around).astype(np.int64) % around
+    sensor_row   = np.clip(np.floor((pixel_z / (SENSOR_ROWS * PIXEL_ROWS * PIXEL_PITCH) + 0.5) * SENSOR_ROWS).astype(np.int64), 0, SENSOR_ROWS - 1)
+    sensor       = first + sensor_row * around + sensor_col
+    pixel_id     = (sensor << 16) | (rng.integers(0, PIXEL_COLS, len(sensor)) << 8) | rng.integers(0, PIXEL_ROWS, len(sensor))
+
+    # mchits of frame f: its tile hits, then its pixel hits
+    base         = _offsets(tile_counts + pixel_counts)[:-1]
+    tile_mc_i    = base[tile_frame] + np.arange(len(owner)) - _offsets(tile_counts)[:-1][tile_frame]
+    pixel_mc_i   = base[pixel_frame] + tile_counts[pixel_frame] + np.arange(len(pixel_owner)) - _offsets(pixel_counts)[:-1][pixel_frame]
+
+    n_mc   = len(owner) + len(pixel_owner)
+    hid    = np.ones(n_mc, dtype=np.int32)
+    hid[tile_mc_i] = rng.choice(TILE_HIDS, len(owner), p=TILE_HID_P)
+    mc_tid = np.zeros(n_mc, dtype=np.int32)
+    mc_tid[tile_mc_i]  = tid[owner]
+    mc_tid[pixel_mc_i] = tid[pixel_owner]
+    p_in   = np.zeros((n_mc, 3))
+    p_in[tile_mc_i]  = np.column_stack((np.cos(phi[owner]), np.sin(phi[owner]), rng.normal(0, 0.5, len(owner)))) * pt[owner, None]
+    p_in[pixel_mc_i] = rng.normal(0, 20., (len(pixel_owner), 3))
+    pdg    = rng.choice([-11, 11], n)
+    mc_pdg = np.zeros(n_mc, dtype=np.int32)
+    mc_pdg[tile_mc_i]  = pdg[owner]
+    mc_pdg[pixel_mc_i] = pdg[pixel_owner]
+
+    mchits = {"hid": hid, "tid": mc_tid, "pdg": mc_pdg, "p_in_x": p_in[:, 0], "p_in_y": p_in[:, 1], "p_in_z": p_in[:, 2]}
+
+    tile   = _offsets(tile_counts)
+    pixel  = _offsets(pixel_counts)
+    traj   = _offsets(n_traj)
+    mu3e = {"tilehit_tile": (tile_id.astype(np.int32), tile),
+            "tilehit_mc_i": (tile_mc_i.astype(np.int32), tile),
+            "tilehit_edep": (rng.exponential(0.5, len(owner)), tile),
+            "hit_pixelid":  (pixel_id.astype(np.int32), pixel),
+            "hit_mc_i":     (pixel_mc_i.astype(np.int32), pixel),
+            "traj_ID":      (tid.astype(np.int32), traj),
+            "traj_type":    (rng.choice(TRAJ_TYPES, n).astype(np.int32), traj),
+            "traj_vx":      (rng.normal(0, 1., n), traj),
+            "traj_vy":      (rng.normal(0, 1., n), traj),
+            "traj_vz":      (rng.uniform(-50., 50., n), traj),
+            "traj_px":      (pt * np.cos(phi), traj),
+            "traj_py":      (pt * np.sin(phi), traj),
+            "traj_pz":      (rng.normal(0, 20., n), traj)}
+
+    return mu3e, mchits
+
+# ------------------------------------
+
+def write_sorted_file(filename, frames, tracks=4., tile_hits=1.5, pixel_hits=8., seed=0):
+    """
+        Writes a synthetic sorted ROOT file with the trees mu3e, mu3e_mchits, alignment/tiles and
+        alignment/sensors (see synthetic_frames for the hit multiplicities). Returns the number of tile hits.
+    """
+    mu3e, mchits   = synthetic_frames(frames, tracks, tile_hits, pixel_hits, seed)
+    tiles, sensors = synthetic_geometry()
+
+    file = ROOT.TFile(filename, "RECREATE")
+    _write_jagged("mu3e", mu3e, frames)
+    file.Close()
+
+    _write_flat("mu3e_mchits", filename, mchits)
+    _write_flat("alignment/tiles", filename, tiles)
+    _write_flat("alignment/sensors", filename, sensors)
+
+    return len(mu3e["tilehit_tile"][0])
@@ -0,0 +1,147 @@
+import os
+import time
+import pstats
+import cProfile
+import contextlib
+from glob import glob
+
+
+# stages of the analyses, in the order they are printed
+STAGES = ["read", "mchits", "geometry", "matching", "helix", "angles", "output"]
+
+# default of the timers of TileHitAngle/TileHitRate (see set_timing)
+_enabled = False
+
+# context of a disabled timer, shared so a stage costs no allocation
+_no_stage = contextlib.nullcontext()
+
+
+#####################
+# private functions #
+#####################
+
+def _add(total, counters):
+    # adds nested dicts of numbers, keys missing in total are copied
+    for key, value in counters.items():
+        if isinstance(value, dict):
+            _add(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+        else:
+            total.setdefault(key, value)
+
+    return total
+
+
+#####################
+# public  functions #
+#####################
+
+def set_timing(enabled=True):
+    """ Switches the stage timers of all TileHitAngle/TileHitRate objects created afterwards on or off """
+    global _enabled
+    _enabled = enabled
+
+# ------------------------------------
+
+def timing_enabled():
+    return _enabled
+
+# ------------------------------------
+
+def add_counters(counters):
+    """ Sums a list of counter dicts (getCounters of several analyses, e.g. the work units of run_mt) """
+    total = {}
+    for c in counters:
+        _add(total, c)
+
+    return total
+
+# ------------------------------------
+
+def format_counters(counters):
+    """ Returns the stage times of a counter dict as a table (one line per stage that was timed) """
+    stages = counters.get("stages", {})
+    total  = sum(s["time"] for s in stages.values())
+    lines  = ["{:<10} {:>10} {:>8} {:>10}".format("stage", "time [s]", "%", "calls")]
+    for name in [s for s in STAGES if s in stages and stages[s]["calls"] != 0]:
+        lines.append("{:<10} {:>10.3f} {:>8.1f} {:>10}".format(name, stages[name]["time"], 100 * stages[name]["time"] / max(total, 1e-12), stages[name]["calls"]))
+
+    return "\n".join(lines)
+
+# ------------------------------------
+
+def profile_call(func, path):
+    """ Runs func() under cProfile and dumps the statistics to path (read them with pstats or load_profiles) """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        profiler.dump_stats(path)
+
+# ------------------------------------
+
+def load_profiles(directory):
+    """ Returns the merged pstats.Stats of all profiles (*.prof) in directory, e.g. of all work units of run_mt """
+    paths = sorted(glob(os.path.join(directory, "*.prof")))
+    if len(paths) == 0:
+        raise ValueError("load_profiles: no profiles in " + directory)
+
+    return pstats.Stats(*paths)
+
+
+# ------------------------------------
+
+class _Stage():
+    __slots__ = ["timer", "name", "start"]
+
+    def __init__ (self, timer, name):
+        self.timer = timer
+        self.name  = name
+
+    def __enter__ (self):
+        self.start = time.perf_counter()
+
+    def __exit__ (self, *args):
+        self.timer.time[self.name]  += time.perf_counter() - self.start
+        self.timer.calls[self.name] += 1
+
+
+# ------------------------------------
+
+class StageTimer():
+    """
+        Cumulative wall time and number of calls of the stages of an analysis (STAGES):
+        read (ROOT file or cache), mchits (hid/tid/pdg/momentum lookups), geometry (tile and pixel positions),
+        matching (tile to pixel hits), helix (trajectory lookup and helix intersection), angles and output.
+        with timer.stage("read"): ... adds the time of the block, stages must not be nested.
+        A disabled timer only returns a shared empty context.
+        enabled: None uses the default of set_timing
+    """
+    def __init__ (self, enabled=None):
+        self.enabled = _enabled if enabled is None else enabled
+        self.reset()
+
+    # ------------------------------------
+
+    def stage(self, name):
+        if not self.enabled:
+            return _no_stage
+
+        return _Stage(self, name)
+
+    # ------------------------------------
+
+    def reset(self):
+        self.time  = dict.fromkeys(STAGES, 0.)
+        self.calls = dict.fromkeys(STAGES, 0)
+
+    # ------------------------------------
+
+    def counters(self):
+        """ Returns {stage: {"time": seconds, "calls": n}} """
+        return {name: {"time": self.time[name], "calls": self.calls[name]} for name in STAGES}
+
+
+# timer of code that is called without one
+NO_TIMER = StageTimer(False)
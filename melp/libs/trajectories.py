@@ -0,0 +1,52 @@
+import numpy as np
+from melp.libs import treeloader as tl
+
+
+class TrajectoryTable():
+    """
+        Trajectories (traj_*) of all frames flattened into arrays with per-frame offsets.
+        (frame, tid) pairs are mapped to rows through a sorted 64 bit key, so whole
+        arrays of pairs can be looked up at once.
+    """
+    def __init__ (self, filename, start=0, stop=None):
+        branches = ["traj_ID", "traj_vx", "traj_vy", "traj_vz", "traj_px", "traj_py", "traj_pz", "traj_type"]
+        dtypes   = {"traj_ID": np.int64, "traj_type": np.int32}
+        for b in branches[1:7]:
+            dtypes[b] = np.float64
+
+        columns       = tl.read_jagged(filename, "mu3e", branches, start, stop, dtypes)
+
+        self.offsets  = columns["traj_ID"].offsets
+        self.tid      = columns["traj_ID"].values
+        self.vertex   = np.column_stack((columns["traj_vx"].values, columns["traj_vy"].values, columns["traj_vz"].values))
+        self.momentum = np.column_stack((columns["traj_px"].values, columns["traj_py"].values, columns["traj_pz"].values))
+        self.type     = columns["traj_type"].values
+
+        # sorted (frame, tid) keys, stable so the first trajectory of a frame wins for duplicate IDs
+        keys          = self.__Get_Keys(columns["traj_ID"].entry_index(), self.tid)
+        self.order    = np.argsort(keys, kind="stable")
+        self.keys     = keys[self.order]
+
+    def __len__ (self):
+        return len(self.tid)
+
+    #####################
+    # private functions #
+    #####################
+
+    def __Get_Keys (self, frame, tid):
+        return (np.asarray(frame, dtype=np.int64) << 32) | (np.asarray(tid, dtype=np.int64) & 0xFFFFFFFF)
+
+    #####################
+    # public  functions #
+    #####################
+
+    def find(self, frame, tid):
+        """ Returns the row of the trajectory with this TID in this frame, -1 if there is none """
+        keys = self.__Get_Keys(frame, tid)
+        if len(self.keys) == 0:
+            return np.full(np.shape(keys), -1, dtype=np.int64)
+
+        pos  = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+
+        return np.where(self.keys[pos] == keys, self.order[pos], -1)
@@ -0,0 +1,201 @@
+import ROOT
+import numpy as np
+from melp.libs import cache as ca
+
+
+class JaggedArray():
+    """
+        Variable length entries stored as one flat array plus offsets.
+        Entry i is values[offsets[i]:offsets[i+1]].
+    """
+    def __init__ (self, values, offsets):
+        self.values  = values
+        self.offsets = offsets
+
+    def __len__ (self):
+        return len(self.offsets) - 1
+
+    def __getitem__ (self, i):
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    # ------------------------------------
+
+    def counts(self):
+        """ Returns the number of values in every entry """
+        return np.diff(self.offsets)
+
+    # ------------------------------------
+
+    def entry_index(self):
+        """ Returns the entry (frame) number of every flat value """
+        return np.repeat(np.arange(len(self)), self.counts())
+
+    # ------------------------------------
+
+    def head(self, n):
+        """ Returns the first n entries as a new JaggedArray (no copy) """
+        n = min(n, len(self))
+        return JaggedArray(self.values[:self.offsets[n]], self.offsets[:n+1])
+
+
+#####################
+# private functions #
+#####################
+
+def _get_dataframe(filename, treename, start, stop):
+    df = ROOT.RDataFrame(treename, filename)
+    if stop is not None and stop <= start:
+        # Range(x, 0) would read until the end of the tree
+        df = df.Range(0, 1).Filter("false")
+    elif start != 0 or stop is not None:
+        df = df.Range(start, 0 if stop is None else stop)
+
+    return df
+
+# ------------------------------------
+
+def _to_jagged(column, dtype=None):
+    counts  = np.fromiter((len(v) for v in column), dtype=np.int64, count=len(column))
+    offsets = np.zeros(len(column) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    if offsets[-1] == 0:
+        values = np.zeros(0, dtype=dtype if dtype is not None else np.float64)
+    else:
+        values = np.concatenate([np.asarray(v, dtype=dtype) for v in column])
+
+    return JaggedArray(values, offsets)
+
+
+def _root_entries(filename, treename):
+    file    = ROOT.TFile(filename)
+    entries = file.Get(treename).GetEntries()
+    file.Close()
+
+    return entries
+
+# ------------------------------------
+
+def _root_branches(filename, treename):
+    return set(str(b) for b in ROOT.RDataFrame(treename, filename).GetColumnNames())
+
+# ------------------------------------
+
+def _root_flat(filename, treename, branches, start, stop):
+    columns = _get_dataframe(filename, treename, start, stop).AsNumpy(list(branches))
+
+    return {b: np.asarray(columns[b]) for b in branches}
+
+# ------------------------------------
+
+def _root_jagged(filename, treename, branches, start, stop, dtypes):
+    columns = _get_dataframe(filename, treename, start, stop).AsNumpy(list(branches))
+
+    return {b: _to_jagged(columns[b], dtypes.get(b)) for b in branches}
+
+
+#####################
+# public  functions #
+#####################
+
+def get_entries(filename, treename="mu3e"):
+    """ Returns the number of entries of a tree """
+    cache = ca.find_cache(filename)
+    if cache is not None and treename in cache.entries:
+        return cache.entries[treename]
+
+    return _root_entries(filename, treename)
+
+# ------------------------------------
+
+def read_flat(filename, treename, branches, start=0, stop=None):
+    """ Reads scalar branches of a tree into a dict of numpy arrays (read-only memory maps if the file has a cache) """
+    cache = ca.find_cache(filename)
+    if cache is not None and cache.has(treename, branches):
+        return {b: cache.flat(treename, b, start, stop) for b in branches}
+
+    return _root_flat(filename, treename, branches, start, stop)
+
+# ------------------------------------
+
+def read_jagged(filename, treename, branches, start=0, stop=None, dtypes=None):
+    """
+        Reads vector branches of a tree into a dict of JaggedArrays (values are read-only memory maps if the file has a cache).
+        dtypes: optional dict branch -> numpy dtype of the flat values
+    """
+    if dtypes is None:
+        dtypes = {}
+
+    cache = ca.find_cache(filename)
+    if cache is not None and cache.has(treename, branches, jagged=True):
+        columns = {}
+        for b in branches:
+            values, offsets = cache.jagged(treename, b, start, stop)
+            columns[b] = JaggedArray(values if b not in dtypes else values.astype(dtypes[b], copy=False), offsets)
+        return columns
+
+    return _root_jagged(filename, treename, branches, start, stop, dtypes)
+
+# ------------------------------------
+
+def prepare_cache(filename, frames_per_block=10000, rows_per_block=1000000):
+    """
+        Decodes all branches used by melp (cache.SCHEMA) once and stores them as a ColumnCache, next to the file
+        or in the directory set with set_cache_dir. All later reads of the file use the cache.
+        The file is read block by block, frames_per_block entries of mu3e and rows_per_block of the other trees.
+        Branches that are not in the file are skipped (they are read from the file if needed).
+    """
+    writer = ca.CacheWriter(filename)
+    try:
+        for treename, schema in ca.SCHEMA.items():
+            entries   = _root_entries(filename, treename)
+            existing  = _root_branches(filename, treename)
+            flat      = [b for b in schema.get("flat", []) if b in existing]
+            jagged    = [b for b in schema.get("jagged", {}) if b in existing]
+            dtypes    = {b: np.dtype(dtype) for b, dtype in schema.get("jagged", {}).items()}
+            block     = frames_per_block if treename == "mu3e" else rows_per_block
+
+            writer.setEntries(treename, entries)
+            # at least one block, so empty trees get (empty) columns too
+            for start in range(0, max(entries, 1), block):
+                stop = min(start + block, entries)
+                if len(flat) != 0:
+                    for b, values in _root_flat(filename, treename, flat, start, stop).items():
+                        writer.appendFlat(treename, b, values)
+                if len(jagged) != 0:
+                    for b, column in _root_jagged(filename, treename, jagged, start, stop, dtypes).items():
+                        writer.appendJagged(treename, b, column.values, column.offsets)
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.close()
+
+    return writer.path
+
+# ------------------------------------
+
+def load_tile_hits(filename, start=0, stop=None, edep=False):
+    """
+        Reads the tile hits of the mu3e tree in bulk.
+        Returns a dict with the JaggedArrays "tilehit_tile", "tilehit_mc_i" (and "tilehit_edep")
+    """
+    branches = ["tilehit_tile", "tilehit_mc_i"]
+    dtypes   = {"tilehit_tile": np.int32, "tilehit_mc_i": np.int64}
+    if edep:
+        branches.append("tilehit_edep")
+        dtypes["tilehit_edep"] = np.float64
+
+    return read_jagged(filename, "mu3e", branches, start, stop, dtypes)
+
+# ------------------------------------
+
+def load_pixel_hits(filename, start=0, stop=None):
+    """
+        Reads the pixel hits of the mu3e tree in bulk.
+        Returns a dict with the JaggedArrays "hit_pixelid" and "hit_mc_i"
+    """
+    branches = ["hit_pixelid", "hit_mc_i"]
+    dtypes   = {"hit_pixelid": np.int64, "hit_mc_i": np.int64}
+
+    return read_jagged(filename, "mu3e", branches, start, stop, dtypes)
@@ -1,121 +1,622 @@
 # import modules
 import melp
 import multiprocessing as mp
-import subprocess
+import concurrent.futures as cf
+import os
+import abc
+import math
+import json
+import time
+import threading
+import itertools
 from glob import glob
 from functools import partial
 import numpy as np
+from melp.libs import treeloader as tl
+from melp.libs import cache as ca
+from melp.libs import geometry as geo
+from melp.libs import results as rs
+from melp.libs import manifest as mn
+from melp.libs import timing as tm
+from melp.libs import progress as pg
+
+
+# detector geometry of a worker process, set once by _init_worker (shared by all files of the run)
+# or read for the file the worker is currently analysing
+_geometry = {"shared": False, "filename": None, "tiles": None, "sensors": None}
+
+
+def _init_worker(tile_geometry, sensor_geometry, progress_queue=None):
+    # None: every worker reads the geometry of its files
+    _geometry["shared"]   = tile_geometry is not None
+    _geometry["filename"] = None
+    _geometry["tiles"]    = tile_geometry
+    _geometry["sensors"]  = sensor_geometry
+
+    # the analyses send their progress to the parent instead of printing it (nothing without a queue)
+    pg.set_reporter(pg.QueueReporter(progress_queue))
+
+
+def _get_geometry(filename):
+    # consecutive units of the same file reuse the geometry
+    if not _geometry["shared"] and _geometry["filename"] != filename:
+        _geometry["filename"] = filename
+        _geometry["tiles"]    = geo.TileGeometry(filename)
+        _geometry["sensors"]  = geo.SensorGeometry(filename)
+
+    return _geometry["tiles"], _geometry["sensors"]
+
+
+# ------------------------------------
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().split()
+    except (OSError, ValueError):
+        return None
+
+
+def _cgroup_cpu_quota():
+    # CPU quota of the container/batch job in cores (cgroup v2 or v1), None if there is none
+    cpu_max = _read_file("/sys/fs/cgroup/cpu.max")
+    if cpu_max is not None and len(cpu_max) == 2 and cpu_max[0] != "max":
+        return int(cpu_max[0]) / int(cpu_max[1])
+
+    quota  = _read_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota is not None and period is not None and int(quota[0]) > 0:
+        return int(quota[0]) / int(period[0])
+
+    return None
+
+
+def available_cpus():
+    """ Number of CPUs this process may use, respects the CPU affinity and cgroup CPU quotas (containers, batch jobs) """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = mp.cpu_count()
+
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+
+    return cpus
+
+
+def free_memory():
+    """ Available memory in bytes (MemAvailable, or the rest of the cgroup memory limit if it is lower), None if unknown """
+    free    = None
+    meminfo = _read_file("/proc/meminfo")
+    if meminfo is not None and "MemAvailable:" in meminfo:
+        free = int(meminfo[meminfo.index("MemAvailable:") + 1]) * 1024
+
+    limit   = _read_file("/sys/fs/cgroup/memory.max")
+    current = _read_file("/sys/fs/cgroup/memory.current")
+    if limit is not None and current is not None and limit[0] != "max":
+        rest = int(limit[0]) - int(current[0])
+        free = rest if free is None else min(free, rest)
+
+    return free
+
+
+def _memory_tight(min_free_memory):
+    if not min_free_memory:
+        return False
+    free = free_memory()
+
+    return free is not None and free < min_free_memory
+
+
+def _throttle(units, done, limit, chunksize, min_free_memory):
+    # feeds the pool (from its task thread), done = [number of finished units, Condition, stopped].
+    # The pool reads its input ahead, so at most limit units are handed out before they have finished,
+    # and no new chunk is handed out while memory is tight and other units are still running
+    for k, unit in enumerate(units):
+        if k % chunksize == 0:
+            # all units before k are in the pool, k - done[0] of them are queued or running
+            with done[1]:
+                while k - done[0] >= limit or (k > done[0] and _memory_tight(min_free_memory)):
+                    if done[2]:
+                        # the pool is terminated, its task thread must not wait for units that never finish
+                        return
+                    done[1].wait(1.)
+        yield unit
+
+
+def _run_chunk(func, chunk):
+    # runs chunksize units in one task of the futures backend
+    return [func(unit) for unit in chunk]
+
+
+def _run_units(func, units, workers, chunksize, backend, initargs, min_free_memory):
+    # yields the results of func for all units in the order they finish
+    if backend == "serial":
+        # everything in this process, e.g. for debugging
+        _init_worker(*initargs)
+        try:
+            for unit in units:
+                yield func(unit)
+        finally:
+            _init_worker(None, None)
+            pg.set_reporter(None)
+
+    elif backend == "process":
+        pool = mp.Pool(workers, _init_worker, initargs)
+        done = [0, threading.Condition(), False]
+        try:
+            # at most two chunks per worker are queued
+            for result in pool.imap_unordered(func, _throttle(units, done, 2 * workers * chunksize, chunksize, min_free_memory), chunksize):
+                with done[1]:
+                    done[0] += 1
+                    done[1].notify()
+                yield result
+        finally:
+            with done[1]:
+                done[2] = True
+                done[1].notify()
+            pool.terminate()
+            pool.join()
+
+    elif backend == "futures":
+        with cf.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+            pending = set()
+            units   = iter(units)
+            for chunk in iter(lambda: list(itertools.islice(units, chunksize)), []):
+                # at most two chunks per worker are queued, none while memory is tight
+                while len(pending) >= 2 * workers or (len(pending) != 0 and _memory_tight(min_free_memory)):
+                    finished, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                    for future in finished:
+                        yield from future.result()
+                pending.add(executor.submit(_run_chunk, func, chunk))
+            for future in cf.as_completed(pending):
+                yield from future.result()
+
+    else:
+        raise ValueError("backend != [process, futures, serial]")
+
+
+# ------------------------------------
+
+#####################
+# jobs              #
+#####################
+
+class Job(abc.ABC):
+    """
+        Base class of everything run_mt can run on work units (plugin API). A subclass implements
+        run(filename, output, start, stop, kwargs, binned), which analyses the frames [start, stop) of
+        one file and returns an AngleResult or RateResult.
+        args:    names of the positional run_mt arguments (the args tuple), in this order
+        formats: keyword arguments that select output formats (passed to result.save) instead of the method
+        methods: methods the job can run, None for any
+    """
+    formats = []
+    methods = None
+
+    def __init__ (self, method, args=()):
+        if self.methods is not None and method not in self.methods:
+            raise ValueError(type(self).__name__ + ": method != " + str(self.methods))
+        self.method = method
+        self.args   = list(args)
+
+    def arguments(self, args, kwargs):
+        """ Returns the keyword arguments of the method and the selected output formats """
+        if not isinstance(args, (tuple, list)):
+            args = (args,)
+        if len(args) > len(self.args):
+            raise ValueError(self.method + ": too many arguments, expected " + str(self.args))
+
+        kwargs  = dict(zip(self.args, args), **kwargs)
+        formats = {name: kwargs.pop(name) for name in self.formats if name in kwargs}
+
+        return kwargs, formats
+
+    @abc.abstractmethod
+    def run(self, filename, output, start, stop, kwargs, binned):
+        pass
+
+
+class AngleJob(Job):
+    """ Runs TileHitAngle.<method>(**kwargs), output formats txt, npz, binned, compressed, records """
+    formats = ["txt", "npz", "binned", "compressed", "records"]
+    # the methods that fill the result of getAngleResult
+    methods = ["hitAngleRec", "hitAnglePixelRec", "hitAngleHelix", "hitAngleTruth"]
+
+    def run(self, filename, output, start, stop, kwargs, binned):
+        tile_geometry, sensor_geometry = _get_geometry(filename)
+        calls = melp.TileHitAngle(filename, output, start=start, stop=stop, tile_geometry=tile_geometry, sensor_geometry=sensor_geometry)
+        getattr(calls, self.method)(**kwargs)
+
+        return calls.getAngleResult(binned)
+
+
+class RateJob(Job):
+    """ Runs TileHitRate.<method>(**kwargs) (a method filling the tileHitRateHID arrays), output formats npz, binned """
+    formats = ["npz", "binned"]
+    methods = ["tileHitRateHID"]
+
+    def run(self, filename, output, start, stop, kwargs, binned):
+        tile_geometry, sensor_geometry = _get_geometry(filename)
+        calls = melp.TileHitRate(filename, output, output+"edep", start=start, stop=stop, tile_geometry=tile_geometry)
+        getattr(calls, self.method)(**kwargs)
+
+        return calls.getRateResult(binned)
+
+
+class MultiJob(Job):
+    """
+        Runs TileHitAngle.hitAngleMulti(requests, **kwargs) and returns a ResultSet with the AngleResult of
+        every request and the RateResult of a "rate" request (output names output and output + "edep"),
+        output formats as AngleJob (npz and binned for the rate result)
+    """
+    formats = AngleJob.formats
+    methods = ["hitAngleMulti"]
+
+    def arguments(self, args, kwargs):
+        kwargs, formats = Job.arguments(self, args, kwargs)
+        if "requests" not in kwargs:
+            raise ValueError(self.method + ": no requests")
+
+        return kwargs, formats
+
+    def run(self, filename, output, start, stop, kwargs, binned):
+        tile_geometry, sensor_geometry = _get_geometry(filename)
+        calls = melp.TileHitAngle(filename, output, start=start, stop=stop, tile_geometry=tile_geometry, sensor_geometry=sensor_geometry)
+        calls.hitAngleMulti(**kwargs)
+
+        results = calls.getAngleResults(binned)
+        rate    = calls.getRateResult(binned)
+        if rate is not None:
+            results[("rate", "", "", "")] = rate
+
+        return rs.ResultSet(results, calls.getCounters())
+
+
+# registered jobs, name -> Job
+_jobs = {}
+
+
+def register_job(name, job):
+    """ Makes job available to run_mt under name """
+    _jobs[name] = job
+
+    return job
+
+
+def get_job(function):
+    """
+        Returns the Job for function: a Job, the name of a registered job or the name of
+        a TileHitAngle/TileHitRate method that fills a single result (AngleJob.methods, RateJob.methods)
+    """
+    if isinstance(function, Job):
+        return function
+    if function in _jobs:
+        return _jobs[function]
+    if function in AngleJob.methods:
+        return AngleJob(function)
+    if function in RateJob.methods:
+        return RateJob(function)
+    if function in MultiJob.methods:
+        return MultiJob(function)
+
+    raise ValueError("Function not found: " + str(function) + ", registered jobs: " + str(sorted(_jobs))
+                     + ", methods: " + str(AngleJob.methods + RateJob.methods + MultiJob.methods))
 
 
 #defining the functions with multithreading support
-#Arguments:
+#Arguments (args tuple of run_mt, or as keyword arguments):
     #-txt, npz, binned: bool, if true it saves in that format
     #-angle: str, "norm" = angle between hit direction and normal vector of tile, "theta" = polar angle, "phi" = azimuth angle
-def mt_tileHitRateHID(input_files, output_files, npz, i):
-    calls = melp.TileHitRate(input_files[0][i], output_files[i], output_files[i]+"edep")
-    print("read file ", i+1)
-    print("started thread ", i+1)
-    calls.tileHitRateHID()
-    if npz == True:
-        calls.saveNpz()
-
-
-def mt_hitAngleRec(input_files, output_files, txt, npz, binned, angle, i):
-    calls = melp.TileHitAngle(input_files[0][i], output_files[i])
-    print("read file ", i+1)
-    print("started thread ", i+1)
-    calls.hitAngleRec(angle=angle)
-    if txt == True:
-        calls.saveTxt()
-    if npz == True:
-        calls.saveNpz()
-    if binned == True:
-        calls.saveBinned()
-
-
-def mt_hitAngleHelix(input_files, output_files, txt, npz, binned, angle, i):
-    calls = melp.TileHitAngle(input_files[0][i], output_files[i])
-    print("read file ", i+1)
-    print("started thread ", i+1)
-    calls.hitAngleHelix(angle=angle)
-    if txt == True:
-        calls.saveTxt()
-    if npz == True:
-        calls.saveNpz()
-    if binned == True:
-        calls.saveBinned()
-
-
-def mt_hitAngleTruth(input_files, output_files, txt, npz, binned, angle, hit_type, particle_type, i):
-    calls = melp.TileHitAngle(input_files[0][i], output_files[i])
-    print("read file ", i+1)
-    print("started thread ", i+1)
-    calls.hitAngleTruth(angle=angle, hit_type=hit_type, particle_type=particle_type)
-    if txt == True:
-        calls.saveTxt()
-    if npz == True:
-        calls.saveNpz()
-    if binned == True:
-        calls.saveBinned()
-
-def mt_hitAnglePixelRec(input_files, output_files, txt, npz, binned, angle, i):
-    calls = melp.TileHitAngle(input_files[0][i], output_files[i])
-    print("read file ", i+1)
-    print("started thread ", i+1)
-    calls.hitAnglePixelRec(angle=angle)
-    if txt == True:
-        calls.saveTxt()
-    if npz == True:
-        calls.saveNpz()
-    if binned == True:
-        calls.saveBinned()
-
-
-
-def run_mt(function_str, src, args):
-#function_str: pass function as str, src: directory of root files to analyse, args: arguments for parallelized function
+register_job("mt_tileHitRateHID",   RateJob("tileHitRateHID", ["npz"]))
+register_job("mt_hitAngleRec",      AngleJob("hitAngleRec", ["txt", "npz", "binned", "angle"]))
+register_job("mt_hitAngleHelix",    AngleJob("hitAngleHelix", ["txt", "npz", "binned", "angle"]))
+register_job("mt_hitAngleTruth",    AngleJob("hitAngleTruth", ["txt", "npz", "binned", "angle", "hit_type", "particle_type"]))
+register_job("mt_hitAnglePixelRec", AngleJob("hitAnglePixelRec", ["txt", "npz", "binned", "angle"]))
+register_job("mt_hitAngleMulti",    MultiJob("hitAngleMulti", ["requests", "txt", "npz", "binned"]))
+
+
+def _run_job(job, input_files, output_files, kwargs, binned, binned_only, checkpoints, profiling, unit):
+    # analyses one work unit (i, start, stop) = frames [start, stop) of input file i in a worker
+    # profiling: (timing, profile directory or None)
+    i, start, stop = unit
+    begin = time.perf_counter()
+
+    timing, profile = profiling
+    enabled = tm.timing_enabled()
+    tm.set_timing(timing)
+    try:
+        run = partial(job.run, input_files[i], output_files[i], start, stop, kwargs, binned)
+        if profile is not None:
+            result = tm.profile_call(run, os.path.join(profile, os.path.basename(output_files[i]) + "_" + str(start) + "_" + str(stop) + ".prof"))
+        else:
+            result = run()
+    finally:
+        # the serial backend runs in the calling process
+        tm.set_timing(enabled)
+    pg.reporter().flush()
+
+    if hasattr(result, "counters"):
+        # time of the unit in the worker (summed when the results are merged)
+        result.counters["elapsed"] = time.perf_counter() - begin
+    if binned_only:
+        # only send the histograms back
+        result = result.binnedOnly()
+    if checkpoints is not None:
+        mn.save_checkpoint(mn.checkpoint_path(checkpoints, output_files[i], start, stop), result)
+
+    return i, start, result
+
+
+# ------------------------------------
+
+def make_work_units(input_files, frames_per_unit=0):
+    """
+        Splits every input file into work units (i, start, stop) of at most frames_per_unit frames,
+        frames_per_unit = 0 gives one unit per file. The units are sorted by size, largest first,
+        so small units fill the gaps at the end of the run.
+    """
+    units = []
+    for i, filename in enumerate(input_files):
+        entries = tl.get_entries(filename)
+        if frames_per_unit == 0 or entries == 0:
+            units.append((i, 0, entries))
+            continue
+        for start in range(0, entries, frames_per_unit):
+            units.append((i, start, min(start + frames_per_unit, entries)))
+
+    units.sort(key=lambda unit: unit[2] - unit[1], reverse=True)
+
+    return units
+
+
+# ------------------------------------
+
+def _concatenate(results):
+    if isinstance(results[0], rs.ResultSet):
+        return rs.ResultSet.concatenate(results)
+    if isinstance(results[0], rs.RateResult):
+        return rs.RateResult.concatenate(results)
+
+    return rs.AngleResult.concatenate(results)
+
+
+def _merge(parts):
+    # parts: list of (start, result) of one file, merged in frame order
+    return _concatenate([result for start, result in sorted(parts, key=lambda part: part[0])])
+
+
+def _outputs(result):
+    # (result, attribute) of all output names of a result
+    if isinstance(result, rs.ResultSet):
+        return [output for r in result.results.values() for output in _outputs(r)]
+    names = ["output_z", "output_rate"] if isinstance(result, rs.RateResult) else ["output"]
+
+    return [(result, name) for name in names]
+
+
+def _set_output(result, output):
+    # output names of a reduced result
+    if isinstance(result, rs.ResultSet):
+        for r in result.results.values():
+            _set_output(r, output)
+    elif isinstance(result, rs.RateResult):
+        result.output_z, result.output_rate = output, output + "edep"
+    else:
+        result.output = output
+
+
+def _save_atomic(save, result):
+    # the output files are written to a temporary directory and then renamed into place
+    names   = _outputs(result)
+    outputs = [getattr(r, name) for r, name in names]
+
+    def save_tmp(tmp):
+        for (r, name), output in zip(names, outputs):
+            setattr(r, name, os.path.join(tmp, os.path.basename(output)))
+        try:
+            save(result)
+        finally:
+            for (r, name), output in zip(names, outputs):
+                setattr(r, name, output)
+
+    mn.atomic_save(save_tmp, os.path.dirname(os.path.abspath(outputs[0])))
+
+
+def _file_summary(filename, output, counters, finished):
+    # summary of one input file, counters: sum of the counters of all its units
+    hits    = counters.get("hits", {})
+    summary = {"input": filename, "output": output, "frames": counters.get("frames", 0),
+               "accepted": counters.get("accepted", hits.get("total", 0)), "elapsed": counters.get("elapsed", 0.),
+               "finished": finished, "hits": hits}
+    if any(stage["calls"] != 0 for stage in counters.get("stages", {}).values()):
+        summary["stages"] = counters["stages"]
+
+    return summary
+
+
+def _save_summary(path, summary):
+    mn.atomic_write(path, lambda f: json.dump(summary, f, indent=1))
+
+
+def _load_checkpoints(manifest, input_files, units):
+    # results of the units finished in an earlier run
+    for i, start, stop in units:
+        yield i, start, mn.load_checkpoint(manifest.checkpoint(input_files[i], start, stop))
+
+
+
+def run_mt(function_str, src, args=(), frames_per_unit=0, chunksize=1, reduce=None, output="out", shared_geometry=True,
+           workers=None, backend="process", min_free_memory=2**30, manifest=None, timing=False, profile=None, progress=True,
+           summary=None, **kwargs):
+#function_str: registered job (e.g. "mt_hitAngleRec"), name of a method of AngleJob/RateJob/MultiJob.methods or a Job
+#src: directory of root files to analyse
+#args: positional arguments of the registered job, kwargs: arguments of the method and output formats (txt, npz, binned, ...)
+#frames_per_unit: files are split into work units of this many frames (0 = one unit per file), the units are handed
+#                 to the threads as they become free, chunksize units at a time
+#reduce: None saves the merged result of every input file as out1, out2, ...
+#        "concat" merges the results of all files (in file and frame order) and "histogram" only the histograms,
+#        the reduced result is saved under the name output and returned
+#shared_geometry: the detector geometry is read once from the first file and used for all files,
+#                 with False every worker reads it from the file it analyses
+#workers: number of worker processes, default is the environment variable MELP_WORKERS or all available cores but two
+#backend: "process" (multiprocessing.Pool), "futures" (concurrent.futures.ProcessPoolExecutor) or "serial" (debugging)
+#min_free_memory: no new units are started while less memory (bytes) is available, 0 disables it
+#manifest: path of a JobManifest (JSON), makes the run resumable: outputs are named output + "_" + input file name,
+#          finished units and files are recorded and skipped when the run is started again
+#timing: time the stages of the analyses (timing.StageTimer) in the workers and print the sum over all units at the end
+#profile: directory, every work unit is run under cProfile and its statistics are saved there as <output>_<start>_<stop>.prof
+#         (timing.load_profiles(directory) merges them)
+#progress: the workers send their analysed frames and hits to this process, which shows one progress line with frames/s and ETA
+#summary: path of a JSON file with a summary of every input file (frames, accepted hits, HID/TID counters, time in the workers),
+#         written whenever a file is finished
+    job = get_job(function_str)
+    kwargs, formats = job.arguments(args, kwargs)
+
+    if reduce not in [None, "concat", "histogram"]:
+        raise ValueError("reduce != [None, concat, histogram]")
+    if backend not in ["process", "futures", "serial"]:
+        raise ValueError("backend != [process, futures, serial]")
+
     # set used threads
     unused_threads = 2 #set the number of threads you don't want to use
+    if workers is None and os.environ.get("MELP_WORKERS"):
+        workers = int(os.environ["MELP_WORKERS"])
+    elif workers is None:
+        workers = available_cpus() - unused_threads
+    threads = max(1, workers)
     print("-----------------------")
-    print("Available threads = ",mp.cpu_count())
-    print("Used threads = ",mp.cpu_count() - unused_threads)
+    print("Available threads = ",available_cpus())
+    print("Used threads = ",threads)
     print("-----------------------")
 
-    input_files = []
-    output_files = []
+    # get list of input files, sorted so the output names do not depend on the order of glob
+    input_files = sorted(glob(src))
 
-
-    # get list of input files
-    input_files.append(glob(src))
+    if manifest is not None:
+        config   = {"function": function_str if isinstance(function_str, str) else type(job).__name__ + "." + job.method,
+                    "kwargs": kwargs, "formats": formats, "frames_per_unit": frames_per_unit, "reduce": reduce, "output": output}
+        manifest = mn.JobManifest(manifest, config)
+        if manifest.complete:
+            print("Run already complete: ", manifest.path)
+            return None
 
     # generate list of output files
-    for j in range(len(input_files[0])):
-        output_files.append("out"+str(j+1))
-
+    if manifest is not None:
+        output_files = [manifest.outputName(f, output) for f in input_files]
+        manifest.save()
+    else:
+        output_files = ["out"+str(j+1) for j in range(len(input_files))]
 
-    # map multiprocessing pool
-    pool = mp.Pool(mp.cpu_count() - unused_threads)
-    if function_str == "mt_tileHitRateHID":
-        func = partial(mt_tileHitRateHID, input_files, output_files, args)
-        pool.map(func, [i for i in range(len(input_files[0]))])
+    # the caches of the files are checked once here (a copied file is hashed in this process only),
+    # the workers find the result in the cache (inherited with fork, else stored in the cache)
+    for filename in input_files:
+        ca.find_cache(filename)
 
-    elif function_str == "mt_hitAngleRec":
-        func = partial(mt_hitAngleRec, input_files, output_files, *args)
-        pool.map(func, [i for i in range(len(input_files[0]))])
+    # split the files into work units
+    units = make_work_units(input_files, frames_per_unit)
+    units_per_file = np.bincount([unit[0] for unit in units], minlength=len(input_files))
+    stops = {(i, start): stop for i, start, stop in units}
 
-    elif function_str == "mt_hitAngleHelix":
-        func = partial(mt_hitAngleHelix, input_files, output_files, *args)
-        pool.map(func, [i for i in range(len(input_files[0]))])
+    # units finished in an earlier run are not processed again
+    finished = []
+    if manifest is not None:
+        if reduce is None:
+            units = [unit for unit in units if not manifest.fileDone(input_files[unit[0]])]
+        finished = [unit for unit in units if manifest.unitDone(input_files[unit[0]], unit[1], unit[2])]
+        units    = [unit for unit in units if not manifest.unitDone(input_files[unit[0]], unit[1], unit[2])]
+        print("Finished work units = ", len(finished))
+    print("Work units = ", len(units))
 
-    elif function_str == "mt_hitAngleTruth":
-        func = partial(mt_hitAngleTruth, input_files, output_files, *args)
-        pool.map(func, [i for i in range(len(input_files[0]))])
+    checkpoints = manifest.directory if manifest is not None else None
+    if profile is not None:
+        profile = os.path.abspath(profile)
+        os.makedirs(profile, exist_ok=True)
+    profiling = (timing, profile)
+    if reduce == "histogram":
+        # the workers only send the histograms back, only the binned output is saved
+        func = partial(_run_job, job, input_files, output_files, kwargs, True, True, checkpoints, profiling)
+        save = lambda result: _save_atomic(lambda r: r.saveBinned(), result)
+    else:
+        func = partial(_run_job, job, input_files, output_files, kwargs, formats.get("binned", False), False, checkpoints, profiling)
+        save = lambda result: _save_atomic(lambda r: r.save(**formats), result)
 
-    elif function_str == "mt_hitAnglePixelRec":
-        func = partial(mt_hitAnglePixelRec, input_files, output_files, *args)
-        pool.map(func, [i for i in range(len(input_files[0]))])
+    # position of every unit in the reduction tree: file and frame order for concatenated arrays,
+    # order of submission for histograms (units that finish at the same time are merged first)
+    if reduce == "concat":
+        position = {(i, start): k for k, (i, start, stop) in enumerate(sorted(finished + units))}
+    else:
+        position = {(i, start): k for k, (i, start, stop) in enumerate(finished + units)}
+    reducer = rs.TreeReducer(len(finished + units), _concatenate)
 
+    if shared_geometry and len(input_files) != 0:
+        # every worker gets the geometry once when it starts (copy-on-write with fork)
+        geometry = (geo.TileGeometry(input_files[0]), geo.SensorGeometry(input_files[0]))
     else:
-        raise ValueError("Function not found")
+        geometry = (None, None)
+
+    # progress of all workers in one line, the workers only send their counts
+    queue   = mp.Queue() if progress else None
+    monitor = pg.ProgressMonitor(queue, sum(stop - start for i, start, stop in units)).start() if progress else None
+    say     = monitor.message if progress else print
+
+    begin       = time.perf_counter()
+    run_summary = {"function": function_str if isinstance(function_str, str) else type(job).__name__ + "." + job.method,
+                   "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "workers": threads, "files": []}
+
+    # units are handed out as threads become free
+    parts   = {}
+    results = _run_units(func, units, min(threads, max(len(units), 1)), chunksize, backend, geometry + (queue,), min_free_memory)
+    if manifest is not None:
+        results = itertools.chain(_load_checkpoints(manifest, input_files, finished), results)
+    counters      = []
+    file_counters = {}
+    try:
+        for i, start, result in results:
+            if manifest is not None:
+                manifest.setUnitDone(input_files[i], start, stops[(i, start)])
+            counters.append(getattr(result, "counters", {}))
+
+            file_counters.setdefault(i, []).append(counters[-1])
+            if summary is not None and len(file_counters[i]) == units_per_file[i]:
+                run_summary["files"].append(_file_summary(input_files[i], output_files[i] if reduce is None else None,
+                                                          tm.add_counters(file_counters.pop(i)), time.perf_counter() - begin))
+                _save_summary(summary, run_summary)
+
+            if reduce is not None:
+                reducer.add(position[(i, start)], result)
+                continue
+
+            parts.setdefault(i, []).append((start, result))
+            if len(parts[i]) < units_per_file[i]:
+                continue
+
+            # all units of file i are done
+            file_parts = parts.pop(i)
+            save(_merge(file_parts))
+            if manifest is not None:
+                manifest.setFileDone(input_files[i], [(start, stops[(i, start)]) for start, result in file_parts])
+            say("finished file ", i+1)
+    finally:
+        if monitor is not None:
+            monitor.close()
+
+    if summary is not None:
+        run_summary["elapsed"] = time.perf_counter() - begin
+        _save_summary(summary, run_summary)
+
+    if timing:
+        print("Stage times of all work units:")
+        print(tm.format_counters(tm.add_counters(counters)))
+
+    if reduce is not None and len(finished + units) != 0:
+        result = reducer.result()
+        _set_output(result, output)
+        save(result)
+        if manifest is not None:
+            manifest.setComplete()
+            for j, filename in enumerate(input_files):
+                manifest.removeCheckpoints(filename, [(start, stop) for i, start, stop in finished + units if i == j])
 
-    pool.close()
+        return result
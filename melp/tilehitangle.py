@@ -1,536 +1,755 @@
-import ROOT
 import numpy as np
 from melp.libs import mathfunctions as mf
 from melp.libs import helices as hl
-
-import gc
+from melp.libs import geometry as geo
+from melp.libs import matching as ma
+from melp.libs import frames as fr
+from melp.libs import histogram as hi
+from melp.libs import results as rs
+from melp.libs import resultstore as rst
+from melp.libs import timing as tm
+from melp.libs import progress as pg
 
 
 class TileHitAngle():
-    def __init__ (self, filename, output):
+    def __init__ (self, filename, output, chunk_size=0, start=0, stop=None, tile_geometry=None, sensor_geometry=None, compact=True, timing=None):
+        """
+            chunk_size: 0 reads the whole file at once, otherwise the analysis methods read and
+                        process chunk_size frames at a time (see iterHitAngle)
+            start, stop: only the frames [start, stop) of the file are analysed (e.g. one work unit of run_mt)
+            tile_geometry, sensor_geometry: already loaded TileGeometry/SensorGeometry (e.g. shared by all
+                        files of a run), read from the file if None
+            compact:    results are kept as float32 z/angle/vector and int32 tile id (float64/int64 if False)
+            timing:     time the stages of the analyses (see getCounters), None uses the default of timing.set_timing
+        """
         self.filename     = filename
         self.output       = output
+        self.chunk_size   = chunk_size
+        self.start        = start
 
-        self.result_z     = np.zeros(0)
-        self.result_angle = np.zeros(0)
-        self.result_id    = np.zeros(0)
-
-        self.file         = ROOT.TFile(filename)
-        self.mu3e_mchits  = self.file.Get("mu3e_mchits")
-        self.mu3e         = self.file.Get("mu3e")
-        self.sensor       = self.file.Get("alignment/sensors")
-        self.tiles        = self.file.Get("alignment/tiles")
-
-        self.tilehit_tile_dic = {}
-        self.tile_mc_i        = {}
-        self.tile_id_pos      = {}
-        self.tile_id_dir      = {}
-
-        self.sensor_id_index  = {}
+        # one structured record per hit (see results.angle_dtype), result_z, result_angle, result_id
+        # and the (N,3) hit directions result_vector are views of its fields
+        self.compact   = compact
+        self.__Set_Results(np.zeros(0, dtype=rs.angle_dtype(compact)))
+        self.method    = ""
 
         self.hit_type  = ""
         self.ana_tpye  = ""
         self.angle     = ""
 
-        # initialize dictionaries
-        for i in range(self.mu3e.GetEntries()):
-            self.mu3e.GetEntry(i)
-            temp_arr_1 = []
-            for j in self.mu3e.tilehit_mc_i:
-                temp_arr_1.append(j)
-            self.tile_mc_i[i] = temp_arr_1
-
-            temp_arr_2 = []
-            for j in self.mu3e.tilehit_tile:
-                temp_arr_2.append(j)
-            self.tilehit_tile_dic[i] = temp_arr_2
-
-        for i in range(self.tiles.GetEntries()):
-            self.tiles.GetEntry(i)
-            # direction
-            xyz = []
-            xyz.append(self.tiles.dirx)
-            xyz.append(self.tiles.diry)
-            xyz.append(self.tiles.dirz)
-
-            self.tile_id_dir[self.tiles.sensor] = xyz
-
-            # position
-            tile_xyz = []
-            tile_xyz.append(self.tiles.posx)
-            tile_xyz.append(self.tiles.posy)
-            tile_xyz.append(self.tiles.posz)
-            self.tile_id_pos[self.tiles.sensor] = tile_xyz
-
-        for i in range(self.sensor.GetEntries()):
-            self.sensor.GetEntry(i)
-            self.sensor_id_index[self.sensor.sensor] = i
+        self.counters  = {}
+        self.histogram = None
+
+        # cumulative time of the analysis stages and number of analysed frames
+        self.timer      = tm.StageTimer(timing)
+        self.n_analysed = 0
+        self.accepted   = 0
+
+        # progress output (a queue to the parent process in run_mt workers)
+        self.progress   = pg.reporter()
+
+        # results of hitAngleMulti
+        self.matching      = "nearest"
+        self.multi_results = {}
+        self.rate_hits     = None
+
+        # detector geometry
+        self.tile_geometry    = geo.TileGeometry(filename) if tile_geometry is None else tile_geometry
+        self.tile_id_pos      = self.tile_geometry.pos_dict()
+        self.tile_id_dir      = self.tile_geometry.dir_dict()
+        self.sensor_geometry  = geo.SensorGeometry(filename) if sensor_geometry is None else sensor_geometry
+
+        if chunk_size == 0 and start == 0 and stop is None:
+            # read tile hits and mchits of the whole file in bulk
+            with self.timer.stage("read"):
+                self.frames   = fr.FrameChunk(filename)
+            self.tilehit_tile = self.frames.tilehit_tile
+            self.tile_mc_i    = self.frames.tile_mc_i
+            self.mchits       = self.frames.mchits
+            self.n_frames     = len(self.frames)
+        else:
+            # frames are read chunk by chunk while they are analysed
+            self.frames       = None
+            self.n_frames     = fr.range_length(filename, start, stop)
+            if chunk_size == 0:
+                # the whole frame range is one chunk
+                self.chunk_size = max(self.n_frames, 1)
 
     #####################
     # private functions #
     #####################
 
-    def __Get_TID_from_Frame_ID (self, mc_i):
-        self.mu3e_mchits.GetEntry(mc_i)
-        tid = self.mu3e_mchits.tid
+    def __Check_N (self, n):
+        if n > self.n_frames or n == 0:
+            n = self.n_frames
+        self.n_analysed = n
+        self.accepted   = 0
 
-        return tid
+        self.progress = pg.reporter()
+        self.progress.start(n)
+        self.progress.message("Frames to analyze: ", n, " of ",  self.n_frames)
 
-    # ------------------------------------
-    def __Get_HID_from_MC_I (self, mc_i):
-        self.mu3e_mchits.GetEntry(mc_i)
-        hid = self.mu3e_mchits.hid
+        return n
 
-        return hid
+    # ------------------------------------
+    def __Iter_Chunks (self, n, pixels=False, trajectories=False, edep=False):
+        # every analysis reads its chunks here, the progress output ends when they are done
+        try:
+            if self.frames is not None:
+                yield self.frames
+                return
+
+            stop = self.start + n
+            for start in range(self.start, stop, self.chunk_size):
+                with self.timer.stage("read"):
+                    chunk = fr.FrameChunk(self.filename, start, min(start + self.chunk_size, stop), edep=edep, pixels=pixels, trajectories=trajectories)
+                yield chunk
+        finally:
+            self.progress.finish()
 
     # ------------------------------------
-    def __Get_TID_from_MC_I (self, mc_i):
-        self.mu3e_mchits.GetEntry(mc_i)
-        tid = self.mu3e_mchits.tid
+    def __Frames_In_Chunk (self, chunk, n):
+        # number of frames of the chunk that belong to the first n frames of the analysed range
+        return max(0, min(self.start + n - chunk.start, len(chunk)))
 
-        return tid
+    # ------------------------------------
+    def __Report (self, chunk, first, last):
+        # frames [first, last) of the chunk were analysed
+        offsets = chunk.tilehit_tile.offsets
+        self.progress.update(last - first, int(offsets[last] - offsets[first]))
 
     # ------------------------------------
-    def __Get_Sensor_IDs_from_Frame_ID (self, entry):
-        self.mu3e.GetEntry(entry)
+    def __Get_Frame_Pixels (self, chunk, entry):
+        """
+            Decodes all pixel hits of one frame at once.
+            Returns the pixel ids, their (N,3) positions and their TIDs
+        """
+        pixel_hits = chunk.pixelHits()
+        sensor_ids = pixel_hits["hit_pixelid"][entry]
+        with self.timer.stage("geometry"):
+            pixel_pos = self.__Get_Sensor_Pos_from_Pixel_ID(sensor_ids).reshape(-1, 3)
+        with self.timer.stage("mchits"):
+            pixel_tid = chunk.mchits.tid[pixel_hits["hit_mc_i"][entry]]
 
-        # Get Sensor IDs
-        hit_id_arr = []
+        return sensor_ids, pixel_pos, pixel_tid
 
-        sensor_id_arr = []
-        for j in self.mu3e.hit_pixelid:
-            sensor_id_arr.append(j)
+    # ------------------------------------
+    def __Get_Sensor_Pos_from_Pixel_ID (self, pixelid):
+        return self.sensor_geometry.position(pixelid)
 
-        # Get MC index
-        mc_i_arr = []
-        for j in self.mu3e.hit_mc_i:
-            mc_i_arr.append(j)
+    # ------------------------------------
+    def __Chunk_Result (self, z_arr, angle_arr, id_arr, vectors=None):
+        result = np.array(z_arr, dtype=np.float64), np.array(angle_arr, dtype=np.float64), np.array(id_arr, dtype=np.int64)
+        if vectors is None:
+            return result
 
-        return sensor_id_arr, mc_i_arr
+        return result + (np.asarray(vectors, dtype=np.float64).reshape(-1, 3),)
 
     # ------------------------------------
-    def __Get_Sensor_Pos_from_Pixel_ID (self, pixelid):
-        pixel       = pixelid >> 16
-        pixel_index = self.sensor_id_index[pixel]
-        self.sensor.GetEntry(pixel_index)
+    def __Collect (self, chunks):
+        # fill the results of all chunks into one structured array
+        self.__Set_Results(self.__Fill_Records(chunks))
 
-        row_param = pixelid & 0xFF
-        col_param = (pixelid >> 8) & 0xFF
+        return self.result_z, self.result_angle, self.result_id
 
-        sensor_pos_vxyz = []
-        sensor_pos_vxyz.append(self.sensor.vx)
-        sensor_pos_vxyz.append(self.sensor.vy)
-        sensor_pos_vxyz.append(self.sensor.vz)
+    # ------------------------------------
+    def __Fill_Records (self, chunks):
+        records = rs.GrowableArray(rs.angle_dtype(self.compact))
+        for z, angle, id, vectors in chunks:
+            with self.timer.stage("output"):
+                records.append(z=z, angle=angle, id=id, vector=vectors)
 
-        sensor_pos_col = []
-        sensor_pos_col.append(self.sensor.colx)
-        sensor_pos_col.append(self.sensor.coly)
-        sensor_pos_col.append(self.sensor.colz)
+        return records.finish()
 
-        sensor_pos_row = []
-        sensor_pos_row.append(self.sensor.rowx)
-        sensor_pos_row.append(self.sensor.rowy)
-        sensor_pos_row.append(self.sensor.rowz)
+    # ------------------------------------
+    def __Set_Results (self, results):
+        self.results       = results
+        self.result_z      = results["z"]
+        self.result_angle  = results["angle"]
+        self.result_id     = results["id"]
+        self.result_vector = results["vector"]
 
-        pos = np.array(sensor_pos_vxyz) + (col_param+0.5)*np.array(sensor_pos_col) + (row_param+0.5)*np.array(sensor_pos_row)
-        return pos
+    # ------------------------------------
+    def __Get_Histogram (self, angle, bins):
+        # fixed binning: z over all tile positions, angle over its full range
+        z_range = (self.tile_geometry.pos[:, 2].min(), self.tile_geometry.pos[:, 2].max())
+        if angle == "phi":
+            angle_range = (-180., 180.)
+        else:
+            angle_range = (0., 180.)
+
+        return hi.Histogram2D(bins, range=(z_range, angle_range))
 
     # ------------------------------------
-    def __Get_Traj_from_TID (self, entry, tid):
-        self.mu3e.GetEntry(entry)
-        traj_id = np.array(self.mu3e.traj_ID)
-        index = np.where(traj_id == tid)[0]
-        try:
-            index = int(index[0])
-        except:
-            return None, None, None, None, None, None, None
+    def __Frame_Vectors (self, chunk, m, rec, pixelrec, max_distance, counters):
+        """
+            Matches tile hits and pixel hits of the first m frames of the chunk,
+            every frame is decoded once for both reconstructions. Returns {"rec": (tile ids, vectors), "pixelrec": (tile ids, vectors)}
+            rec:      vector from the tile to the nearest pixel hit of the same trajectory
+            pixelrec: vector between the nearest pixel hits of the trajectory in layer 2 and layer 3
+        """
+        rec_ids, rec_vec, pix_ids, pix_vec = [], [np.zeros((0, 3))], [], [np.zeros((0, 3))]
+
+        # pixel hits of a whole file are read on first use
+        with self.timer.stage("read"):
+            chunk.pixelHits()
 
-        vx   = self.mu3e.traj_vx
-        vy   = self.mu3e.traj_vy
-        vz   = self.mu3e.traj_vz
-        px   = self.mu3e.traj_px
-        py   = self.mu3e.traj_py
-        pz   = self.mu3e.traj_pz
-        type = self.mu3e.traj_type
+        # loop over all Root frames
+        reported = 0
+        for i in range(m):
+            # report progress every 1000 frames
+            if i - reported == 1000:
+                self.__Report(chunk, reported, i)
+                reported = i
+
+            ##################################
+            # HID CHECK
+            # only primary hit gets analyzed
+            ##################################
+            tile_ids  = chunk.tilehit_tile[i]
+            tile_mc_i = chunk.tile_mc_i[i]
+            with self.timer.stage("mchits"):
+                primary = chunk.mchits.hid[tile_mc_i] == 1
+            counters["hid_ok"]      += int(np.count_nonzero(primary))
+            counters["hid_discard"] += len(primary) - int(np.count_nonzero(primary))
+            if not np.any(primary):
+                continue
+
+            # decode all pixel hits of the frame once
+            sensor_ids, pixel_pos, pixel_tid = self.__Get_Frame_Pixels(chunk, i)
+
+            tile_ids = tile_ids[primary]
+            with self.timer.stage("geometry"):
+                tile_pos = self.tile_geometry.position(tile_ids)
+            with self.timer.stage("mchits"):
+                tid_tile = chunk.mchits.tid[tile_mc_i[primary]]
+
+            ##################################
+            # TID CHECK
+            # check for matching sensor and tile hits
+            ##################################
+            with self.timer.stage("matching"):
+                matcher = ma.FrameMatcher(pixel_pos, pixel_tid)
+                for t in tid_tile.tolist():
+                    counters["tid_ok"]      += matcher.count(t)
+                    counters["tid_discard"] += len(sensor_ids) - matcher.count(t)
+
+                if rec:
+                    ##################################
+                    # the nearest matching sensor hit is used to approximate the trajectory
+                    ##################################
+                    # distance can be zero!
+                    nearest, _ = matcher.nearest(tile_pos, tid_tile, max_distance)
+                    found      = nearest >= 0
+
+                    rec_ids.append(tile_ids[found])
+                    rec_vec.append(pixel_pos[nearest[found]] - tile_pos[found])
+
+                if pixelrec:
+                    ##################################
+                    # the nearest matching sensor hits are used to approximate the trajectory
+                    ##################################
+                    pixel_sensor = sensor_ids >> 16
 
-        return vx[index], vy[index], vz[index], px[index], py[index], pz[index], type[index]
+                    # only the first hit of every TID on every sensor is used
+                    _, first  = np.unique(np.column_stack((pixel_tid, pixel_sensor)), axis=0, return_index=True)
+                    candidate = np.sort(first)
+                    k         = pixel_sensor[candidate]
+
+                    #split pixel ids into different pixel layers
+                    #pixel ids 2000 <= ID < 3000 || 14000 <= ID < 15200
+                    #pixel ids 3000 <= ID < 4000 || 15200 <= ID < 16500
+                    layer2 = candidate[((k >= 10000) & (k < 11500)) | ((k >= 14000) & (k < 15200))]
+                    layer3 = candidate[((k >= 11500) & (k < 12500)) | ((k >= 15200) & (k < 16500))]
+
+                    matcher_layer2 = ma.FrameMatcher(pixel_pos[layer2], pixel_tid[layer2])
+                    matcher_layer3 = ma.FrameMatcher(pixel_pos[layer3], pixel_tid[layer3])
+
+                    # find nearest pixel in layer 2 to the tile, then nearest pixel in layer 3 to it
+                    index_2, _ = matcher_layer2.nearest(tile_pos, tid_tile)
+                    found_2    = index_2 >= 0
+                    pixel_pos_layer2 = pixel_pos[layer2[index_2[found_2]]]
+
+                    index_3, _ = matcher_layer3.nearest(pixel_pos_layer2, tid_tile[found_2])
+                    found_3    = index_3 >= 0
+                    pixel_pos_layer2 = pixel_pos_layer2[found_3]
+                    pixel_pos_layer3 = pixel_pos[layer3[index_3[found_3]]]
+
+                    pix_ids.append(tile_ids[found_2][found_3])
+                    pix_vec.append(pixel_pos_layer3 - pixel_pos_layer2)
+
+        self.__Report(chunk, reported, m)
+
+        result = {}
+        if rec:
+            result["rec"]      = (self.__Ids(rec_ids), np.concatenate(rec_vec))
+        if pixelrec:
+            result["pixelrec"] = (self.__Ids(pix_ids), np.concatenate(pix_vec))
+
+        return result
+
+    # ------------------------------------
+    def __Truth_Vectors (self, chunk, m, hit_type, particle_type):
+        """ Returns the tile ids and the MC momenta of the selected tile hits of the first m frames of the chunk """
+        # all tile hits of the chunk
+        tile_ids = chunk.tilehit_tile.head(m).values
+        mc_i     = chunk.tile_mc_i.head(m).values
+
+        #############
+        # HID CHECK #
+        #############
+        with self.timer.stage("mchits"):
+            hid = chunk.mchits.hid[mc_i]
+            pdg = chunk.mchits.pdg[mc_i]
+        if hit_type == "primary":
+            # only primary hit gets analyzed
+            mask = hid == 1
+        elif hit_type == "secondary":
+            mask = hid == 1
+        elif hit_type == "all":
+            mask = np.ones(len(mc_i), dtype=bool)
+        else:
+            raise ValueError("hit_type: not supported")
+
+        #############
+        # PDG Check #
+        #############
+        if particle_type == "electron":
+            mask &= pdg == 11
+        elif particle_type == "positron":
+            mask &= pdg == -11
+        elif particle_type == "all":
+            pass
+        else:
+            raise ValueError("particle_type: not supported")
+
+        with self.timer.stage("mchits"):
+            p_in = chunk.mchits.p_in[mc_i[mask]]
+
+        return tile_ids[mask], p_in
 
     # ------------------------------------
-    def __Get_Momentum_from_MC_I (self, mc_i):
-        self.mu3e_mchits.GetEntry(mc_i)
+    def __Helix_Vectors (self, chunk, m, counters):
+        """ Returns the tile ids and the helix directions at the tiles of the primary tile hits of the first m frames of the chunk """
+        # all tile hits of the chunk
+        tile_ids = chunk.tilehit_tile.head(m).values
+        mc_i     = chunk.tile_mc_i.head(m).values
+        frame    = chunk.tilehit_tile.head(m).entry_index()
+
+        ##################################
+        # HID CHECK
+        # only primary hit gets analyzed
+        ##################################
+        with self.timer.stage("mchits"):
+            primary = chunk.mchits.hid[mc_i] == 1
+        counters["hid_ok"]      += int(np.count_nonzero(primary))
+        counters["hid_discard"] += len(primary) - int(np.count_nonzero(primary))
+
+        tile_ids = tile_ids[primary]
+        mc_i     = mc_i[primary]
+        frame    = frame[primary]
+
+        # trajectories of all hits in one gather
+        with self.timer.stage("read"):
+            trajectories = chunk.trajectoryTable()
+        with self.timer.stage("mchits"):
+            tid = chunk.mchits.tid[mc_i]
+        with self.timer.stage("helix"):
+            index = trajectories.find(frame, tid)
+        found        = index >= 0
+        counters["no_traj"] += len(index) - int(np.count_nonzero(found))
+
+        # electron or position
+        # if type == 2 or type == 3:
+        # TODO: dont mix electrons with positions
+        tile_ids = tile_ids[found]
+        index    = index[found]
+        type_1   = np.abs(trajectories.type[index]) % 10
+        helix_ok = (type_1 == 1) | (type_1 == 2)
+
+        tile_ids = tile_ids[helix_ok]
+        index    = index[helix_ok]
+        type_1   = type_1[helix_ok]
+
+        with self.timer.stage("geometry"):
+            tile_pos = self.tile_geometry.position(tile_ids)
+
+        # intersect all helices with their tiles at once
+        with self.timer.stage("helix"):
+            vx, vy, vz = trajectories.vertex[index].T
+            px, py, pz = trajectories.momentum[index].T
+            vectors    = hl.HelixBatch(vx, vy, vz, px, py, pz, type_1, tile_pos).hitVector()
+
+        return tile_ids, vectors
 
-        px   = self.mu3e_mchits.p_in_x
-        py   = self.mu3e_mchits.p_in_y
-        pz   = self.mu3e_mchits.p_in_z
+    # ------------------------------------
+    def __Ids (self, id_list):
+        if len(id_list) == 0:
+            return np.zeros(0, dtype=np.int32)
 
-        p_xyz    = np.zeros(3)
-        p_xyz[0] = px
-        p_xyz[1] = py
-        p_xyz[2] = pz
+        return np.concatenate(id_list)
 
-        return p_xyz
+    # ------------------------------------
+    def __Get_Angles (self, method, vectors, tile_ids, angle):
+        """
+            Angles of the (N,3) hit vectors of one method, all hits at once. rec/pixelrec vectors point
+            from the tile to the pixels, truth/helix vectors along the track, so the reference vectors
+            (and the sign of phi) differ between the methods.
+        """
+        vectors   = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+        with self.timer.stage("geometry"):
+            tile_norm = self.tile_geometry.direction(tile_ids)
+
+        if method == "rec" or method == "pixelrec":
+            z_axis, phi_norm, phi_sign = np.array([0,0,1]), tile_norm, -1
+        elif method == "truth":
+            z_axis, phi_norm, phi_sign = np.array([0,0,-1]), -tile_norm, -1
+        elif method == "helix":
+            z_axis, phi_norm, phi_sign = np.array([0,0,-1]), -tile_norm, 1
+        else:
+            raise ValueError("method != [rec, pixelrec, truth, helix]")
+
+        with self.timer.stage("angles"):
+            if angle == "norm":
+                return mf.angles_between(vectors, tile_norm)
+            elif angle == "theta":
+                return mf.angles_between(vectors, z_axis)
+            elif angle == "phi":
+                return phi_sign * mf.angles_between_phi(vectors[:, 0:2], phi_norm[:, 0:2])
+            else:
+                raise ValueError('ERROR: angle != [norm, theta, phi]')
 
     # ------------------------------------
-    def __Get_PDG_from_MC_I (self, mc_i):
-        self.mu3e_mchits.GetEntry(mc_i)
+    def __Angle_Result (self, method, vectors, tile_ids, angle):
+        """ (z, angle, id, vectors) of the hits of one chunk """
+        with self.timer.stage("geometry"):
+            z = self.tile_geometry.z(tile_ids)
+        self.accepted += len(z)
 
-        return self.mu3e_mchits.pdg
+        return self.__Chunk_Result(z, self.__Get_Angles(method, vectors, tile_ids, angle), tile_ids, vectors)
 
+    # ------------------------------------
+    def __Labels (self, method, matching="nearest", hit_type="primary", particle_type="all"):
+        """ Returns ana_type, hit_type of the output names of a method """
+        if method == "truth":
+            return "Truth" + particle_type, hit_type
+        elif method == "helix":
+            return "Helix", "primary"
+        elif method == "pixelrec":
+            return "PixelSensorMatching" + matching, "primary"
 
-    #####################
-    # public  functions #
-    #####################
+        return "SensorMatching" + matching, "primary"
 
-    def hitAnglePixelRec(self, n=0, angle="norm", matching="nearest"):
-        self.hit_type = "primary"
-        self.ana_tpye = "SensorMatching" + matching
-        self.angle    = angle
+    # ------------------------------------
+    def __Pixel_Rec_Chunks (self, n, angle, matching):
+        self.ana_tpye, self.hit_type = self.__Labels("pixelrec", matching)
+        self.angle = angle
+        self.method = "pixelrec"
 
         # counters
-        hid_discard = 0
-        hid_ok      = 0
-        tid_discard = 0
-        tid_ok      = 0
+        self.counters = {"hid_ok": 0, "hid_discard": 0, "tid_ok": 0, "tid_discard": 0}
 
+        n = self.__Check_N(n)
 
-        # Check Argument
-        if n > len(self.tilehit_tile_dic) or n == 0:
-            n = len(self.tilehit_tile_dic)
-        print("Frames to analyze: ", n, " of ",  len(self.tilehit_tile_dic))
+        for chunk in self.__Iter_Chunks(n, pixels=True):
+            m                  = self.__Frames_In_Chunk(chunk, n)
+            tile_ids, vectors  = self.__Frame_Vectors(chunk, m, False, True, None, self.counters)["pixelrec"]
 
-        # Define Arrays for result
-        angle_sensor_tile = []
-        z_arr  = []
-        id_arr = []
+            yield self.__Angle_Result("pixelrec", vectors, tile_ids, angle)
 
-        # loop over all Root frames
-        for i in range(n):
-            # loop over all tile hits in one Root frame
-            for u in range(len(self.tilehit_tile_dic[i])):
-                ##################################
-                # HID CHECK
-                # only primary hit gets analyzed
-                ##################################
-                tile_id  = self.tilehit_tile_dic[i][u]
-                hid_test = self.__Get_HID_from_MC_I(self.tile_mc_i[i][u])
-                if hid_test != 1:
-                    hid_discard += 1
-                    continue
-                hid_ok += 1
-
-                sensor_ids_tmp, sensor_frame_mc_i_tmp = self.__Get_Sensor_IDs_from_Frame_ID(i)
-
-                tmp_distance_tile_to_pixel_layer2    = []
-                tmp_distance_pixel_to_pixel          = []
-
-                tile_pos = self.tile_id_pos[tile_id]
-
-                # TID for tile
-                tid_tile_test   = self.__Get_TID_from_MC_I(self.tile_mc_i[i][u])
-
-                ##################################
-                # TID CHECK
-                # check for matching sensor and tile hits
-                ##################################
-                sensor_id_tid   = []
-                sensor_mc_i_tid = []
-                for g in range(len(sensor_ids_tmp)):
-                    tid_sensor_test = self.__Get_TID_from_MC_I(sensor_frame_mc_i_tmp[g])
-                    if tid_sensor_test != tid_tile_test:
-                        tid_discard += 1
-                        continue
-                    tid_ok += 1
-                    sensor_id_tid.append(sensor_ids_tmp[g])
-                    sensor_mc_i_tid.append(sensor_frame_mc_i_tmp[g])
-
-                #split pixel ids into different pixel layers
-                pixel_ids = []
-                for l in sensor_id_tid:
-                    pixel_ids.append(l >> 16)
-
-                sensor_ids_layer2        = [] #pixel ids 2000 <= ID < 3000 || 14000 <= ID < 15200
-                sensor_frame_mc_i_layer2 = []
-                sensor_ids_layer3        = [] #pixel ids 3000 <= ID < 4000 || 15200 <= ID < 16500
-                sensor_frame_mc_i_layer3 = []
-
-                for k in pixel_ids:
-                    #if (k >= 2000 and k < 3000) or (k >= 14000 and k < 15200):
-                    if (k >= 10000 and k < 11500) or (k >= 14000 and k < 15200):
-                        index_id_2 = np.where(np.array(pixel_ids) == k)
-                        sensor_ids_layer2.append(sensor_id_tid[index_id_2[0][0]])
-                        sensor_frame_mc_i_layer2.append(sensor_mc_i_tid[index_id_2[0][0]])
-
-                    #elif (k >= 3000 and k < 4000) or (k >= 15200 and k < 16500):
-                    elif (k >= 11500 and k < 12500) or (k >= 15200 and k < 16500):
-                        index_id_3 = np.where(np.array(pixel_ids) == k)
-                        sensor_ids_layer3.append(sensor_id_tid[index_id_3[0][0]])
-                        sensor_frame_mc_i_layer3.append(sensor_mc_i_tid[index_id_3[0][0]])
-
-
-                # loop over all pixel hits in one Root frame
-                pixel_pos_layer2 = []
-                pixel_pos_layer3 = []
-                # find distance tile to pixel (in layer 2)
-                for v in range(len(sensor_ids_layer2)):
-                    pixel_id_layer2  = sensor_ids_layer2[v]
-                    pixel_pos_layer2 = self.__Get_Sensor_Pos_from_Pixel_ID(pixel_id_layer2)
-                    distance_layer2  = np.sqrt((tile_pos[0]-pixel_pos_layer2[0])**2 + (tile_pos[1]-pixel_pos_layer2[1])**2 + (tile_pos[2]-pixel_pos_layer2[2])**2)
-
-                    tmp_distance_tile_to_pixel_layer2.append(distance_layer2)
-                    ##################################
-                    # the nearest matching sensor hits are used to approximate the trajectory
-                    ##################################
-                    # tmp_distance_tile_to_pixel can be zero!
-                if len(tmp_distance_tile_to_pixel_layer2) != 0:
-                    index_2     = np.where(tmp_distance_tile_to_pixel_layer2 == np.min(tmp_distance_tile_to_pixel_layer2))[0][0]
-                    sensor_id_layer2 = sensor_ids_layer2[index_2]
-                    pixel_pos_layer2 = self.__Get_Sensor_Pos_from_Pixel_ID(sensor_id_layer2)
+    # ------------------------------------
+    def __Truth_Chunks (self, n, angle, hit_type, particle_type):
+        self.ana_tpye, self.hit_type = self.__Labels("truth", hit_type=hit_type, particle_type=particle_type)
+        self.angle = angle
+        self.method = "truth"
 
-                else:
-                    continue
+        self.counters = {}
 
-                # find distance pixel to pixel
-                for w in range(len(sensor_ids_layer3)):
-                    pixel_id_layer3  = sensor_ids_layer3[w]
-                    pixel_pos_layer3 = self.__Get_Sensor_Pos_from_Pixel_ID(pixel_id_layer3)
-                    distance_pixel  = np.sqrt((pixel_pos_layer2[0]-pixel_pos_layer3[0])**2 + (pixel_pos_layer2[1]-pixel_pos_layer3[1])**2 + (pixel_pos_layer2[2]-pixel_pos_layer3[2])**2)
+        n = self.__Check_N(n)
 
-                    tmp_distance_pixel_to_pixel.append(distance_pixel)
-                    ##################################
-                    # the nearest matching sensor hits are used to approximate the trajectory
-                    ##################################
-                    # tmp_distance_tile_to_pixel can be zero!
-                if len(tmp_distance_pixel_to_pixel) != 0:
-                    index_3     = np.where(tmp_distance_pixel_to_pixel == np.min(tmp_distance_pixel_to_pixel))[0][0]
-                    sensor_id_layer3 = sensor_ids_layer3[index_3]
-                    pixel_pos_layer3 = self.__Get_Sensor_Pos_from_Pixel_ID(sensor_id_layer3)
+        for chunk in self.__Iter_Chunks(n):
+            m                  = self.__Frames_In_Chunk(chunk, n)
+            tile_ids, vectors  = self.__Truth_Vectors(chunk, m, hit_type, particle_type)
+            self.__Report(chunk, 0, m)
 
-                if np.array(pixel_pos_layer3).size == 0:
-                    continue
-                
-                vector_sensor_layers = np.array(pixel_pos_layer3) - np.array(pixel_pos_layer2)
-                
-                tile_norm = np.array(self.tile_id_dir[tile_id])
-                if angle == "norm":
-                    angle_sensor_tile.append(mf.angle_between(vector_sensor_layers, tile_norm))
-                elif angle == "theta":
-                    angle_sensor_tile.append(mf.angle_between(vector_sensor_layers, np.array([0,0,1])))
-                elif angle == "phi":
-                    angle_sensor_tile.append(-mf.angle_between_phi(vector_sensor_layers[0:2], tile_norm[0:2]))
-                else:
-                    raise ValueError('ERROR: angle != [norm, theta, phi]')
-                z_arr.append(tile_pos[2])
-                id_arr.append(tile_id)
+            yield self.__Angle_Result("truth", vectors, tile_ids, angle)
 
-            # Print progress
-            if i % 1000 == 0 and i != 0:
-                print(round((i/n)*100,2), "%")
-        print("100%")
+    # ------------------------------------
+    def __Rec_Chunks (self, n, angle, matching, max_distance):
+        self.ana_tpye, self.hit_type = self.__Labels("rec", matching)
+        self.angle = angle
+        self.method = "rec"
 
-        print("HID CHECK: ", hid_ok, " of " , hid_ok+ hid_discard, "ok")
-        print("TID CHECK: ", tid_ok, " of " , tid_ok+ hid_discard, "ok")
-        print("Total Events with matching Tile and Sensor Hit: ", len(z_arr), " of: ", hid_ok, " primary Tile hits")
+        # counters
+        self.counters = {"hid_ok": 0, "hid_discard": 0, "tid_ok": 0, "tid_discard": 0}
 
-        self.result_z     = np.array(z_arr)
-        self.result_angle = np.array(angle_sensor_tile)
-        self.result_id    = np.array(id_arr)
+        n = self.__Check_N(n)
 
-        return self.result_z, self.result_angle, self.result_id
+        for chunk in self.__Iter_Chunks(n, pixels=True):
+            m                  = self.__Frames_In_Chunk(chunk, n)
+            tile_ids, vectors  = self.__Frame_Vectors(chunk, m, True, False, max_distance, self.counters)["rec"]
 
+            yield self.__Angle_Result("rec", vectors, tile_ids, angle)
 
-    def hitAngleTruth(self, n=0, angle="norm", hit_type="primary", particle_type="all"):
+    # ------------------------------------
+    def __Helix_Chunks (self, n, angle):
+        self.ana_tpye, self.hit_type = self.__Labels("helix")
+        self.angle = angle
+        self.method = "helix"
 
-        self.hit_type = hit_type
-        self.ana_tpye = "Truth" + particle_type
-        self.angle    = angle
+        # counters
+        self.counters = {"hid_ok": 0, "hid_discard": 0, "no_traj": 0}
 
-        if n > len(self.tilehit_tile_dic) or n == 0:
-            n = len(self.tilehit_tile_dic)
-        print("Frames to analyze: ", n, " of ",  len(self.tilehit_tile_dic))
+        n = self.__Check_N(n)
 
-        # Define Arrays for result
-        angle_arr  = []
-        z_arr  = []
-        id_arr = []
+        for chunk in self.__Iter_Chunks(n, trajectories=True):
+            m                  = self.__Frames_In_Chunk(chunk, n)
+            tile_ids, vectors  = self.__Helix_Vectors(chunk, m, self.counters)
+            self.__Report(chunk, 0, m)
 
-        # loop over all Root frames
-        for i in range(n):
-        #for i in range(100):
-            # loop over all tile hits in one Root frame
-            for u in range(len(self.tilehit_tile_dic[i])):
-
-                tile_id  = self.tilehit_tile_dic[i][u]
-                #############
-                # HID CHECK #
-                #############
-                hid_test = self.__Get_HID_from_MC_I(self.tile_mc_i[i][u])
-                if hit_type == "primary":
-                    # only primary hit gets analyzed
-                    if hid_test != 1:
-                        continue
-                elif hit_type == "secondary":
-                    if hid_test != 1:
-                        continue
-                elif hit_type == "all":
-                    pass
-                else:
-                    raise ValueError("hit_type: not supported")
-
-                #############
-                # PDG Check #
-                #############
-                pdg = self.__Get_PDG_from_MC_I(self.tile_mc_i[i][u])
-                if particle_type == "electron":
-                    if pdg != 11:
-                        continue
-                elif particle_type == "positron":
-                    if pdg != -11:
-                        continue
-                elif particle_type == "all":
-                    pass
+            yield self.__Angle_Result("helix", vectors, tile_ids, angle)
+
+    # ------------------------------------
+    def __Multi_Requests (self, requests):
+        """
+            Normalises the requests of hitAngleMulti to (method, angle, hit_type, particle_type).
+            A request is a method name (angle "norm") or a tuple (method, angle[, hit_type[, particle_type]])
+        """
+        result = []
+        for request in requests:
+            if isinstance(request, str):
+                request = (request,)
+            method = request[0]
+            if method == "rate":
+                request = ("rate", "", "", "")
+            elif method == "truth":
+                request = tuple(request) + ("norm", "primary", "all")[len(request) - 1:]
+            elif method == "rec" or method == "pixelrec" or method == "helix":
+                if len(request) > 2:
+                    raise ValueError("hitAngleMulti: hit_type and particle_type are only supported for truth")
+                request = tuple(request) + ("norm",)[len(request) - 1:] + ("primary", "all")
+            else:
+                raise ValueError("method != [rec, pixelrec, truth, helix, rate]")
+            if request not in result:
+                result.append(request)
+
+        return result
+
+    # ------------------------------------
+    def __Multi_Chunks (self, n, requests, matching, max_distance):
+        self.matching = matching
+        methods = set(r[0] for r in requests)
+
+        # counters of every method
+        self.counters = {}
+        if "rec" in methods or "pixelrec" in methods:
+            self.counters["rec"] = {"hid_ok": 0, "hid_discard": 0, "tid_ok": 0, "tid_discard": 0}
+        if "helix" in methods:
+            self.counters["helix"] = {"hid_ok": 0, "hid_discard": 0, "no_traj": 0}
+
+        n = self.__Check_N(n)
+
+        pixels = "rec" in methods or "pixelrec" in methods
+        for chunk in self.__Iter_Chunks(n, pixels=pixels, trajectories="helix" in methods, edep="rate" in methods):
+            m = self.__Frames_In_Chunk(chunk, n)
+
+            # hit vectors of every method, computed once for all angles
+            vectors = {}
+            if pixels:
+                vectors.update(self.__Frame_Vectors(chunk, m, "rec" in methods, "pixelrec" in methods, max_distance, self.counters["rec"]))
+            if "helix" in methods:
+                vectors["helix"] = self.__Helix_Vectors(chunk, m, self.counters["helix"])
+            if not pixels:
+                # else reported by __Frame_Vectors
+                self.__Report(chunk, 0, m)
+
+            results = {}
+            for request in requests:
+                method, angle, hit_type, particle_type = request
+                if method == "rate":
+                    results[request] = chunk.rateRecords(self.tile_geometry, m, self.timer)
+                    self.accepted += len(results[request][0])
+                    continue
+                if method == "truth":
+                    if ("truth", hit_type, particle_type) not in vectors:
+                        vectors[("truth", hit_type, particle_type)] = self.__Truth_Vectors(chunk, m, hit_type, particle_type)
+                    tile_ids, hit_vectors = vectors[("truth", hit_type, particle_type)]
                 else:
-                    raise ValueError("particle_type: not supported")
+                    tile_ids, hit_vectors = vectors[method]
 
-                tile_pos = self.tile_id_pos[tile_id]
+                results[request] = self.__Angle_Result(method, hit_vectors, tile_ids, angle)
 
+            yield results
 
-                p_xyz = self.__Get_Momentum_from_MC_I(self.tile_mc_i[i][u])
+    # ------------------------------------
+    def __Rate_Arrays (self, z, edep, hid):
+        # the eight arrays of TileHitRate.tileHitRateHID
+        primary   = hid == 1
+        secondary = hid == 2
+        tertiary  = hid == 3
 
-                if  angle == "norm":
-                    angle_arr.append(mf.angle_between(p_xyz, self.tile_id_dir[tile_id]))
-                elif angle == "theta":
-                    angle_arr.append(mf.angle_between(p_xyz, np.array([0,0,-1])))
-                elif angle == "phi":
-                    vector = -np.array(self.tile_id_dir[tile_id])
-                    angle_arr.append(-mf.angle_between_phi(p_xyz[0:2], vector[0:2]))
-                else:
-                    raise ValueError('ERROR: angle != [norm, theta, phi]')
+        return z, z[primary], z[secondary], z[tertiary], edep, edep[primary], edep[secondary], edep[tertiary]
 
-                z_arr.append(tile_pos[2])
-                id_arr.append(tile_id)
+    # ------------------------------------
+    def __Records_Writer (self, path, float_dtype, id_dtype, append):
+        result = rs.AngleResult(self.output, self.angle, self.ana_tpye, self.hit_type, metadata={"method": self.method, "input": [self.filename]})
 
+        return rst.ResultWriter(result.name() + ".mres" if path is None else path, result.header(), float_dtype, id_dtype, append)
 
 
-            if i % 1000 == 0 and i != 0:
-                print(round((i/n)*100,2), "%  |  Hits:", len(z_arr))
-        print("100%")
+    #####################
+    # public  functions #
+    #####################
 
-        self.result_z     = np.array(z_arr)
-        self.result_angle = np.array(angle_arr)
-        self.result_id    = np.array(id_arr)
+    def iterHitAngle(self, method="rec", n=0, vectors=False, **kwargs):
+        """
+            Streaming version of the hitAngle* methods. Yields (z, angle, id) for every chunk of
+            frames, so the results can be written or histogrammed while the file is processed.
+            method: "rec", "pixelrec", "truth" or "helix", kwargs are passed on as for the hitAngle* methods
+            vectors: yield (z, angle, id, hit vectors) instead
+        """
+        if method == "rec":
+            chunks = self.__Rec_Chunks(n, kwargs.get("angle", "norm"), kwargs.get("matching", "nearest"), kwargs.get("max_distance", 150))
+        elif method == "pixelrec":
+            chunks = self.__Pixel_Rec_Chunks(n, kwargs.get("angle", "norm"), kwargs.get("matching", "nearest"))
+        elif method == "truth":
+            chunks = self.__Truth_Chunks(n, kwargs.get("angle", "norm"), kwargs.get("hit_type", "primary"), kwargs.get("particle_type", "all"))
+        elif method == "helix":
+            chunks = self.__Helix_Chunks(n, kwargs.get("angle", "norm"))
+        else:
+            raise ValueError("method != [rec, pixelrec, truth, helix]")
+
+        if vectors:
+            return chunks
+
+        return (chunk_result[0:3] for chunk_result in chunks)
 
-        return self.result_z, self.result_angle, self.result_id
+    # ------------------------------------
 
+    def iterHitAngleMulti(self, requests, n=0, matching="nearest", max_distance=150):
+        """
+            Streaming version of hitAngleMulti. Yields {request: (z, angle, id)} for every chunk of frames
+            ({"rate": the eight arrays of TileHitRate.iterTileHitRateHID} for a rate request)
+        """
+        chunks = self.__Multi_Chunks(n, self.__Multi_Requests(requests), matching, max_distance)
+
+        return ({request: self.__Rate_Arrays(result[0], result[1], result[3]) if request[0] == "rate" else result[0:3]
+                 for request, result in results.items()} for results in chunks)
 
     # ------------------------------------
 
-    def hitAngleRec(self, n=0, angle="norm", matching="nearest"):
+    def hitAngleMulti(self, requests, n=0, matching="nearest", max_distance=150):
         """
-            TODO:
-                - add new options for sensor tile matching (sensor cluster)
+            Runs several analyses in a single pass over the file: every chunk is read once, every frame is
+            decoded and matched once and the hit vectors of a method are shared by all its angles.
+            requests: list of method names or tuples (method, angle[, hit_type[, particle_type]]),
+                      e.g. [("rec", "norm"), ("rec", "phi"), ("helix", "theta"), ("truth", "norm", "all"), "rate"]
+            Returns {(method, angle, hit_type, particle_type): (z, angle, id)}, the same arrays as the single
+            hitAngle* methods (the eight TileHitRate.tileHitRateHID arrays for "rate")
         """
-        self.hit_type  = "primary"
-        self.ana_tpye = "SensorMatching" + matching
-        self.angle    = angle
+        requests = self.__Multi_Requests(requests)
+        records  = {request: rs.GrowableArray(rs.angle_dtype(self.compact)) for request in requests if request[0] != "rate"}
+        rate     = {request: rs.GrowableArray(rs.rate_dtype(self.compact)) for request in requests if request[0] == "rate"}
+        for chunk_result in self.__Multi_Chunks(n, requests, matching, max_distance):
+            with self.timer.stage("output"):
+                for request in records:
+                    z, angle, id, vectors = chunk_result[request]
+                    records[request].append(z=z, angle=angle, id=id, vector=vectors)
+                for request in rate:
+                    z, edep, id, hid = chunk_result[request]
+                    rate[request].append(z=z, edep=edep, id=id, hid=hid)
+
+        self.multi_results = {}
+        for request in records:
+            results = records[request].finish()
+            self.multi_results[request] = results["z"], results["angle"], results["id"]
+        self.rate_hits = None
+        for request in rate:
+            # one record per tile hit as in TileHitRate, kept for the histograms of getRateResult
+            self.rate_hits = rate[request].finish()
+            self.multi_results[request] = self.__Rate_Arrays(self.rate_hits["z"], self.rate_hits["edep"], self.rate_hits["hid"])
+
+        if "rec" in self.counters:
+            hid_ok, hid_discard, tid_ok = self.counters["rec"]["hid_ok"], self.counters["rec"]["hid_discard"], self.counters["rec"]["tid_ok"]
+            self.progress.message("HID CHECK: ", hid_ok, " of " , hid_ok+ hid_discard, "ok")
+            self.progress.message("TID CHECK: ", tid_ok, " of " , tid_ok+ hid_discard, "ok")
+        if "helix" in self.counters:
+            self.progress.message("Hits without matching trajectory: ", self.counters["helix"]["no_traj"])
+
+        return self.multi_results
 
-        # counters
-        hid_discard = 0
-        hid_ok      = 0
-        tid_discard = 0
-        tid_ok      = 0
+    # ------------------------------------
 
+    def getAngleResults(self, binned=False, bins=[220,180]):
+        """
+            Returns the angle results of hitAngleMulti as {request: AngleResult} with the output labels of
+            the single methods.
+        """
+        results = {}
+        for request, result in self.multi_results.items():
+            method, angle, hit_type, particle_type = request
+            if method == "rate":
+                continue
+            ana_type, hit_type = self.__Labels(method, self.matching, hit_type, particle_type)
 
-        # Check Argument
-        if n > len(self.tilehit_tile_dic) or n == 0:
-            n = len(self.tilehit_tile_dic)
-        print("Frames to analyze: ", n, " of ",  len(self.tilehit_tile_dic))
+            histogram = self.__Get_Histogram(angle, bins).fill(self.tile_geometry.z(result[2]), result[1]) if binned else None
+            results[request] = rs.AngleResult(self.output, angle, ana_type, hit_type, result[0], result[1], result[2], histogram,
+                                              {"method": method, "input": [self.filename]})
 
-        # Define Arrays for result
-        angle_sensor_tile = []
-        z_arr  = []
-        id_arr = []
+        return results
 
-        # loop over all Root frames
-        for i in range(n):
-            # loop over all tile hits in one Root frame
-            for u in range(len(self.tilehit_tile_dic[i])):
-
-                ##################################
-                # HID CHECK
-                # only primary hit gets analyzed
-                ##################################
-                tile_id  = self.tilehit_tile_dic[i][u]
-                hid_test = self.__Get_HID_from_MC_I(self.tile_mc_i[i][u])
-                if hid_test != 1:
-                    hid_discard += 1
-                    continue
-                hid_ok += 1
+    # ------------------------------------
 
-                tile_pos = self.tile_id_pos[tile_id]
+    def getRateResult(self, binned=False, bins=220):
+        """
+            Returns the result of a "rate" request of hitAngleMulti as RateResult with the output names
+            output and output + "edep" (None without a rate request). binned: also add the histograms
+            as TileHitRate.getRateResult
+        """
+        if self.rate_hits is None:
+            return None
 
-                tmp_distance_tile_to_pixel    = []
-                sensor_ids, sensor_frame_mc_i = self.__Get_Sensor_IDs_from_Frame_ID(i)
+        arrays     = self.multi_results[("rate", "", "", "")]
+        histograms = None
+        if binned:
+            # exact z of the tiles for the binning (stored z can be float32)
+            hits       = self.rate_hits
+            histograms = rs.rate_histograms(self.tile_geometry, bins)
+            rs.fill_rate_histograms(histograms, self.__Rate_Arrays(self.tile_geometry.z(hits["id"]), hits["edep"].astype(np.float64), hits["hid"]))
 
-                # TID for tile
-                tid_tile_test   = self.__Get_TID_from_MC_I(self.tile_mc_i[i][u])
+        return rs.RateResult(self.output, self.output + "edep", dict(zip(rs.RateResult.names, arrays[0:4])), dict(zip(rs.RateResult.names, arrays[4:8])), histograms)
 
-                # loop over all pixel hits in one Root frame
-                for v in range(len(sensor_ids)):
-                    ##################################
-                    # TID CHECK
-                    # check for matching sensor and tile hits
-                    ##################################
-                    tid_sensor_test = self.__Get_TID_from_MC_I(sensor_frame_mc_i[v])
-                    if tid_sensor_test != tid_tile_test:
-                        tid_discard = tid_discard +1
-                        tmp_distance_tile_to_pixel.append(10000)
-                        continue
-                    tid_ok = tid_ok + 1
-
-                    pixel_id  = sensor_ids[v]
-                    pixel_pos = self.__Get_Sensor_Pos_from_Pixel_ID(pixel_id)
-                    distance  = np.sqrt((tile_pos[0]-pixel_pos[0])**2 + (tile_pos[1]-pixel_pos[1])**2 + (tile_pos[2]-pixel_pos[2])**2)
-
-
-                    tmp_distance_tile_to_pixel.append(distance)
-
-                # print(tmp_distance_tile_to_pixel)
-                ##################################
-                # the nearest matching sensor hit is used to approximate the trajectory
-                ##################################
-                # tmp_distance_tile_to_pixel can be zero!
-                if len(tmp_distance_tile_to_pixel) != 0 and min(tmp_distance_tile_to_pixel) < 150:
-                    index     = np.where(tmp_distance_tile_to_pixel == min(tmp_distance_tile_to_pixel))[0][0]
-                    sensor_id = sensor_ids[index]
-
-                    pixel_pos = self.__Get_Sensor_Pos_from_Pixel_ID(sensor_id)
-
-                    vector_sensor_tile = np.array(pixel_pos) - np.array(tile_pos)
-
-                    if angle == "norm":
-                        angle_sensor_tile.append(mf.angle_between(vector_sensor_tile, self.tile_id_dir[tile_id]))
-                    elif angle == "theta":
-                        angle_sensor_tile.append(mf.angle_between(vector_sensor_tile, np.array([0,0,1])))
-                    elif angle == "phi":
-                        vector = np.array(self.tile_id_dir[tile_id])
-                        angle_sensor_tile.append(-mf.angle_between_phi(vector_sensor_tile[0:2], vector[0:2]))
-                    else:
-                        raise ValueError('ERROR: angle != [norm, theta, phi]')
-                    z_arr.append(tile_pos[2])
-                    id_arr.append(tile_id)
-
-            # Print progress
-            if i % 1000 == 0 and i != 0:
-                print(round((i/n)*100,2), "%")
-        print("100%")
-
-        print("HID CHECK: ", hid_ok, " of " , hid_ok+ hid_discard, "ok")
-        print("TID CHECK: ", tid_ok, " of " , tid_ok+ hid_discard, "ok")
-        print("Total Events with matching Tile and Sensor Hit: ", len(z_arr), " of: ", hid_ok, " primary Tile hits")
-
-        self.result_z     = np.array(z_arr)
-        self.result_angle = np.array(angle_sensor_tile)
-        self.result_id    = np.array(id_arr)
+    # ------------------------------------
+
+    def hitAnglePixelRec(self, n=0, angle="norm", matching="nearest"):
+        self.__Collect(self.__Pixel_Rec_Chunks(n, angle, matching))
+
+        hid_ok, hid_discard, tid_ok = self.counters["hid_ok"], self.counters["hid_discard"], self.counters["tid_ok"]
+        self.progress.message("HID CHECK: ", hid_ok, " of " , hid_ok+ hid_discard, "ok")
+        self.progress.message("TID CHECK: ", tid_ok, " of " , tid_ok+ hid_discard, "ok")
+        self.progress.message("Total Events with matching Tile and Sensor Hit: ", len(self.result_z), " of: ", hid_ok, " primary Tile hits")
+
+        return self.result_z, self.result_angle, self.result_id
+
+
+    def hitAngleTruth(self, n=0, angle="norm", hit_type="primary", particle_type="all"):
+        self.__Collect(self.__Truth_Chunks(n, angle, hit_type, particle_type))
+
+        return self.result_z, self.result_angle, self.result_id
+
+
+    def hitAngleRec(self, n=0, angle="norm", matching="nearest", max_distance=150):
+        """
+            max_distance: tile hits without a matching pixel hit closer than this are discarded
+            TODO:
+                - add new options for sensor tile matching (sensor cluster)
+        """
+        self.__Collect(self.__Rec_Chunks(n, angle, matching, max_distance))
+
+        hid_ok, hid_discard, tid_ok = self.counters["hid_ok"], self.counters["hid_discard"], self.counters["tid_ok"]
+        self.progress.message("HID CHECK: ", hid_ok, " of " , hid_ok+ hid_discard, "ok")
+        self.progress.message("TID CHECK: ", tid_ok, " of " , tid_ok+ hid_discard, "ok")
+        self.progress.message("Total Events with matching Tile and Sensor Hit: ", len(self.result_z), " of: ", hid_ok, " primary Tile hits")
 
         return self.result_z, self.result_angle, self.result_id
 
@@ -546,109 +765,167 @@ class TileHitAngle():
                 [done] add angle "theta" and "norm"
                 [...] testing
                     [...] phi
-                [use mt] improve speed
+                [done] improve speed (HelixBatch)
         """
-        self.hit_type  = "primary"
-        self.ana_tpye = "Helix"
-        self.angle    = angle
+        self.__Collect(self.__Helix_Chunks(n, angle))
 
-        # counters
-        hid_discard = 0
-        hid_ok      = 0
-        no_traj     = 0
+        hid_ok, hid_discard = self.counters["hid_ok"], self.counters["hid_discard"]
+        self.progress.message("HID CHECK: ", hid_ok, " of " , hid_ok + hid_discard, "ok")
+        self.progress.message("Hits: ", len(self.result_z), "  |  Hits without matching trajectory: ", self.counters["no_traj"])
 
-        if n > len(self.tilehit_tile_dic) or n == 0:
-            n = len(self.tilehit_tile_dic)
-        print("Frames to analyze: ", n, " of ",  len(self.tilehit_tile_dic))
+        return self.result_z, self.result_angle, self.result_id
 
-        # Define Arrays for result
-        angle_arr  = []
-        z_arr      = []
-        id_arr     = []
 
-        # loop over all Root frames
-        for i in range(n):
-        #for i in range(100):
-            # loop over all tile hits in one Root frame
-            for u in range(len(self.tilehit_tile_dic[i])):
-
-                ##################################
-                # HID CHECK
-                # only primary hit gets analyzed
-                ##################################
-                tile_id  = self.tilehit_tile_dic[i][u]
-                hid_test = self.__Get_HID_from_MC_I(self.tile_mc_i[i][u])
-                if hid_test != 1:
-                    hid_discard += 1
-                    continue
-                hid_ok += 1
 
-                tile_pos = self.tile_id_pos[tile_id]
+    # ------------------------------------
 
-                tid_tile_test   = self.__Get_TID_from_MC_I(self.tile_mc_i[i][u])
+    def fillBinned(self, method="rec", n=0, histogram=None, bins=[220,180], **kwargs):
+        """
+            Runs a hitAngle* method chunk by chunk and only fills the (z, angle) histogram,
+            the per-hit results are not kept. An existing histogram can be passed to be filled further.
+            method and kwargs as for iterHitAngle
+        """
+        if histogram is None:
+            histogram = self.__Get_Histogram(kwargs.get("angle", "norm"), bins)
 
-                vx, vy, vz, px, py, pz, type = self.__Get_Traj_from_TID(i, tid_tile_test)
-                if type == None:
-                    # No matching trajectory was found
-                    no_traj += 1
-                    continue
+        for z, angle, id in self.iterHitAngle(method, n, **kwargs):
+            with self.timer.stage("output"):
+                histogram.fill(z, angle)
 
-                # electron or position
-                # if type == 2 or type == 3:
-                # TODO: dont mix electrons with positions
+        self.histogram = histogram
 
-                type_1 = abs(int(repr(type)[-1]))
-                if type_1 == 1 or type_1 == 2:
-                    helix = hl.Helices(vx, vy, vz, px, py, pz, type_1, tile_pos)
-                    angle_arr.append(helix.hitAngle(self.tile_id_dir[tile_id], angle))
-                    z_arr.append(tile_pos[2])
-                    id_arr.append(tile_id)
-                    del helix
-                    gc.collect()
+        return histogram
 
+    # ------------------------------------
 
-            if i % 1000 == 0 and i != 0:
-                print(round((i/n)*100,2), "%  |  Hits:", len(z_arr), "  |  Hits without matching trajectory: ", no_traj)
-        print("100%")
+    def getHistogram(self, bins=[220,180]):
+        """ Returns the current result as (z, angle) Histogram2D with the fixed binning of fillBinned """
+        # exact z of the tiles for the binning (result_z can be float32)
+        return self.__Get_Histogram(self.angle, bins).fill(self.tile_geometry.z(self.result_id), self.result_angle)
 
-        self.result_z     = np.array(z_arr)
-        self.result_angle = np.array(angle_arr)
-        self.result_id    = np.array(id_arr)
+    # ------------------------------------
 
-        return self.result_z, self.result_angle, self.result_id
+    def getBinned(self, bins=[220,180]):
+        return self.getHistogram(bins).getBinned()
 
+    # ------------------------------------
 
+    def saveBinned(self, bins=[220,180]):
+        self.getAngleResult(True, bins).saveBinned()
 
     # ------------------------------------
 
-    def getBinned(self):
-        return np.histogram2d(self.result_z, self.result_angle, bins=[220,180])
+    def getResult(self):
+        return self.result_z, self.result_angle, self.result_id
 
     # ------------------------------------
 
-    def saveBinned(self):
-        binned_data, xedges, yedges = np.histogram2d(self.result_z, self.result_angle, bins=[220,180])
-        np.savez(self.output + self.angle + self.ana_tpye + self.hit_type + "_binned", data=binned_data, xedges=xedges, yedges=yedges)
+    def getVectors(self):
+        """ Returns the (N,3) hit directions of the current result (same order as getResult) """
+        return self.result_vector
 
     # ------------------------------------
 
-    def getResult(self):
+    def getAngles(self, angle="all"):
+        """
+            Computes the angles of the current result from its hit vectors in one pass, without rerunning the analysis.
+            angle: "norm", "theta" or "phi" returns one array, a list of them or "all" a dict angle -> array
+        """
+        if self.method == "":
+            raise ValueError("getAngles: no result, run a hitAngle* method first")
+
+        if angle == "all":
+            angle = ["norm", "theta", "phi"]
+        if isinstance(angle, str):
+            return self.__Get_Angles(self.method, self.result_vector, self.result_id, angle)
+
+        return {a: self.__Get_Angles(self.method, self.result_vector, self.result_id, a) for a in angle}
+
+    # ------------------------------------
+
+    def setAngle(self, angle):
+        """ Switches the current result (and the output names of the save functions) to another angle: "norm", "theta" or "phi" """
+        if angle not in ("norm", "theta", "phi"):
+            raise ValueError("setAngle: angle must be one of norm, theta, phi, got " + repr(angle))
+
+        self.results["angle"] = self.getAngles(angle)
+        self.angle            = angle
+
         return self.result_z, self.result_angle, self.result_id
 
     # ------------------------------------
 
+    def getAngleResult(self, binned=False, bins=[220,180]):
+        """
+            Returns the current result with its output labels as AngleResult, e.g. to merge the
+            results of several frame ranges. binned: also add the (z, angle) histogram
+        """
+        histogram = self.getHistogram(bins) if binned else None
+
+        return rs.AngleResult(self.output, self.angle, self.ana_tpye, self.hit_type, self.result_z, self.result_angle, self.result_id, histogram,
+                              {"method": self.method, "input": [self.filename]}, self.getCounters())
+
+    # ------------------------------------
+
+    def getCounters(self):
+        """
+            Returns the counters of the last analysis as dict: {"frames": analysed frames, "accepted": accepted hits (summed over the requests of hitAngleMulti),
+            "hits": HID/TID counters of the method ({method: counters} after hitAngleMulti),
+            "stages": {stage: {"time": seconds, "calls": n}}} (stage times are 0 if timing is off, see timing.StageTimer)
+        """
+        hits = {k: dict(v) if isinstance(v, dict) else v for k, v in self.counters.items()}
+
+        return {"frames": self.n_analysed, "accepted": self.accepted, "hits": hits, "stages": self.timer.counters()}
+
+    # ------------------------------------
+
     def saveTxt(self):
-        np.savetxt(self.output + self.angle + self.ana_tpye + self.hit_type + "_z.txt", self.result_z)
-        np.savetxt(self.output + self.angle + self.ana_tpye + self.hit_type + "_angle.txt", self.result_angle)
-        np.savetxt(self.output + self.angle + self.ana_tpye + self.hit_type + "_id.txt", self.result_id)
+        with self.timer.stage("output"):
+            self.getAngleResult().saveTxt()
 
     # ------------------------------------
 
     def saveCompressed(self):
-        np.savez_compressed(self.output + self.angle + self.ana_tpye + self.hit_type + "_compressed", z=self.result_z, angle=self.result_angle, id=self.result_id)
+        with self.timer.stage("output"):
+            self.getAngleResult().saveCompressed()
 
 
     # ------------------------------------
 
     def saveNpz(self):
-        np.savez(self.output + self.angle + self.ana_tpye + self.hit_type, z=self.result_z, angle=self.result_angle, id=self.result_id)
+        with self.timer.stage("output"):
+            self.getAngleResult().saveNpz()
+
+    # ------------------------------------
+
+    def saveRecords(self, path=None, float_dtype=np.float32, id_dtype=np.int32):
+        """ Saves the result as binary records with a metadata header (see AngleResult.saveRecords) """
+        with self.timer.stage("output"):
+            self.getAngleResult().saveRecords(path, float_dtype, id_dtype)
+
+    # ------------------------------------
+
+    def writeRecords(self, method="rec", n=0, path=None, float_dtype=np.float32, id_dtype=np.int32, append=False, **kwargs):
+        """
+            Runs a hitAngle* method chunk by chunk and appends every chunk to a binary result file
+            (see AngleResult.saveRecords), the per-hit results are not kept in memory.
+            method and kwargs as for iterHitAngle, path: default output name + ".mres"
+            Returns the path of the file
+        """
+        chunks = self.iterHitAngle(method, n, **kwargs)
+
+        # the labels of the header are known when the first chunk is analysed
+        writer = None
+        try:
+            for z, angle, id in chunks:
+                with self.timer.stage("output"):
+                    if writer is None:
+                        writer = self.__Records_Writer(path, float_dtype, id_dtype, append)
+                    writer.append(z, angle, id)
+            if writer is None:
+                writer = self.__Records_Writer(path, float_dtype, id_dtype, append)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        return writer.path
@@ -1,26 +1,30 @@
-import ROOT
 import numpy as np
+from melp.libs import geometry as geo
+from melp.libs import frames as fr
+from melp.libs import results as rs
+from melp.libs import timing as tm
+from melp.libs import progress as pg
 
 
 class TileHitRate:
-    def __init__ (self, filename, output_z, output_rate):
+    def __init__ (self, filename, output_z, output_rate, chunk_size=0, start=0, stop=None, tile_geometry=None, compact=True, timing=None):
+        """
+            chunk_size: 0 reads the whole file at once, otherwise the analysis methods read and
+                        process chunk_size frames at a time (see iterTileHitRateHID)
+            start, stop: only the frames [start, stop) of the file are analysed (e.g. one work unit of run_mt)
+            tile_geometry: already loaded TileGeometry (e.g. shared by all files of a run), read from the file if None
+            compact: results are kept as float32 z/edep (float64 if False)
+            timing: time the stages of the analysis (see getCounters), None uses the default of timing.set_timing
+        """
         self.filename     = filename
         self.output_z     = output_z
         self.output_rate  = output_rate
+        self.chunk_size   = chunk_size
+        self.start        = start
 
         self.result_z     = np.zeros(0)
         self.result_rate  = np.zeros(0)
 
-        self.file         = ROOT.TFile(filename)
-        self.mu3e_mchits  = self.file.Get("mu3e_mchits")
-        self.mu3e         = self.file.Get("mu3e")
-        self.tiles        = self.file.Get("alignment/tiles")
-
-        self.tilehit_tile_dic    = {}
-        self.tile_mc_i           = {}
-        self.tile_id_pos         = {}
-        self.tilehit_edep_dic    = {}
-
         self.tilehit_z           = []
         self.tilehit_edep        = []
 
@@ -34,130 +38,210 @@ class TileHitRate:
         self.edep_secondary_arr  = []
         self.edep_tertiary_arr   = []
 
-        # initialize dictionaries
-        for i in range(self.mu3e.GetEntries()):
-            self.mu3e.GetEntry(i)
+        self.histograms          = {}
+
+        # cumulative time of the analysis stages and number of analysed frames
+        self.timer               = tm.StageTimer(timing)
+        self.n_analysed          = 0
+        self.hit_counts          = dict.fromkeys(rs.RateResult.names, 0)
+
+        # progress output (a queue to the parent process in run_mt workers)
+        self.progress            = pg.reporter()
+
+        # one structured record per tile hit (see results.rate_dtype), the result arrays are views or subsets of it
+        self.compact             = compact
+        self.hits                = np.zeros(0, dtype=rs.rate_dtype(compact))
+
+        # tile positions, tile id -> z through a sorted index
+        self.tile_geometry    = geo.TileGeometry(filename) if tile_geometry is None else tile_geometry
+        self.tile_id_pos      = self.tile_geometry.pos_dict()
+
+        if chunk_size == 0 and start == 0 and stop is None:
+            # read tile hits and mchits of the whole file in bulk
+            with self.timer.stage("read"):
+                self.frames   = fr.FrameChunk(filename, edep=True, momentum=False)
+            self.tilehit_tile = self.frames.tilehit_tile
+            self.tile_mc_i    = self.frames.tile_mc_i
+            self.tile_edep    = self.frames.tile_edep
+            self.mchits       = self.frames.mchits
+            self.n_frames     = len(self.frames)
+        else:
+            # frames are read chunk by chunk while they are analysed
+            self.frames       = None
+            self.n_frames     = fr.range_length(filename, start, stop)
+            if chunk_size == 0:
+                # the whole frame range is one chunk
+                self.chunk_size = max(self.n_frames, 1)
 
-            temp_arr_1 = []
-            for j in self.mu3e.tilehit_mc_i:
-                temp_arr_1.append(j)
-            self.tile_mc_i[i] = temp_arr_1
+    #####################
+    # private functions #
+    #####################
+    def __Iter_Chunks (self, n):
+        # every analysis reads its chunks here, the progress output ends when they are done
+        try:
+            if self.frames is not None:
+                yield self.frames
+                return
+
+            stop = self.start + n
+            for start in range(self.start, stop, self.chunk_size):
+                with self.timer.stage("read"):
+                    chunk = fr.FrameChunk(self.filename, start, min(start + self.chunk_size, stop), edep=True, momentum=False)
+                yield chunk
+        finally:
+            self.progress.finish()
 
-            temp_arr_2 = []
-            for j in self.mu3e.tilehit_tile:
-                temp_arr_2.append(j)
-            self.tilehit_tile_dic[i] = temp_arr_2
+    # ----
+    def __Get_Histograms (self, bins):
+        return rs.rate_histograms(self.tile_geometry, bins)
 
-            temp_arr_3 = []
-            for j in self.mu3e.tilehit_edep:
-                temp_arr_3.append(j)
-            self.tilehit_edep_dic[i] = temp_arr_3
+    # ----
+    def __Fill_Histograms (self, histograms, chunk_result):
+        with self.timer.stage("output"):
+            rs.fill_rate_histograms(histograms, chunk_result)
 
-        for i in range(self.tiles.GetEntries()):
-            self.tiles.GetEntry(i)
+    # ----
+    def __Check_N (self, n):
+        if n > self.n_frames or n == 0:
+            n = self.n_frames
+        self.n_analysed = n
+        self.hit_counts = dict.fromkeys(rs.RateResult.names, 0)
 
-            # position
-            tile_xyz = []
-            tile_xyz.append(self.tiles.posx)
-            tile_xyz.append(self.tiles.posy)
-            tile_xyz.append(self.tiles.posz)
-            self.tile_id_pos[self.tiles.sensor] = tile_xyz
+        self.progress = pg.reporter()
+        self.progress.start(n)
+        self.progress.message(n, " of ",  self.n_frames)
 
-    #####################
-    # private functions #
-    #####################
-    def __Get_HID_from_MC_I (self, mc_i):
-            self.mu3e_mchits.GetEntry(mc_i)
-            hid = self.mu3e_mchits.hid
+        return n
 
-            return hid
+    # ----
+    def __Report (self, chunk, m):
+        # the first m frames of the chunk were analysed
+        self.progress.update(m, int(chunk.tilehit_tile.offsets[m]))
+
+    # ----
+    def __Count (self, hid):
+        # adds the tile hits of one chunk to the counters of getCounters
+        self.hit_counts["total"]     += len(hid)
+        self.hit_counts["primary"]   += int(np.count_nonzero(hid == 1))
+        self.hit_counts["secondary"] += int(np.count_nonzero(hid == 2))
+        self.hit_counts["tertiary"]  += int(np.count_nonzero(hid == 3))
+
+    # ----
+    def __Fill_Records (self, n):
+        # z, edep, tile id and HID class of all tile hits of the first n frames
+        records = rs.GrowableArray(rs.rate_dtype(self.compact))
+        for chunk in self.__Iter_Chunks(n):
+            m = self.__Frames_In_Chunk(chunk, n)
+            z, edep, tile_ids, hid = chunk.rateRecords(self.tile_geometry, m, self.timer)
+            self.__Report(chunk, m)
+            self.__Count(hid)
+            with self.timer.stage("output"):
+                records.append(z=z, edep=edep, id=tile_ids, hid=hid)
+
+        self.hits = records.finish()
+
+        return self.hits
+
+    # ----
+    def __Split_HID (self, z, edep, hid):
+        primary   = hid == 1
+        secondary = hid == 2
+        tertiary  = hid == 3
+
+        return z, z[primary], z[secondary], z[tertiary], edep, edep[primary], edep[secondary], edep[tertiary]
+
+    # ----
+    def __Frames_In_Chunk (self, chunk, n):
+        # number of frames of the chunk that belong to the first n frames of the analysed range
+        return max(0, min(self.start + n - chunk.start, len(chunk)))
 
 
     #####################
     # public  functions #
     #####################
 
-    def tileHitRate (self, n):
-        self.tilehit_z = []
-        for i in range(self.mu3e.GetEntries()):
-            for j in self.tilehit_tile_dic[i]:
-                self.tilehit_z.append(self.tile_id_pos[j][2])
+    def tileHitRate (self, n=0):
+        hits = self.__Fill_Records(self.__Check_N(n))
 
-        self.tilehit_edep = []
-        for i in range(self.mu3e.GetEntries()):
-            for j in self.tilehit_edep_dic[i]:
-                self.tilehit_edep.append(j)
+        self.tilehit_z    = hits["z"]
+        self.tilehit_edep = hits["edep"]
 
-        z_arr    = np.array(self.tilehit_z)
-        edep_arr = np.array(self.tilehit_edep)
+        return self.tilehit_z, self.tilehit_edep
 
-        return z_arr, edep_arr
+    # ----
+    def iterTileHitRateHID(self, n = 0):
+        """
+            Streaming version of tileHitRateHID. Yields the eight arrays for every chunk of frames.
+        """
+        n = self.__Check_N(n)
+
+        for chunk in self.__Iter_Chunks(n):
+            m      = self.__Frames_In_Chunk(chunk, n)
+            z, edep, tile_ids, hid = chunk.rateRecords(self.tile_geometry, m, self.timer)
+            self.__Report(chunk, m)
+            self.__Count(hid)
+
+            yield self.__Split_HID(z, edep, hid)
 
     # ----
     def tileHitRateHID(self, n = 0):
+        n = self.__Check_N(n)
 
-        tilehit_z_total         = []
-        tilehit_z_primary       = []
-        tilehit_z_secondary     = []
-        tilehit_z_tertiary      = []
-        
-        tilehit_edep_total      = []
-        tilehit_edep_primary    = []
-        tilehit_edep_secondary  = []
-        tilehit_edep_tertiary   = []
-    
-        # Check Argument
-        if n > len(self.tilehit_tile_dic) or n == 0:
-            n = len(self.tilehit_tile_dic)
-        print(n, " of ",  len(self.tilehit_tile_dic))
-
-        # loop over all Root frames
-        for i in range(n):
-
-            # loop over all tile hits in one Root frame
-            for u in range(len(self.tilehit_tile_dic[i])):
-
-                tile_id  = self.tilehit_tile_dic[i][u]
-                hid_test = self.__Get_HID_from_MC_I(self.tile_mc_i[i][u])
-                j = self.tilehit_tile_dic[i][u]
-                k = self.tilehit_edep_dic[i][u]
-                tilehit_z_total.append(self.tile_id_pos[j][2])
-                tilehit_edep_total.append(k)
-                if np.abs(hid_test) == 1:
-                    tilehit_z_primary.append(self.tile_id_pos[j][2])
-                    tilehit_edep_primary.append(k)
-                elif np.abs(hid_test) == 2:
-                    tilehit_z_secondary.append(self.tile_id_pos[j][2])
-                    tilehit_edep_secondary.append(k)
-                elif np.abs(hid_test) == 3:
-                    tilehit_z_tertiary.append(self.tile_id_pos[j][2])
-                    tilehit_edep_tertiary.append(k)
-                    
-            # Print progress
-            if i % 1000 == 0 and i != 0:
-                print(round((i/n)*100,2), "%")
-        print("100%")
-
-        self.z_total_arr      = np.array(tilehit_z_total)
-        self.z_primary_arr    = np.array(tilehit_z_primary)
-        self.z_secondary_arr  = np.array(tilehit_z_secondary)
-        self.z_tertiary_arr   = np.array(tilehit_z_tertiary)
-
-        self.edep_total_arr      = np.array(tilehit_edep_total)
-        self.edep_primary_arr    = np.array(tilehit_edep_primary)
-        self.edep_secondary_arr  = np.array(tilehit_edep_secondary)
-        self.edep_tertiary_arr   = np.array(tilehit_edep_tertiary) 
+        hits   = self.__Fill_Records(n)
+        arrays = self.__Split_HID(hits["z"], hits["edep"], hits["hid"])
+
+        self.z_total_arr, self.z_primary_arr, self.z_secondary_arr, self.z_tertiary_arr = arrays[0:4]
+        self.edep_total_arr, self.edep_primary_arr, self.edep_secondary_arr, self.edep_tertiary_arr = arrays[4:8]
 
         return self.z_total_arr, self.z_primary_arr, self.z_secondary_arr, self.z_tertiary_arr, self.edep_total_arr, self.edep_primary_arr, self.edep_secondary_arr, self.edep_tertiary_arr 
 
 
+    # ----
+    def fillBinnedHID(self, n = 0, histograms=None, bins=220):
+        """
+            Runs tileHitRateHID chunk by chunk and only fills z histograms, the per-hit arrays are not kept.
+            Returns a dict with the hit rate histograms "z_total", "z_primary", "z_secondary", "z_tertiary"
+            and the edep weighted histograms "edep_total", ... . Existing histograms can be passed to be filled further.
+        """
+        if histograms is None:
+            histograms = self.__Get_Histograms(bins)
+
+        for chunk_result in self.iterTileHitRateHID(n):
+            self.__Fill_Histograms(histograms, chunk_result)
+
+        self.histograms = histograms
+
+        return histograms
+
     # ----
     def getResult(self):
         return self.z_total_arr, self.z_primary_arr, self.z_secondary_arr, self.z_tertiary_arr, self.edep_total_arr, self.edep_primary_arr, self.edep_secondary_arr, self.edep_tertiary_arr 
 
     # ----
-    def saveNpz(self):
-        np.savez(self.output_z, total=self.z_total_arr, primary=self.z_primary_arr, secondary=self.z_secondary_arr, tertiary=self.z_tertiary_arr)
-        np.savez(self.output_rate, total=self.edep_total_arr, primary=self.edep_primary_arr, secondary=self.edep_secondary_arr, tertiary=self.edep_tertiary_arr)
+    def getRateResult(self, binned=False, bins=220):
+        """
+            Returns the result of tileHitRateHID with its output names as RateResult, e.g. to merge several frame ranges.
+            binned: also add the histograms of fillBinnedHID
+        """
+        arrays     = [self.z_total_arr, self.z_primary_arr, self.z_secondary_arr, self.z_tertiary_arr, self.edep_total_arr, self.edep_primary_arr, self.edep_secondary_arr, self.edep_tertiary_arr]
+        histograms = None
+        if binned:
+            # exact z of the tiles for the binning (stored z can be float32)
+            histograms = self.__Get_Histograms(bins)
+            self.__Fill_Histograms(histograms, self.__Split_HID(self.tile_geometry.z(self.hits["id"]), self.hits["edep"].astype(np.float64), self.hits["hid"]))
+
+        return rs.RateResult(self.output_z, self.output_rate, dict(zip(rs.RateResult.names, arrays[0:4])), dict(zip(rs.RateResult.names, arrays[4:8])), histograms,
+                             self.getCounters())
 
-    
\ No newline at end of file
+    # ----
+    def getCounters(self):
+        """
+            Returns {"frames": analysed frames, "hits": {"total", "primary", "secondary", "tertiary"},
+            "stages": {stage: {"time": seconds, "calls": n}}} (stage times are 0 if timing is off)
+        """
+        return {"frames": self.n_analysed, "hits": dict(self.hit_counts), "stages": self.timer.counters()}
+
+    # ----
+    def saveNpz(self):
+        with self.timer.stage("output"):
+            self.getRateResult().saveNpz()
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture(scope="session")
+def sorted_file(tmp_path_factory):
+    """ Synthetic sorted ROOT file of 300 frames (needs ROOT) """
+    pytest.importorskip("ROOT")
+    from melp.libs import synthetic as sy
+
+    filename = str(tmp_path_factory.mktemp("data") / "synthetic.root")
+    sy.write_sorted_file(filename, 300, seed=3)
+
+    return filename
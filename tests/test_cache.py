@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pytest
+
+# importing melp imports ROOT
+pytest.importorskip("ROOT")
+
+from melp.libs import cache as ca
+
+
+def _make_cache(tmp_path):
+    filename = str(tmp_path / "sorted.root")
+    with open(filename, "wb") as f:
+        f.write(b"root file content")
+    ca.set_cache_dir(str(tmp_path / "caches"))
+    os.makedirs(str(tmp_path / "caches"))
+
+    writer = ca.CacheWriter(filename)
+    writer.appendFlat("mu3e_mchits", "hid", np.arange(5))
+    writer.setEntries("mu3e_mchits", 5)
+    writer.close()
+
+    return filename
+
+
+def test_copied_file_is_hashed_once(tmp_path, monkeypatch):
+    filename = _make_cache(tmp_path)
+    hashes   = []
+    monkeypatch.setattr(ca, "file_hash", lambda f, hash=ca.file_hash: hashes.append(f) or hash(f))
+
+    # a copy without the modification time
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert ca.find_cache(filename) is not None
+    assert len(hashes) == 1
+
+    # another process (empty table of opened caches) trusts the stored modification time
+    ca._caches.clear()
+    cache = ca.find_cache(filename)
+    assert cache is not None and np.array_equal(cache.flat("mu3e_mchits", "hid"), np.arange(5))
+    assert len(hashes) == 1
+
+    ca.set_cache_dir(None)
+
+
+def test_changed_file_invalidates_the_cache(tmp_path):
+    filename = _make_cache(tmp_path)
+    with open(filename, "wb") as f:
+        f.write(b"other root file content")
+
+    assert ca.find_cache(filename) is None
+
+    ca.set_cache_dir(None)
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("ROOT")
+
+import melp
+
+
+@pytest.mark.parametrize("chunk_size", [0, 70])
+def test_binned_and_records_count_accepted_hits(sorted_file, tmp_path, chunk_size):
+    single = melp.TileHitAngle(sorted_file, str(tmp_path / "out"), chunk_size=chunk_size)
+    single.hitAngleRec()
+    expected = single.getCounters()
+    assert expected["accepted"] == len(single.results) > 0
+
+    binned = melp.TileHitAngle(sorted_file, str(tmp_path / "out"), chunk_size=chunk_size)
+    binned.fillBinned("rec")
+    records = melp.TileHitAngle(sorted_file, str(tmp_path / "out"), chunk_size=chunk_size)
+    records.writeRecords("rec", path=str(tmp_path / "rec.mres"))
+
+    for calls in (binned, records):
+        counters = calls.getCounters()
+        assert counters["accepted"] == expected["accepted"]
+        assert counters["hits"] == expected["hits"]
+
+
+def test_multi_counts_every_request(sorted_file, tmp_path):
+    calls = melp.TileHitAngle(sorted_file, str(tmp_path / "out"), chunk_size=70)
+    calls.hitAngleMulti(["rec", "rate"])
+
+    results = list(calls.getAngleResults().values()) + [calls.getRateResult()]
+    assert calls.getCounters()["accepted"] == sum(len(r) for r in results)
+
+
+@pytest.mark.parametrize("chunk_size", [0, 70])
+def test_binned_rate_counts_hits(sorted_file, tmp_path, chunk_size):
+    single = melp.TileHitRate(sorted_file, str(tmp_path / "z"), str(tmp_path / "edep"), chunk_size=chunk_size)
+    arrays = single.tileHitRateHID()
+    expected = single.getCounters()["hits"]
+    assert expected == {"total": len(arrays[0]), "primary": len(arrays[1]), "secondary": len(arrays[2]), "tertiary": len(arrays[3])}
+
+    binned = melp.TileHitRate(sorted_file, str(tmp_path / "z"), str(tmp_path / "edep"), chunk_size=chunk_size)
+    binned.fillBinnedHID()
+    assert binned.getCounters()["hits"] == expected
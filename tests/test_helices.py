@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("ROOT")
+
+from melp.libs import helices as hl
+
+
+def _random_helices(n, seed=5):
+    # tiles close to the trajectories: a point of the helix within +-3 rad of the vertex plus noise
+    rng    = np.random.default_rng(seed)
+    vx, vy = rng.normal(0, 3, n), rng.normal(0, 3, n)
+    vz     = rng.normal(0, 30, n)
+    phi    = rng.uniform(-np.pi, np.pi, n)
+    pt     = rng.uniform(15, 50, n)
+    px, py = pt * np.cos(phi), pt * np.sin(phi)
+    pz     = rng.normal(0, 20, n)
+    type   = rng.choice([1, 2], n)
+
+    batch    = hl.HelixBatch(vx, vy, vz, px, py, pz, type, np.zeros((n, 3)))
+    alpha    = batch.phi + rng.uniform(-3, 3, n)
+    tile_pos = np.column_stack((batch.xc - batch.r * np.cos(alpha), batch.yc - batch.r * np.sin(alpha),
+                                batch.z0 + batch.dz * (alpha - batch.phi) / (2 * np.pi))) + rng.normal(0, 2, (n, 3))
+    tile_norm = rng.normal(0, 1, (n, 3))
+
+    return (vx, vy, vz, px, py, pz, type, tile_pos), tile_norm
+
+
+@pytest.mark.parametrize("angle", ["phi", "theta", "norm"])
+def test_helix_batch_agrees_with_helices(angle):
+    args, tile_norm = _random_helices(300)
+
+    batch  = hl.HelixBatch(*args).hitAngle(tile_norm, angle)
+    single = np.array([hl.Helices(*[a[i] for a in args]).hitAngle(tile_norm[i], angle) for i in range(len(tile_norm))])
+
+    diff = np.abs(batch - single)
+    diff = np.minimum(diff, 360 - diff)
+    assert diff.max() < 1e-3
@@ -0,0 +1,87 @@
+import time
+import pytest
+
+pytest.importorskip("ROOT")
+
+from melp import multithreading as mt
+
+
+def _timed_unit(unit):
+    start = time.time()
+    time.sleep(0.05)
+
+    return unit, start, time.time()
+
+
+def _failing_unit(unit):
+    if unit == 3:
+        raise ValueError("unit 3")
+
+    return _timed_unit(unit)
+
+
+def _overlapping(runs, after):
+    # units started after the time after while another unit was running
+    return [u for u, start, stop in runs if start > after and any(s < start < e for v, s, e in runs if v != u)]
+
+
+@pytest.mark.parametrize("backend", ["process", "futures"])
+def test_no_unit_starts_while_memory_is_tight(monkeypatch, backend):
+    # memory becomes tight shortly after the start, from then on the units run one after the other
+    # (apart from the ones that were already queued: two chunks per worker)
+    tight = time.time() + 0.3
+    monkeypatch.setattr(mt, "_memory_tight", lambda min_free_memory: time.time() > tight)
+
+    runs = list(mt._run_units(_timed_unit, range(40), 2, 1, backend, (None, None, None), 1))
+
+    assert sorted(u for u, start, stop in runs) == list(range(40))
+    assert len(_overlapping(runs, tight)) <= 2 * 2
+
+
+@pytest.mark.parametrize("backend", ["process", "futures", "serial"])
+def test_chunksize(backend):
+    runs = list(mt._run_units(_timed_unit, range(7), 2, 3, backend, (None, None, None), 0))
+
+    assert sorted(u for u, start, stop in runs) == list(range(7))
+
+
+@pytest.mark.parametrize("backend", ["process", "futures"])
+def test_failing_unit_stops_the_run(backend):
+    # the pool is terminated while its input still waits for free slots
+    with pytest.raises(ValueError, match="unit 3"):
+        list(mt._run_units(_failing_unit, range(40), 2, 1, backend, (None, None, None), 0))
+
+
+def test_get_job():
+    assert isinstance(mt.get_job("hitAngleHelix"), mt.AngleJob)
+    assert isinstance(mt.get_job("tileHitRateHID"), mt.RateJob)
+    assert mt.get_job("mt_hitAngleRec").method == "hitAngleRec"
+    assert isinstance(mt.get_job("hitAngleMulti"), mt.MultiJob)
+
+
+@pytest.mark.parametrize("function", ["iterHitAngleMulti", "fillBinned", "tileHitRate", "fillBinnedHID", "getResult", "nothing"])
+def test_get_job_rejects_methods_without_single_result(function):
+    with pytest.raises(ValueError, match="registered jobs"):
+        mt.get_job(function)
+
+
+def test_job_rejects_methods_without_single_result():
+    with pytest.raises(ValueError):
+        mt.AngleJob("fillBinned")
+
+
+def test_job_needs_run():
+    class NoRun(mt.Job):
+        pass
+
+    with pytest.raises(TypeError):
+        NoRun("hitAngleRec")
+
+
+def test_multi_job_arguments():
+    kwargs, formats = mt.get_job("mt_hitAngleMulti").arguments(([("rec", "phi"), "rate"], False, True), {})
+    assert kwargs == {"requests": [("rec", "phi"), "rate"]}
+    assert formats == {"txt": False, "npz": True}
+
+    with pytest.raises(ValueError, match="no requests"):
+        mt.get_job("hitAngleMulti").arguments((), {})
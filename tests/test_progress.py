@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("ROOT")
+
+import melp
+from melp.libs import progress as pg
+
+
+ANGLE_CALLS = {
+    "hitAngleRec":       lambda a, tmp: a.hitAngleRec(),
+    "hitAnglePixelRec":  lambda a, tmp: a.hitAnglePixelRec(),
+    "hitAngleTruth":     lambda a, tmp: a.hitAngleTruth(),
+    "hitAngleHelix":     lambda a, tmp: a.hitAngleHelix(),
+    "hitAngleMulti":     lambda a, tmp: a.hitAngleMulti(["rec", "helix", "rate"]),
+    "fillBinned":        lambda a, tmp: a.fillBinned("rec"),
+    "writeRecords":      lambda a, tmp: a.writeRecords("truth", path=str(tmp / "truth.mres")),
+    "iterHitAngle":      lambda a, tmp: list(a.iterHitAngle("pixelrec")),
+    "iterHitAngleMulti": lambda a, tmp: list(a.iterHitAngleMulti(["truth", "rate"])),
+}
+
+RATE_CALLS = {
+    "tileHitRate":        lambda r: r.tileHitRate(),
+    "tileHitRateHID":     lambda r: r.tileHitRateHID(),
+    "fillBinnedHID":      lambda r: r.fillBinnedHID(),
+    "iterTileHitRateHID": lambda r: list(r.iterTileHitRateHID()),
+}
+
+
+def _progress_lines(output):
+    return [line.strip() for line in output.splitlines() if line.strip().endswith("%")]
+
+
+@pytest.mark.parametrize("chunk_size", [0, 70])
+@pytest.mark.parametrize("method", sorted(ANGLE_CALLS))
+def test_angle_analyses_finish_progress(sorted_file, tmp_path, capsys, method, chunk_size):
+    pg.set_reporter(None)
+    ANGLE_CALLS[method](melp.TileHitAngle(sorted_file, str(tmp_path / "out"), chunk_size=chunk_size), tmp_path)
+
+    lines = _progress_lines(capsys.readouterr().out)
+    assert lines[-1] == "100%" and lines.count("100%") == 1
+
+
+@pytest.mark.parametrize("chunk_size", [0, 70])
+@pytest.mark.parametrize("method", sorted(RATE_CALLS))
+def test_rate_analyses_finish_progress(sorted_file, tmp_path, capsys, method, chunk_size):
+    pg.set_reporter(None)
+    RATE_CALLS[method](melp.TileHitRate(sorted_file, str(tmp_path / "z"), str(tmp_path / "edep"), chunk_size=chunk_size))
+
+    lines = _progress_lines(capsys.readouterr().out)
+    assert lines[-1] == "100%" and lines.count("100%") == 1
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+# importing melp imports ROOT
+pytest.importorskip("ROOT")
+
+from melp.libs import results as rs
+
+
+def _angle_result(z):
+    return rs.AngleResult("out", "norm", "Truthall", "primary", np.array(z), np.array(z) * 2, np.arange(len(z)), counters={"frames": 10})
+
+
+def _rate_result(z):
+    z = {name: np.array(z) for name in rs.RateResult.names}
+
+    return rs.RateResult("out", "outedep", z, z, counters={"frames": 10})
+
+
+def test_result_set_concatenate():
+    sets   = [rs.ResultSet({"angle": _angle_result([1., 2.]), "rate": _rate_result([3.])}, {"frames": 10}),
+              rs.ResultSet({"angle": _angle_result([4.]), "rate": _rate_result([5., 6.])}, {"frames": 5})]
+    merged = rs.ResultSet.concatenate(sets)
+
+    assert np.array_equal(merged.results["angle"].z, [1., 2., 4.])
+    assert np.array_equal(merged.results["rate"].z["total"], [3., 5., 6.])
+    assert merged.counters == {"frames": 15}
+    assert len(merged) == 6
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("ROOT")
+
+import melp
+
+
+def test_multi_keeps_rec_and_pixelrec_apart(sorted_file, tmp_path):
+    calls   = melp.TileHitAngle(sorted_file, str(tmp_path / "out"))
+    calls.hitAngleMulti([("rec", "phi"), ("pixelrec", "phi")])
+    results = calls.getAngleResults()
+
+    rec, pixelrec = results[("rec", "phi", "primary", "all")], results[("pixelrec", "phi", "primary", "all")]
+    assert rec.name() == str(tmp_path / "out") + "phiSensorMatchingnearestprimary"
+    assert pixelrec.name() == str(tmp_path / "out") + "phiPixelSensorMatchingnearestprimary"
+
+    # both are saved, with the results of the single methods
+    for result in results.values():
+        result.saveNpz()
+    single = melp.TileHitAngle(sorted_file, "x").hitAnglePixelRec(angle="phi")
+    assert np.array_equal(np.load(pixelrec.name() + ".npz")["angle"], single[1])
+    single = melp.TileHitAngle(sorted_file, "x").hitAngleRec(angle="phi")
+    assert np.array_equal(np.load(rec.name() + ".npz")["angle"], single[1])
+
+
+@pytest.mark.parametrize("angle", ["norm", "theta", "phi"])
+def test_set_angle_switches_result(sorted_file, angle):
+    calls = melp.TileHitAngle(sorted_file, "out")
+    calls.hitAngleRec(angle="norm")
+
+    z, angles, tile_ids = calls.setAngle(angle)
+    assert calls.angle == angle
+    # recomputed from the stored (float32) hit vectors
+    assert np.allclose(angles, melp.TileHitAngle(sorted_file, "out").hitAngleRec(angle=angle)[1], atol=1e-4)
+
+
+@pytest.mark.parametrize("angle", ["all", ["norm", "phi"], "eta"])
+def test_set_angle_rejects_other_angles(sorted_file, angle):
+    calls = melp.TileHitAngle(sorted_file, "out")
+    calls.hitAngleRec(angle="norm")
+
+    with pytest.raises(ValueError):
+        calls.setAngle(angle)
+    assert calls.angle == "norm"